@@ -343,8 +343,8 @@ class NameTokenizer(SourceCodeTokenizer):
     tokenize to return only the class names from the source file
     '''
 
-    def __init__(self, srcfile, lang):
-        super(NameTokenizer, self).__init__(srcfile, lang=lang)
+    def __init__(self, srcfile, lang, options=None):
+        super(NameTokenizer, self).__init__(srcfile, lang=lang, options=options)
 
     def ignore_token(self, srctoken):
         ignore = False
@@ -562,7 +562,7 @@ class ClassCoOccurMatrix(TCApp):
         # create a list of classnames and keep it in classnames set
         names = set()
 
-        tokenizer = NameTokenizer(srcfile, self.lang)
+        tokenizer = NameTokenizer(srcfile, self.lang, self.tokenizer_options)
 
         for srctoken in tokenizer:
             value = srctoken.value.strip()
@@ -16,16 +16,19 @@ import string
 import os
 import datetime
 import json
+import multiprocessing
+from itertools import islice
 from optparse import OptionParser
 
-from pygments import highlight
 from pygments.formatters import HtmlFormatter
 
 from .tctoolkitutil import *
 from .thirdparty.templet import *
 from .codedupdetect import CodeDupDetect
+from .codedupdetect.highlightcache import HighlightCache, highlight_source
 #from exceptions import ImportError
 
+HIGHLIGHT_BATCH = 32  # number of matches highlighted together (per worker process)
 
 class HtmlWriter(object):
 
@@ -33,9 +36,14 @@ class HtmlWriter(object):
     class to output the duplication information in html format
     '''
 
-    def __init__(self, cddapp):
+    def __init__(self, cddapp, jobs=1, usecache=True):
         self.cddapp = cddapp
         self.formatter = HtmlFormatter(encoding='utf-8')
+        self.jobs = jobs  # number of worker processes used for syntax highlighting
+        self.usecache = usecache  # save the highlighted sources beside the report
+        self.highlightcache = HighlightCache()
+        self.highlightkeys = set()  # cache keys of the matches written in the report
+        self.pool = None
 
     def getCssStyle(self):
         return self.formatter.get_style_defs('.highlight')
@@ -44,15 +52,76 @@ class HtmlWriter(object):
         return self.cddapp.getMatches()
 
     def write(self, fname, blameflag=False):
+        '''
+        write the report. Report is written in parts (one part per match), hence the complete
+        html page is never created in memory. Sources of the matches are highlighted in batches
+        while the report is written.
+        '''
         self.blameflag = blameflag
         fname = make_uncpath(fname)
-        with codecs.open(fname, "wb", encoding='utf-8', errors='ignore') as outf:
-            outf.write(self.output())
+        cachefile = HighlightCache.get_cache_file(fname)
+        if self.usecache:
+            self.highlightcache = HighlightCache.load(cachefile)
+        self.highlightkeys = set()
+        if self.jobs > 1:
+            self.pool = multiprocessing.Pool(self.jobs)
+        try:
+            with codecs.open(fname, "wb", encoding='utf-8', errors='ignore') as outf:
+                for part in self.iterOutput():
+                    outf.write(part)
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+        if self.usecache:
+            # entries of the matches not in this report are removed.
+            self.highlightcache.save(cachefile, self.highlightkeys)
+
+    def output(self):
+        return ''.join(self.iterOutput())
+
+    def iterOutput(self):
+        '''
+        generate the html report in parts. Matches are iterated twice (for the links and for
+        the match sections).
+        '''
+        yield self.outputHeader()
+        for i, match in enumerate(self.getMatches()):
+            yield self.getMatchLink(i, match)
+        yield self.outputMatchesStart()
+        batchsize = HIGHLIGHT_BATCH * max(1, self.jobs)
+        matches = iter(self.getMatches())
+        start = 0
+        while True:
+            batch = list(islice(matches, batchsize))
+            if not batch:
+                break
+            self.highlightMatches(batch)
+            for i, match in enumerate(batch, start):
+                yield self.getMatchHtml(i, match)
+            if not self.usecache:
+                # highlighted sources are not saved, hence they are not kept after writing.
+                self.highlightcache = HighlightCache()
+            start = start + len(batch)
+        yield self.outputFooter()
+        yield self.outputCooccurenceMatrix()
+        yield 'var dupData = '
+        for chunk in json.JSONEncoder(ensure_ascii=False).iterencode(self.getCooccuranceDict()):
+            yield chunk
+        yield ';\n'
+        yield self.outputEnd()
 
     def getCooccuranceData(self):
         '''
         create a co-occurance data in JSON format.
         '''
+        return json.dumps(self.getCooccuranceDict(), ensure_ascii=False)
+
+    def getCooccuranceDict(self):
+        '''
+        create a co-occurance data as dictionary of groups, nodes and links lists.
+        '''
         groups, nodes, links = self.cddapp.getCooccuranceData()
         nodelist = [None] * len(nodes)
         linklist = list()
@@ -74,8 +143,7 @@ class HtmlWriter(object):
             linklist.append(
                 {'source': nodes[source], 'target': nodes[target], 'value': value})
 
-        #return json.dumps({'groups': grouplist, 'nodes': nodelist, 'links': linklist}, ensure_ascii=False, encoding='utf-8')
-        return json.dumps({'groups': grouplist, 'nodes': nodelist, 'links': linklist}, ensure_ascii=False)
+        return {'groups': grouplist, 'nodes': nodelist, 'links': linklist}
 
     @unicodefunction
     def outputCooccurenceMatrix(self):
@@ -265,14 +333,13 @@ class HtmlWriter(object):
             };
 
             //duplication co-occurance data
-            var dupData = ${self.getCooccuranceData()};
-            drawCooccurrence(dupData);
         '''
         # duplication co-occurance matrix data.
         # similar to http://bost.ocks.org/mike/miserables/
+        # data (var dupData) is written separately by 'iterOutput' function
 
     @unicodefunction
-    def output(self):
+    def outputHeader(self):
         '''<!DOCTYPE html>
         <html>
             <head>
@@ -312,11 +379,19 @@ class HtmlWriter(object):
             </head>
             <body>
                 <div>
-                 ${[self.getMatchLink(i, match) for i, match in enumerate(self.getMatches())]}
+        '''
+
+    @unicodefunction
+    def outputMatchesStart(self):
+        '''
                 </div>
                 <div style="margin-top:10px">Goto <a href="#dup_co_ocm">Duplication Cooccurance Matrix</a></div>
                 <div style="margin-top:10px">
-                    ${[self.getMatchHtml(i, match) for i, match in enumerate(self.getMatches())]}
+        '''
+
+    @unicodefunction
+    def outputFooter(self):
+        '''
                 </div>
                 <div id="dup_co_ocm">
                     <h1>Duplication Cooccurance Matrix</h1>
@@ -325,7 +400,12 @@ class HtmlWriter(object):
                 </div>
             </body>
             <script>
-            ${self.outputCooccurenceMatrix()}
+        '''
+
+    @unicodefunction
+    def outputEnd(self):
+        '''
+            drawCooccurrence(dupData);
             </script>
         </html>
         '''
@@ -364,12 +444,37 @@ class HtmlWriter(object):
             <li>${match.srcfile()}:${match.getStartLine()}-${match.getStartLine()+match.getLineCount()}: In Revision ${match.getRevisionNumber()} by ${match.getAuthorName()}:</li>
         '''
 
+    def highlightMatches(self, matches):
+        '''
+        highlight the sources of the matches which are not in the highlight cache. Identical
+        sources are highlighted only once. Sources are highlighted in the worker process pool
+        (if the report is written with more than one job). Returns the set of cache keys of
+        the matches.
+        '''
+        keys = set()
+        pending = dict()  # cache key -> (lexer, source code)
+        for matchset in matches:
+            lexer = matchset.getSourceLexer()
+            source_code = ''.join(matchset.getMatchSource())
+            key = self.highlightcache.get_key(lexer, source_code)
+            keys.add(key)
+            if key not in self.highlightcache and key not in pending:
+                pending[key] = (lexer, source_code)
+        self.highlightkeys.update(keys)
+
+        if self.pool is not None and len(pending) > 1:
+            chunksize = max(1, min(16, len(pending) // (self.jobs * 4)))
+            results = self.pool.imap(highlight_source, pending.values(), chunksize)
+            for key, highlighted in zip(list(pending.keys()), results):
+                self.highlightcache.add(key, highlighted)
+        else:
+            for key, lexer_source in pending.items():
+                self.highlightcache.add(key, highlight_source(lexer_source))
+        return keys
+
     def getSyntaxHighlightedSource(self, matchset):
         source_code = ''.join(matchset.getMatchSource())
-        highlighted = highlight(source_code, matchset.getSourceLexer(), self.formatter, outfile=None)
-        #out of 'highlight' function is string, encoded with 'self.formatter.encoding'. Hence we have to
-        #decode it with appropriate encoding and then covert it to unicode.
-        return str(highlighted.decode(self.formatter.encoding))
+        return self.highlightcache.get(matchset.getSourceLexer(), source_code)
 
     def getD3JS(self):
         jsdir = getJsDirPath()
@@ -423,7 +528,8 @@ class CDDApp(TCApp):
 
         if self.options.format.lower() == 'html':
             # self.cdd.html_output(self.options.filename)
-            htmlwriter = HtmlWriter(self)
+            htmlwriter = HtmlWriter(self, jobs=self.options.jobs,
+                                    usecache=not self.options.no_highlight_cache)
             htmlwriter.write(self.outfile, self.options.blame)
 
         else:
@@ -435,21 +541,24 @@ class CDDApp(TCApp):
 
     def printDuplicates(self, filename):
         with FileOrStdout(filename) as output:
-            exactmatch = self.cdd.printmatches(output)
+            exactmatch = self.cdd.printmatches(output, self.options.top)
             tm2 = datetime.datetime.now()
 
     def foundMatches(self):
         '''
         return true if there is atleast one match found.
         '''
-        matches = self.getMatches()
-        return(len(matches) > 0)
+        return next(iter(self.getMatches()), None) is not None
 
     def getMatches(self):
+        '''
+        return the match sets of the report. Without --top, match sets are iterated lazily
+        from the match store (every call returns a new iterator).
+        '''
+        if not self.options.top:
+            return self.cdd.reportmatches()
         if(self.matches == None):
-            exactmatches = self.cdd.findcopies()
-            self.matches = sorted(
-                exactmatches, reverse=True, key=lambda x: x.matchedlines)
+            self.matches = self.cdd.reportmatches(self.options.top)
         return(self.matches)
 
     def getCooccuranceData(self):
@@ -458,7 +567,28 @@ class CDDApp(TCApp):
     def getCDDInstance(self):
         filelist = self.getFileList(self.args[0], exclude_dirs=self.exclude)
         return CodeDupDetect(filelist, self.options.chunk, fuzzy=self.options.fuzzy,
-                             min_lines=self.options.min_lines, blameflag=self.options.blame)
+                             min_lines=self.options.min_lines, blameflag=self.options.blame,
+                             jobs=self.options.jobs, engine=self.options.engine,
+                             cachedir=self.options.cache_dir,
+                             cachesize=self.options.cache_size * 1024 * 1024,
+                             indexfile=self.options.index, changedfiles=self.getChangedFiles(),
+                             tokentable=self.options.token_table, prefilter=self.options.prefilter,
+                             partitions=self.options.partitions, spilldir=self.options.spill_dir,
+                             similarity=self.options.similarity, rootdir=self.dirname,
+                             tokenizer_options=self.tokenizer_options)
+
+    def getChangedFiles(self):
+        '''
+        read the list of changed files (one file per line, e.g. output of 'git diff --name-only')
+        '''
+        if not self.options.changed:
+            return None
+        if self.options.changed == '-':
+            lines = sys.stdin.readlines()
+        else:
+            with codecs.open(self.options.changed, "rb", encoding='utf-8', errors='ignore') as changed:
+                lines = changed.readlines()
+        return [line.strip() for line in lines if line.strip()]
 
 
 def RunMain():
@@ -471,7 +601,7 @@ def RunMain():
 def createOptionParser():
     usage = "usage: %prog [options] <directory name>"
     description = """Code Duplication Detector. (C) Nitin Bhide nitinbhide@thinkingcraftsman.in
-    Uses RabinKarp algorithm for finding exact duplicates. Fuzzy duplication detection support is
+    Uses RabinKarp algorithm (or suffix array) for finding exact duplicates. Fuzzy duplication detection support is
     experimental.
     """
     parser = OptionParser(usage, description=description)
@@ -490,6 +620,33 @@ def createOptionParser():
                       help="Enable fuzzy matching (ignore variable names, function names etc).")
     parser.add_option("-b", "--blame", dest="blame", default=False, action="store_true",
                       help="Enable svn blame information output in reports.")
+    parser.add_option("-j", "--jobs", dest="jobs", default=1, type="int",
+                      help="Number of worker processes used for tokenizing the files (and highlighting the html report). Default is 1")
+    parser.add_option("-e", "--engine", dest="engine", default='rabinkarp', type="choice",
+                      choices=['rabinkarp', 'suffix', 'sharded', 'minhash', 'function'],
+                      help="Duplicate detection engine. Supported : rabinkarp, suffix (suffix array), sharded (map/reduce over file shards), minhash (near-miss clones), function (duplicate functions, with --fuzzy also the functions differing only in names and literals). Default is rabinkarp")
+    parser.add_option("", "--similarity", dest="similarity", default=0.8, type="float",
+                      help="Minimum similarity (0 to 1) of the near-miss clones found by minhash engine. Blocks of '--minimum' tokens are compared. Default is 0.8")
+    parser.add_option("", "--partitions", dest="partitions", default=16, type="int",
+                      help="Number of hash range partitions (reducers) used by the sharded engine. Default is 16")
+    parser.add_option("", "--spill-dir", dest="spill_dir", default=None,
+                      help="Directory for the spill files of the sharded engine. Temporary directory is used if not specified.")
+    parser.add_option("", "--cache-dir", dest="cache_dir", default=None,
+                      help="Directory for caching the tokens of the files. Unchanged files are not parsed again.")
+    parser.add_option("", "--cache-size", dest="cache_size", default=1024, type="int",
+                      help="Maximum size of the token cache in MB. Least recently used entries are removed. Default is 1024")
+    parser.add_option("", "--index", dest="index", default=None,
+                      help="Persistent duplication index file. Only the changed files are analyzed if index exists (rabinkarp engine only).")
+    parser.add_option("", "--changed", dest="changed", default=None,
+                      help="File with list of changed files (e.g. output of 'git diff --name-only'). Use '-' for stdin. Requires --index")
+    parser.add_option("", "--token-table", dest="token_table", default=None,
+                      help="File to save the token hash table. Table is loaded in the next run, hence hashes of known tokens are not computed again.")
+    parser.add_option("", "--prefilter", dest="prefilter", default=False, action="store_true",
+                      help="Two pass mode. Hashes seen only once (found using bloom filter) are not stored. Reduces the memory usage (rabinkarp engine only).")
+    parser.add_option("", "--no-highlight-cache", dest="no_highlight_cache", default=False, action="store_true",
+                      help="Do not save the syntax highlighted sources beside the html report (<report>.hlcache) for the next run.")
+    parser.add_option("", "--top", dest="top", default=None, type="int",
+                      help="Report only the given number of largest duplicates (selected using a bounded heap). Default is to report all duplicates in the order they are found")
     parser.add_option("-x", "--exclude", dest="exclude", default='',
                       help="Directories to exclude in analysis")
     parser.add_option("", '--test', action="store_true", dest='runtests',
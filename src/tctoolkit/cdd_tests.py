@@ -6,9 +6,39 @@ TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 Purpose: Tests for cdd
 '''
 import unittest
+import io
 import os
-import cdd
-import code_duplication_extractor as dups_extractor
+import shutil
+import struct
+import tempfile
+import threading
+import numpy
+from pygments.lexers import PythonLexer
+from tctoolkit import cdd
+from tctoolkit.codedupdetect import CodeDupDetect
+from tctoolkit.codedupdetect.tokencache import CACHE_EXTENSION as TOKEN_CACHE_EXTENSION
+from tctoolkit.codedupdetect.functionindex import FunctionIndex, FunctionTokenizer
+from tctoolkit.codedupdetect.tokenizer import Tokenizer
+from tctoolkit.codedupdetect.tokenstore import TokenVocabulary
+from tctoolkit.codedupdetect.matchstore import MatchStore
+from tctoolkit.codedupdetect.intervalindex import IntervalIndex
+from tctoolkit.codedupdetect import rabinkarp
+from tctoolkit.codedupdetect import suffixarray
+from tctoolkit.codedupdetect import sourcelines
+from tctoolkit.codedupdetect.highlightcache import HighlightCache, highlight_source
+from tctoolkit.codedupdetect import minhashdetect
+from tctoolkit.tctoolkitutil import TokenizerOptions, LexerRegistry
+from tctoolkit.tctoolkitutil.bloomfilter import BloomFilter, ScalableBloomFilter
+from tctoolkit.tctoolkitutil.filecontent import FileContentCache, read_source_chunks
+from tctoolkit.tctoolkitutil.filelist import DirFileLister, DirSnapshot, SNAPSHOT_VERSION, make_uncpath
+
+try:
+    import code_duplication_extractor as dups_extractor
+except (ImportError, SyntaxError):
+    # extractor is not ported to python 3 yet
+    dups_extractor = None
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata')
 
 
 def get_default_options():
@@ -27,6 +57,25 @@ def get_default_options():
             self.runtests = False
             self.comments = False
             self.exclude = ''
+            self.jobs = 1
+            self.engine = 'rabinkarp'
+            self.cache_dir = None
+            self.cache_size = 1024
+            self.index = None
+            self.changed = None
+            self.token_table = None
+            self.prefilter = False
+            self.top = None
+            self.no_highlight_cache = False
+            self.partitions = 16
+            self.spill_dir = None
+            self.similarity = 0.8
+            self.tokenizer = 'pygments'
+            self.max_file_size = None
+            self.large_file_policy = 'stream'
+            self.sniff_lexer = False
+            self.scan_threads = 1
+            self.dir_snapshot = None
     return Options()
 
 
@@ -46,6 +95,119 @@ def get_option_parser(lang, srclocation):
     return parser
 
 
+def create_fixture_tree(dirname):
+    '''
+    create a small source tree from the parts of the testdata files. Every duplicate is copied
+    once only, hence all the engines find the same matches. Returns the sorted file list.
+    '''
+    with open(os.path.join(TESTDATA_DIR, 'script_1.py')) as srcfile:
+        lines = srcfile.readlines()
+    with open(os.path.join(TESTDATA_DIR, 'script_2.py')) as srcfile:
+        script2 = srcfile.readlines()
+    os.makedirs(os.path.join(dirname, 'sub'))
+    parts = {'a.py': script2,
+             os.path.join('sub', 'b.py'): lines[:200],
+             os.path.join('sub', 'c.py'): lines[100:260] + lines[1000:1100],
+             'z.py': lines[1050:1200]}
+    for fname, filelines in parts.items():
+        with open(os.path.join(dirname, fname), 'w') as srcfile:
+            srcfile.writelines(filelines)
+    return get_fixture_files(dirname)
+
+
+def create_repetitive_tree(dirname):
+    '''
+    create a source tree with a table of similar rows (i.e. periodic run of tokens) and a
+    duplicate copied in three files. Returns the sorted file list.
+    '''
+    with open(os.path.join(TESTDATA_DIR, 'script_1.py')) as srcfile:
+        lines = srcfile.readlines()
+    rows = ["    (%d, 'name%d', %d.5, None),\n" % (i % 7, i % 7 * 3, i % 7 * 11) for i in range(600)]
+    os.makedirs(dirname)
+    parts = {'table.py': ['TABLE = [\n'] + rows + [']\n'],
+             'x.py': lines[:150],
+             'y.py': lines[300:400] + lines[:150],
+             'z.py': lines[:150] + lines[500:600]}
+    for fname, filelines in parts.items():
+        with open(os.path.join(dirname, fname), 'w') as srcfile:
+            srcfile.writelines(filelines)
+    return get_fixture_files(dirname)
+
+
+def get_fixture_files(dirname):
+    '''
+    return the source files in the order listed by DirFileLister (files of a directory before
+    the files of its subdirectories)
+    '''
+    filelist = list()
+    for root, dirs, files in os.walk(dirname):
+        dirs.sort()
+        filelist.extend(os.path.join(root, fname) for fname in sorted(files) if fname.endswith('.py'))
+    return filelist
+
+
+def get_cache_entries(cachedir):
+    return [fname for root, dirs, files in os.walk(cachedir) for fname in files
+            if fname.endswith(TOKEN_CACHE_EXTENSION)]
+
+
+def find_matches(filelist, **kwargs):
+    '''
+    run the duplication detector and return the matches as sorted list of (matched lines,
+    sorted list of (source file, start line, line count)). Order of match sets and of the matches
+    in a set does not depend on the engine or on the order in which they were found.
+    '''
+    kwargs.setdefault('min_lines', 3)
+    dupdetect = CodeDupDetect(filelist, 100, **kwargs)
+    return sorted((matchset.matchedlines,
+                   sorted((match.srcfile(), match.getStartLine(), match.getLineCount())
+                          for match in matchset))
+                  for matchset in dupdetect.findcopies())
+
+
+class ReportApp(object):
+    '''
+    minimal CDDApp used by the HtmlWriter
+    '''
+
+    def __init__(self, dupdetect, srcdir):
+        self.dupdetect = dupdetect
+        self.srcdir = srcdir
+
+    def getMatches(self):
+        return self.dupdetect.reportmatches()
+
+    def getCooccuranceData(self):
+        return self.dupdetect.getCooccuranceData(self.srcdir)
+
+
+class NoDiagonals(dict):
+    '''
+    'covered' diagonals of RabinKarp which never records a diagonal, hence no pair is skipped
+    '''
+
+    def __setitem__(self, key, value):
+        pass
+
+
+def find_rabinkarp_matches(filelist, skip=True):
+    '''
+    return the matches (like find_matches) of the RabinKarp detector. If 'skip' is False, pairs
+    inside a known match on the same diagonal are compared too. Returns (matches, skipped pairs).
+    '''
+    store = MatchStore(100, False)
+    rk = rabinkarp.RabinKarp(100, 3, store)
+    if not skip:
+        rk.covered = NoDiagonals()
+    for srcfile in filelist:
+        rk.addAllTokens(srcfile)
+    return (sorted((matchset.matchedlines,
+                    sorted((match.srcfile(), match.getStartLine(), match.getLineCount())
+                           for match in matchset))
+                   for matchset in store.iter_matches()), rk.skippedmatches)
+
+
+@unittest.skipIf(dups_extractor is None, "code_duplication_extractor is not importable")
 class TestFixture(unittest.TestCase):
     #[manojp: 22/01/2015]: test for duplicates across files needs to be corrected.
 
@@ -74,5 +236,781 @@ class TestFixture(unittest.TestCase):
         self.assertEqual(expected, dups_analytics['analytics'])
 
 
+class TestEngines(unittest.TestCase):
+    '''
+    options which change only the speed (or memory usage) of the detection must find the same
+    matches as the default (serial, rabinkarp) run.
+    '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        self.filelist = create_fixture_tree(self.srcdir)
+        self.expected = find_matches(self.filelist)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_matches_found(self):
+        self.assertEqual(3, len(self.expected))
+
+    def test_top_matches(self):
+        dupdetect = CodeDupDetect(self.filelist, 100, min_lines=3)
+        largest = sorted((matchedlines for matchedlines, matches in self.expected), reverse=True)
+        self.assertEqual(largest[:2], [matchset.matchedlines for matchset in dupdetect.sortedmatches(2)])
+        output = io.StringIO()
+        dupdetect.printmatches(output, 1)
+        self.assertEqual(1, output.getvalue().count('Match '))
+
+    def test_report_matches(self):
+        # without a top-k limit, match sets are iterated lazily from the match store
+        dupdetect = CodeDupDetect(self.filelist, 100, min_lines=3)
+        self.assertNotIsInstance(dupdetect.reportmatches(), list)
+        output = io.StringIO()
+        dupdetect.printmatches(output)
+        self.assertEqual(len(self.expected), output.getvalue().count('Match '))
+
+        report = os.path.join(self.tmpdir, 'report.html')
+        cdd.HtmlWriter(ReportApp(dupdetect, self.srcdir), usecache=False).write(report)
+        with open(report) as reportf:
+            html = reportf.read()
+        for i in range(len(self.expected)):
+            self.assertIn('<a href="#match_%d">' % i, html)
+            self.assertIn('<div id="match_%d">' % i, html)
+
+    def test_parallel_jobs(self):
+        self.assertEqual(self.expected, find_matches(self.filelist, jobs=2))
+
+    def test_tokenizer_options(self):
+        # only the start of sub/c.py is tokenized, hence its match with z.py is not found.
+        # Options are given to the tokenizers in the worker processes too.
+        options = TokenizerOptions(max_file_size=6400, large_file_policy='sample')
+        expected = find_matches(self.filelist, tokenizer_options=options)
+        self.assertEqual(2, len(expected))
+        self.assertEqual(expected, find_matches(self.filelist, jobs=2, tokenizer_options=options))
+        for engine in ['suffix', 'sharded', 'function']:
+            self.assertEqual(find_matches(self.filelist, engine=engine, tokenizer_options=options),
+                             find_matches(self.filelist, engine=engine, jobs=2,
+                                          tokenizer_options=options))
+
+    def test_fast_tokenizer(self):
+        # fast lexers emit the same tokens as Pygments, hence the matches are same
+        options = TokenizerOptions('fast')
+        self.assertEqual(self.expected, find_matches(self.filelist, tokenizer_options=options))
+        srcdir = os.path.dirname(os.path.abspath(__file__))
+        filelist = [os.path.join(srcdir, fname) for fname in sorted(os.listdir(srcdir))
+                    if fname.endswith('.py')]
+        for kwargs in [dict(), dict(fuzzy=True), dict(engine='function')]:
+            self.assertEqual(find_matches(filelist, **kwargs),
+                             find_matches(filelist, tokenizer_options=options, **kwargs))
+
+    def test_sniff_lexer(self):
+        # language of a file without extension is guessed only if it is asked for
+        script = os.path.join(self.srcdir, 'script')
+        shutil.copyfile(os.path.join(self.srcdir, 'a.py'), script)
+        filelist = self.filelist + [script]
+        self.assertEqual(self.expected, find_matches(filelist))
+        sniffed = find_matches(filelist, tokenizer_options=TokenizerOptions(sniff=True))
+        self.assertIn(script, [srcfile for lines, matches in sniffed for srcfile, start, count in matches])
+
+    def test_token_cache(self):
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        # first run fills the cache, second run loads all the files from it
+        self.assertEqual(self.expected, find_matches(self.filelist, cachedir=cachedir))
+        self.assertEqual(len(self.filelist), len(get_cache_entries(cachedir)))
+        self.assertEqual(self.expected, find_matches(self.filelist, cachedir=cachedir))
+
+    def test_token_table(self):
+        tokentable = os.path.join(self.tmpdir, 'tokens.table')
+        # first run saves the token hash table, second run loads it
+        self.assertEqual(self.expected, find_matches(self.filelist, tokentable=tokentable))
+        self.assertTrue(os.path.exists(tokentable))
+        self.assertEqual(self.expected, find_matches(self.filelist, tokentable=tokentable))
+
+    def test_duplication_index(self):
+        indexfile = os.path.join(self.tmpdir, 'cdd.index')
+        with open(os.path.join(self.srcdir, 'a.py')) as srcfile:
+            lines = srcfile.readlines()
+        # rabinkarp matches depend on the order in which the files are added. z.py is the
+        # second file in the file list but the last one in the sorted order.
+        with open(os.path.join(self.srcdir, 'z.py'), 'a') as srcfile:
+            srcfile.writelines(lines)
+        expected = find_matches(self.filelist)
+        # index built from scratch finds the same matches as the run without index
+        self.assertEqual(expected, find_matches(self.filelist, indexfile=indexfile))
+        self.assertEqual(expected, find_matches(self.filelist, indexfile=indexfile))
+
+        # copy a duplicate in the last file. Changed file is listed relative to the working
+        # copy (like 'git diff --name-only') while the 'src' subdirectory is scanned.
+        os.makedirs(os.path.join(self.tmpdir, '.git'))
+        with open(os.path.join(self.srcdir, 'sub', 'c.py'), 'a') as srcfile:
+            srcfile.writelines(lines)
+        changed = find_matches(self.filelist)
+        self.assertNotEqual(expected, changed)
+        self.assertEqual(changed, find_matches(self.filelist, indexfile=indexfile,
+                                               changedfiles=['src/sub/c.py', 'src/missing.py'],
+                                               rootdir=self.srcdir))
+        # index saved after the incremental update is same as a fresh index
+        self.assertEqual(changed, find_matches(self.filelist, indexfile=indexfile))
+
+    def test_duplication_index_middle_file(self):
+        indexfile = os.path.join(self.tmpdir, 'cdd.index')
+        self.assertEqual(self.expected, find_matches(self.filelist, indexfile=indexfile))
+        with open(os.path.join(TESTDATA_DIR, 'script_1.py')) as srcfile:
+            lines = srcfile.readlines()
+        bfile = os.path.join(self.srcdir, 'sub', 'b.py')
+        with open(bfile) as srcfile:
+            blines = srcfile.readlines()
+        zfile = os.path.join(self.srcdir, 'z.py')
+        with open(zfile) as srcfile:
+            zlines = srcfile.readlines()
+
+        # files in the middle of the file list are changed. Matches of the later files
+        # depend on them.
+        edits = [(bfile, blines[:49] + lines[345:439] + blines[49:109] + lines[1062:1152] + blines[109:]),
+                 (zfile, zlines[:60]), (bfile, blines + zlines[:60])]
+        for fname, filelines in edits:
+            with open(fname, 'w') as srcfile:
+                srcfile.writelines(filelines)
+            expected = find_matches(self.filelist)
+            self.assertEqual(expected, find_matches(self.filelist, indexfile=indexfile,
+                                                    changedfiles=[fname]))
+            self.assertEqual(expected, find_matches(self.filelist, indexfile=indexfile))
+
+        # deleted file in the middle of the file list
+        os.remove(zfile)
+        filelist = [srcfile for srcfile in self.filelist if srcfile != zfile]
+        self.assertEqual(find_matches(filelist), find_matches(filelist, indexfile=indexfile))
+
+    def test_covered_diagonals(self):
+        matches, skipped = find_rabinkarp_matches(self.filelist)
+        self.assertEqual(self.expected, matches)
+        self.assertEqual((matches, 0), find_rabinkarp_matches(self.filelist, skip=False))
+
+    def test_prefilter(self):
+        self.assertEqual(self.expected, find_matches(self.filelist, prefilter=True))
+        # second pass loads the tokens stored in the cache by the first pass
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        self.assertEqual(self.expected, find_matches(self.filelist, prefilter=True, jobs=2,
+                                                     cachedir=cachedir))
+        self.assertEqual(len(self.filelist), len(get_cache_entries(cachedir)))
+
+    def test_suffix_engine(self):
+        self.assertEqual(self.expected, find_matches(self.filelist, engine='suffix'))
+
+    def test_sharded_engine(self):
+        spilldir = os.path.join(self.tmpdir, 'spill')
+        self.assertEqual(self.expected, find_matches(self.filelist, engine='sharded', partitions=4,
+                                                     spilldir=spilldir))
+        self.assertEqual(self.expected, find_matches(self.filelist, engine='sharded', jobs=2))
+
+    def test_match_keys(self):
+        # exact engines use the same (start window hash, matchlen) match keys
+        keys = list()
+        for engine in ['rabinkarp', 'suffix', 'sharded']:
+            dupdetect = CodeDupDetect(self.filelist, 100, min_lines=3, engine=engine)
+            dupdetect.findcopies()
+            keys.append(sorted(dupdetect.matchstore.matchlist))
+        self.assertEqual([keys[0]] * 3, keys)
+
+
+class TestRepetitiveInput(unittest.TestCase):
+    '''
+    engines must report a periodic run or a duplicate with many copies as one match set
+    '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        self.filelist = create_repetitive_tree(os.path.join(self.tmpdir, 'src'))
+        self.expected = find_matches(self.filelist)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_match_sets(self):
+        self.assertEqual([2, 3], sorted(len(matches) for matchedlines, matches in self.expected))
+
+    def test_covered_diagonals(self):
+        # periodic run has matches on many diagonals of the same file
+        matches, skipped = find_rabinkarp_matches(self.filelist)
+        self.assertEqual(self.expected, matches)
+        self.assertEqual((matches, 0), find_rabinkarp_matches(self.filelist, skip=False))
+
+    def test_suffix_engine(self):
+        self.assertEqual(self.expected, find_matches(self.filelist, engine='suffix'))
+
+    def test_sharded_engine(self):
+        spilldir = os.path.join(self.tmpdir, 'spill')
+        self.assertEqual(self.expected, find_matches(self.filelist, engine='sharded', partitions=4,
+                                                     spilldir=spilldir))
+        # spill files and the temporary token cache are removed
+        self.assertEqual([], os.listdir(spilldir))
+        self.assertEqual(self.expected, find_matches(self.filelist, engine='sharded', jobs=2))
+
+    def test_minhash_engine(self):
+        # minhash regions are aligned to blocks, hence compare only the matched files of the sets
+        def matched_files(matchsets):
+            return set(tuple(sorted(os.path.basename(srcfile) for srcfile, start, length in matches))
+                       for matchedlines, matches in matchsets)
+
+        matchsets = find_matches(self.filelist, engine='minhash')
+        self.assertTrue(matched_files(self.expected) <= matched_files(matchsets))
+        # periodic run is one set of two halves
+        self.assertEqual(1, sum(1 for matchedlines, matches in matchsets
+                                if os.path.basename(matches[0][0]) == 'table.py'))
+
+
+class TestMinHash(unittest.TestCase):
+
+    def test_helpers(self):
+        self.assertEqual((16, 4), minhashdetect.lsh_bands(64, 0.5))
+        self.assertEqual(0.5, minhashdetect.jaccard(set([1, 2, 3]), set([2, 3, 4])))
+        self.assertEqual(minhashdetect.permutations(4), minhashdetect.permutations(4))
+
+
+class TestDirFileLister(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        os.makedirs(os.path.join(self.tmpdir, 'src', 'sub'))
+        os.makedirs(os.path.join(self.tmpdir, '.git'))
+        for fname in ['a.py', 'src/b.py', 'src/sub/c.c', '.git/d.py']:
+            open(os.path.join(self.tmpdir, fname), 'w').close()
+        self.snapshotfile = os.path.join(self.tmpdir, 'dirs.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def relpaths(self, files):
+        return [os.path.relpath(fname, self.tmpdir) for fname in files]
+
+    def test_snapshot(self):
+        lister = DirFileLister(self.tmpdir, threads=4, snapshotfile=self.snapshotfile)
+        self.assertEqual(['a.py', os.path.join('src', 'b.py')],
+                         self.relpaths(lister.getMatchingFiles('*.py')))
+        snapshot = DirSnapshot.load(self.snapshotfile)
+        self.assertEqual(3, len(snapshot))
+        srcdir = make_uncpath(os.path.join(self.tmpdir, 'src'))
+        mtime, dirs, files = snapshot.entries[srcdir]
+        self.assertEqual((['sub'], ['b.py']), (dirs, files))
+
+        # entry of an unchanged directory is loaded from the snapshot
+        snapshot.update(srcdir, (mtime, dirs, files + ['cached.py']))
+        snapshot.save(self.snapshotfile)
+        self.assertIn(os.path.join('src', 'cached.py'),
+                      self.relpaths(lister.getMatchingFiles('*.py')))
+        # new file in a directory is found even if the snapshot is used
+        open(os.path.join(self.tmpdir, 'src', 'sub', 'e.py'), 'w').close()
+        self.assertIn(os.path.join('src', 'sub', 'e.py'),
+                      self.relpaths(lister.getMatchingFiles(['*.py', '*.c'])))
+
+    def test_invalid_snapshot(self):
+        lister = DirFileLister(self.tmpdir, snapshotfile=self.snapshotfile)
+        expected = lister.getMatchingFiles('*.py')
+        with open(self.snapshotfile, 'rb') as snapf:
+            data = snapf.read()
+        # corrupted snapshot or snapshot of a different version is not used
+        version = struct.pack('<I', SNAPSHOT_VERSION + 1)
+        for baddata in [data[:-1], data[:4] + version + data[8:], b'']:
+            with open(self.snapshotfile, 'wb') as snapf:
+                snapf.write(baddata)
+            self.assertEqual(0, len(DirSnapshot.load(self.snapshotfile)))
+            self.assertEqual(expected, lister.getMatchingFiles('*.py'))
+            # snapshot is saved again
+            self.assertEqual(3, len(DirSnapshot.load(self.snapshotfile)))
+
+
+class TestHighlight(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        self.filelist = create_fixture_tree(self.srcdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_highlight_cache(self):
+        lexer = PythonLexer()
+        source = 'def f(x):\n    return x\n'
+        cache = HighlightCache()
+        highlighted = cache.get(lexer, source)
+        self.assertEqual(highlighted, highlight_source((lexer, source)))
+        self.assertIs(highlighted, cache.get(lexer, source))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        cache.get(lexer, 'x = 1\n')
+
+        # only the given keys are saved
+        cachefile = HighlightCache.get_cache_file(os.path.join(self.tmpdir, 'report.html'))
+        cache.save(cachefile, [HighlightCache.get_key(lexer, source)])
+        loaded = HighlightCache.load(cachefile)
+        self.assertEqual(1, len(loaded))
+        self.assertEqual(highlighted, loaded.get(lexer, source))
+        self.assertEqual((1, 0), (loaded.hits, loaded.misses))
+
+        with open(cachefile, 'wb') as cachef:
+            cachef.write(b'not a cache')
+        self.assertEqual(0, len(HighlightCache.load(cachefile)))
+        self.assertEqual(0, len(HighlightCache.load(os.path.join(self.tmpdir, 'missing'))))
+
+    def test_report_cache(self):
+        dupdetect = CodeDupDetect(self.filelist, 100, min_lines=3)
+        app = ReportApp(dupdetect, self.srcdir)
+        reports = list()
+        for jobs, usecache in [(1, False), (2, False), (1, True), (1, True)]:
+            report = os.path.join(self.tmpdir, 'report.html')
+            writer = cdd.HtmlWriter(app, jobs=jobs, usecache=usecache)
+            writer.write(report)
+            with open(report) as reportf:
+                reports.append(reportf.read())
+            cachefile = HighlightCache.get_cache_file(report)
+            self.assertEqual(usecache, os.path.exists(cachefile))
+        # sources highlighted in the worker processes or loaded from the cache are same
+        self.assertEqual([reports[0]] * 4, reports)
+        # cache has the sources of the matches in the report only
+        self.assertEqual(writer.highlightkeys, set(HighlightCache.load(cachefile).entries))
+        self.assertEqual(len(dupdetect.sortedmatches()), writer.highlightcache.hits)
+
+
+class TestFileContentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        self.srcfile = os.path.join(self.tmpdir, 'a.c')
+        with open(self.srcfile, 'wb') as srcfile:
+            srcfile.write(b'int a;\r\nchar *s = "\xc3\xa9\xff";\n')
+        self.emptyfile = os.path.join(self.tmpdir, 'empty.c')
+        open(self.emptyfile, 'wb').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_text(self):
+        cache = FileContentCache()
+        # invalid bytes are ignored
+        self.assertEqual('int a;\r\nchar *s = "\u00e9";\n', cache.get_text(self.srcfile))
+        content = cache.get(self.srcfile)
+        self.assertIs(content, cache.get(self.srcfile))
+        self.assertEqual((2, 1), (cache.hits, cache.misses))
+        self.assertEqual('', cache.get_text(self.emptyfile))
+
+        # modified file is read again
+        with open(self.srcfile, 'ab') as srcfile:
+            srcfile.write(b'int b;\n')
+        self.assertTrue(cache.get_text(self.srcfile).endswith('int b;\n'))
+        self.assertEqual(b'', content.data)
+        cache.clear()
+
+    def test_eviction(self):
+        # size limit removes the least recently used file. Removed mapping is not closed since
+        # it may be still in use.
+        cache = FileContentCache(maxbytes=10, maxfiles=2)
+        content = cache.get(self.srcfile)
+        cache.get_text(self.srcfile)
+        cache.get_text(self.emptyfile)
+        self.assertEqual([self.emptyfile], list(cache.contents))
+        self.assertEqual(b'int a;', content.data[:6])
+        content.close()
+
+        cache = FileContentCache(maxfiles=1)
+        cache.get_text(self.srcfile)
+        cache.get_text(self.emptyfile)
+        self.assertEqual(1, len(cache))
+        # invalidated file is closed
+        content = cache.get(self.srcfile)
+        cache.invalidate(self.srcfile)
+        self.assertNotIn(self.srcfile, cache.contents)
+        self.assertEqual(b'', content.data)
+
+    def test_read_source_chunks(self):
+        self.assertEqual('int a;\r\nchar *s = "\u00e9";\n',
+                         ''.join(read_source_chunks(self.srcfile, chunksize=4)))
+        self.assertEqual(['int a;\r\n'], list(read_source_chunks(self.srcfile, chunksize=4, limit=12)))
+        self.assertEqual([], list(read_source_chunks(self.emptyfile)))
+
+
+class TestSourceLines(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_line_offsets(self):
+        self.assertEqual([0], list(sourcelines.line_offsets(b'')))
+        self.assertEqual([0, 3, 5], list(sourcelines.line_offsets(b'ab\ncd')))
+        self.assertEqual([0, 4, 5, 8], list(sourcelines.line_offsets(b'ab\r\n\ncd\n')))
+
+    def test_line_index_cache(self):
+        fname = os.path.join(self.tmpdir, 'a.c')
+        with open(fname, 'wb') as srcfile:
+            srcfile.write('line 0\r\nline 1\nline 2 \u00e9\nline 3'.encode('utf-8'))
+        cache = sourcelines.LineIndexCache(maxfiles=1)
+        index = cache.get(fname)
+        self.assertEqual(4, len(index))
+        self.assertEqual(['line 1\n', 'line 2 \u00e9\n'], index.get_lines(1, 2))
+        self.assertEqual(['line 3'], index.get_lines(3, 5))
+        self.assertEqual(b'line 0\r\n', index.get_bytes(0, 1))
+        self.assertEqual(b'', index.get_bytes(4, 1))
+        self.assertIs(index, cache.get(fname))
+        cache.invalidate(fname)
+        self.assertIsNot(index, cache.get(fname))
+
+        # only 'maxfiles' files are kept open
+        other = os.path.join(self.tmpdir, 'b.c')
+        with open(other, 'wb') as srcfile:
+            srcfile.write(b'x\n')
+        index = cache.get(fname)
+        cache.get(other)
+        self.assertEqual([other], list(cache.indexes))
+        self.assertEqual(0, len(index))
+        cache.clear()
+
+    def test_insert_comments(self):
+        srcdir = os.path.join(self.tmpdir, 'src')
+        filelist = create_fixture_tree(srcdir)
+        dupdetect = CodeDupDetect(filelist, 100, min_lines=3)
+        expected = dict()  # source file -> (start, end) line indices of the matches
+        for matchset in dupdetect.sortedmatches():
+            for match in matchset:
+                start = match.getStartLine()
+                expected.setdefault(match.srcfile(), set()).add((start, start + match.getLineCount()))
+        originals = dict()
+        for srcfile in filelist:
+            with open(srcfile) as srcf:
+                originals[srcfile] = srcf.readlines()
+
+        dupdetect.insert_comments(srcdir)
+        for srcfile in filelist:
+            with open(srcfile) as srcf:
+                lines = srcf.readlines()
+            # comments are inserted before the start and after the end lines of the matches.
+            # Other lines are not changed.
+            begins, ends, source = dict(), dict(), list()
+            for line in lines:
+                if line.startswith('//!DUPLICATE BEGIN'):
+                    begins[line.split()[2]] = len(source)
+                elif line.startswith('//!DUPLICATE END'):
+                    ends[line.split()[2]] = len(source)
+                else:
+                    source.append(line)
+            self.assertEqual(originals[srcfile], source)
+            self.assertEqual(expected.get(srcfile, set()),
+                             set((begin, ends[no]) for no, begin in begins.items()))
+
+
+class TestRollingHash(unittest.TestCase):
+
+    def rolling_hashes(self, values, window_size):
+        rollinghash = rabinkarp.RollingHash(window_size, value_func=lambda value: value,
+                                            vocabulary=TokenVocabulary())
+        hashes = list()
+        for value in values:
+            if len(rollinghash.tokenqueue) > 0:
+                hashes.append(rollinghash.curhash)
+            rollinghash.addToken(value)
+        return hashes
+
+    def test_window_hashes(self):
+        # vectorized hashes are same as the RollingHash hashes, including the files shorter
+        # than the window
+        values = ['tok%d' % (i % 37) for i in range(500)]
+        for numtokens in [0, 1, 2, 5, 12, 500]:
+            tokenhashes = numpy.array([rabinkarp.token_hash(value) for value in values[:numtokens]],
+                                      dtype=numpy.uint32)
+            self.assertEqual(self.rolling_hashes(values[:numtokens], 10),
+                             rabinkarp.window_hashes(tokenhashes, 10).tolist())
+
+    def test_get_hashes(self):
+        tknzr = Tokenizer(os.path.join(TESTDATA_DIR, 'script_1.py'))
+        rk = rabinkarp.RabinKarp(100, 3, MatchStore(100, False))
+        hashes = rk.getHashesVectorized(tknzr)
+        self.assertEqual(len(tknzr.get_token_list()) - 1, len(hashes))
+        self.assertEqual(self.rolling_hashes([token.value for token in tknzr], 100), hashes.tolist())
+
+    def test_without_numpy(self):
+        # matches found with the pure python rolling hash are same as the vectorized version
+        tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        try:
+            filelist = create_fixture_tree(os.path.join(tmpdir, 'src'))
+            expected = find_matches(filelist)
+            rabinkarp.NUMPY_SUPPORT = False
+            try:
+                self.assertEqual(expected, find_matches(filelist))
+            finally:
+                rabinkarp.NUMPY_SUPPORT = True
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestRabinKarp(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        with open(os.path.join(TESTDATA_DIR, 'script_1.py')) as srcfile:
+            lines = srcfile.readlines()
+        self.filelist = [os.path.join(self.tmpdir, fname) for fname in ['a.py', 'b.py']]
+        for fname in self.filelist:
+            with open(fname, 'w') as srcfile:
+                srcfile.writelines(lines[:200])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_covered_diagonal(self):
+        # b.py is a copy of a.py. A window inside the match is a suffix of the match, hence
+        # it is not compared again.
+        for skip in [True, False]:
+            rk = rabinkarp.RabinKarp(100, 3, MatchStore(100, False))
+            if not skip:
+                rk.covered = NoDiagonals()
+            for srcfile in self.filelist:
+                rk.addAllTokens(srcfile)
+            self.assertEqual(1, len(rk.matchstore.matchlist))
+            tokens = rk.getTokanizer(self.filelist[1]).get_token_list()
+            matchlen = rk.findMatches(rk.getWindowHash(tokens, 50), tokens[50])
+            if skip:
+                self.assertEqual((0, 1), (matchlen, rk.skippedmatches))
+            else:
+                self.assertEqual((len(tokens) - 50, 0), (matchlen, rk.skippedmatches))
+                # suffix of the match is nested in it
+                self.assertEqual(1, rk.matchstore.nestedmatches)
+            self.assertEqual(1, len(rk.matchstore.matchlist))
+
+
+class TestTokenVocabulary(unittest.TestCase):
+
+    def test_hash_table(self):
+        vocabulary = TokenVocabulary()
+        values = ['def', 'x', '(', 'def', 'x', ')']
+        hashes = [vocabulary.get_hash(value, rabinkarp.token_hash) for value in values]
+        self.assertEqual([rabinkarp.token_hash(value) for value in values], hashes)
+        # hash of every distinct value is computed once
+        self.assertEqual((2, 4), (vocabulary.hits, vocabulary.misses))
+        table = vocabulary.get_hash_table(rabinkarp.token_hash)
+        self.assertEqual(hashes, [table[vocabulary.intern(value)] for value in values])
+
+        # shared vocabulary gives the same rolling hash as a separate one
+        shared = rabinkarp.RollingHash(3, value_func=lambda value: value, vocabulary=vocabulary)
+        separate = rabinkarp.RollingHash(3, value_func=lambda value: value, vocabulary=TokenVocabulary())
+        for value in values:
+            shared.addToken(value)
+            separate.addToken(value)
+            self.assertEqual(separate.curhash, shared.curhash)
+
+    def test_save_load(self):
+        tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        try:
+            tablefile = os.path.join(tmpdir, 'tokens.table')
+            vocabulary = TokenVocabulary()
+            vocabulary.get_hash_table(rabinkarp.token_hash)
+            for value in ['a', 'b', 'c']:
+                vocabulary.get_hash(value, rabinkarp.token_hash)
+            vocabulary.save(tablefile)
+
+            loaded = TokenVocabulary()
+            self.assertTrue(loaded.load(tablefile))
+            self.assertEqual([rabinkarp.token_hash(value) for value in 'abc'],
+                             [loaded.get_hash(value, rabinkarp.token_hash) for value in 'abc'])
+            self.assertEqual((3, 0), (loaded.hits, loaded.misses))
+
+            # ids are different if some values were added before loading. Hashes are correct.
+            other = TokenVocabulary()
+            other.intern('z')
+            self.assertTrue(other.load(tablefile))
+            self.assertEqual([rabinkarp.token_hash(value) for value in 'zabc'],
+                             [other.get_hash(value, rabinkarp.token_hash) for value in 'zabc'])
+
+            with open(tablefile, 'wb') as tablef:
+                tablef.write(b'XXXX')
+            self.assertFalse(TokenVocabulary().load(tablefile))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestSuffixArray(unittest.TestCase):
+
+    def check_suffix_array(self, text):
+        expected = sorted(range(len(text)), key=lambda i: text[i:])
+        self.assertEqual(expected, list(suffixarray.suffix_array(text)))
+        self.assertEqual(expected, list(suffixarray._suffix_array_python(text)))
+
+    def test_suffix_array(self):
+        self.check_suffix_array([ord(ch) for ch in 'mississippi'])
+        self.check_suffix_array([ord(ch) for ch in 'abababababab'])
+        self.check_suffix_array([1])
+        text = [ord(ch) for ch in 'banana']
+        self.assertEqual([0, 1, 3, 0, 0, 2], list(suffixarray.lcp_array(text, suffixarray.suffix_array(text))))
+
+    def test_supermaximal_repeats(self):
+        # 'abc' occurs thrice. 'xabc' occurs twice and contains two of the three occurrences
+        text = [ord(ch) for ch in 'xabcyxabczabcw']
+        sa = suffixarray.suffix_array(text)
+        lcp = suffixarray.lcp_array(text, sa)
+
+        def prevtoken(i):
+            return text[sa[i] - 1] if sa[i] > 0 else suffixarray.TEXT_START
+
+        repeats = sorted((lcpvalue, sorted(sa[left:right + 1]))
+                         for lcpvalue, left, right in suffixarray.supermaximal_repeats(lcp, prevtoken, 2))
+        self.assertEqual([(3, [1, 6, 10]), (4, [0, 5])], repeats)
+
+
+class TestFunctionIndex(unittest.TestCase):
+
+    SOURCE = '''
+def first(items):
+    total = 0
+    for item in items:
+        total = total + item
+    return total
+
+def second(values):
+    total = 0
+    for value in values:
+        total = total + value
+    return total
+
+def third(items):
+    total = 0
+    for item in items:
+        total = total + item
+    return total
+'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        self.srcfile = os.path.join(self.tmpdir, 'functions.py')
+        with open(self.srcfile, 'w') as srcfile:
+            srcfile.write(self.SOURCE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_duplicate_functions(self):
+        tknzr = FunctionTokenizer(self.srcfile)
+        tknzr.update_token_list()
+        self.assertEqual(['first', 'second', 'third'], [unit.name for unit in tknzr.get_units()])
+        index = FunctionIndex(10, 3, MatchStore(10, False))
+        index.addTokenizer(tknzr)
+        # 'first' and 'third' differ only in the function name
+        self.assertEqual([2], [len(units) for units in index.duplicates()])
+        self.assertEqual([3], [len(units) for units in index.duplicates(fuzzy=True)])
+        self.assertEqual(2, index.findMatches(fuzzy=True))
+
+
+class TestLexerRegistry(unittest.TestCase):
+
+    def test_lookups(self):
+        registry = LexerRegistry()
+        lexer = registry.get_lexer_for_file('test.py')
+        self.assertEqual('Python', lexer.name)
+        self.assertIs(lexer, registry.get_lexer_for_file('other.py'))
+        self.assertIsNone(registry.get_lexer_for_file('test.unknownext'))
+        self.assertIsNone(registry.get_lexer_for_file('test2.unknownext'))
+        self.assertEqual((2, 2), (registry.misses, registry.hits))
+        self.assertIsNone(registry.get_lexer_for_lang('nosuchlanguage'))
+        # every thread gets its own lexer instance
+        lexers = list()
+        thread = threading.Thread(target=lambda: lexers.append(registry.get_lexer_for_file('t.py')))
+        thread.start()
+        thread.join()
+        self.assertIsNot(lexer, lexers[0])
+        self.assertEqual(lexer.options, lexers[0].options)
+
+    def test_file_names(self):
+        # files without extension or matched by name do not share the lookup of their extension,
+        # whatever the lookup order
+        for names in [['README', 'Makefile'], ['Makefile', 'README']]:
+            registry = LexerRegistry()
+            lexers = dict((name, registry.get_lexer_for_file(os.path.join('src', name))) for name in names)
+            self.assertIsNone(lexers['README'])
+            self.assertEqual('Makefile', lexers['Makefile'].name)
+        registry = LexerRegistry()
+        self.assertEqual('Text only', registry.get_lexer_for_file('notes.txt').name)
+        self.assertEqual('CMake', registry.get_lexer_for_file('CMakeLists.txt').name)
+
+    def test_sniff(self):
+        registry = LexerRegistry()
+        self.assertEqual('Python', registry.get_lexer_for_file('script', lambda f: '#!/usr/bin/env python\n').name)
+        self.assertIsNone(registry.get_lexer_for_file('notes', lambda f: 'hello world'))
+        # content of the other files with the same unknown extension is not read
+        self.assertIsNone(registry.get_lexer_for_file('a.notes', lambda f: 'hello world'))
+        self.assertIsNone(registry.get_lexer_for_file('b.notes', lambda f: 1 / 0))
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_scalar_and_bulk_keys(self):
+        # keys added in bulk are found by scalar lookups and vice versa, whatever the integer type
+        for bloom in [BloomFilter(capacity=1000), ScalableBloomFilter(initial_capacity=100)]:
+            bloom.add_many(numpy.array([5, 6, 7], dtype=numpy.uint64))
+            bloom.add(numpy.int64(8))
+            bloom.add(9)
+            for key in [numpy.uint64(5), numpy.int32(6), 7, numpy.uint64(8), numpy.uint64(9)]:
+                self.assertIn(key, bloom)
+            self.assertTrue(all(bloom.contains_many(numpy.array([5, 6, 7, 8, 9], dtype=numpy.uint64))))
+            self.assertTrue(all(bloom.contains_many([8, 9])))
+
+    def test_file_round_trip(self):
+        tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+        try:
+            bloomfile = os.path.join(tmpdir, 'keys.bloom')
+            bloom = BloomFilter(capacity=1000)
+            bloom.add_many(numpy.arange(0, 500, 5, dtype=numpy.uint64))
+            bloom.tofile(bloomfile)
+            for use_mmap in [True, False]:
+                loaded = BloomFilter.fromfile(bloomfile, use_mmap=use_mmap)
+                self.assertEqual(bloom.count, len(loaded))
+                self.assertEqual(bloom.bitarray.bytes, loaded.bitarray.bytes)
+                self.assertTrue(all(loaded.contains_many(numpy.arange(0, 500, 5, dtype=numpy.uint64))))
+                # keys added later are not written to the file
+                loaded.add(1001)
+                self.assertIn(1001, loaded)
+                self.assertEqual(bloom.count, len(BloomFilter.fromfile(bloomfile)))
+
+            with open(bloomfile, 'rb') as bloomf:
+                data = bloomf.read()
+            with open(bloomfile, 'wb') as bloomf:
+                bloomf.write(data[:len(data) // 2])
+            self.assertRaises(ValueError, BloomFilter.fromfile, bloomfile, use_mmap=False)
+            with open(bloomfile, 'wb') as bloomf:
+                bloomf.write(b'XXXX' + data[4:])
+            self.assertRaises(ValueError, BloomFilter.fromfile, bloomfile)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestIntervalIndex(unittest.TestCase):
+
+    def test_containing(self):
+        index = IntervalIndex()
+        index.add(10, 20, 'a')
+        index.add(0, 100, 'b')
+        index.add(30, 40, 'c')
+        self.assertEqual(['a', 'b'], sorted(index.containing(12, 18)))
+        self.assertEqual(['b'], list(index.containing(15, 35)))
+        self.assertTrue(index.remove(0, 100, 'b'))
+        self.assertFalse(index.remove(0, 100, 'b'))
+        self.assertEqual([], list(index.containing(15, 35)))
+        self.assertEqual(2, len(index))
+
+    def test_same_as_linear_scan(self):
+        # one very long interval and many short ones, some with the same start
+        intervals = [(0, 100000, 0)] + [(start, start + start % 7, start) for start in range(1, 3000)]
+        intervals = intervals + [(start, start + 3, -start) for start in range(0, 3000, 5)]
+        index = IntervalIndex()
+        for start, end, value in intervals:
+            index.add(start, end, value)
+        for start, end, value in intervals[::2]:
+            self.assertTrue(index.remove(start, end, value))
+        intervals = intervals[1::2]
+        self.assertEqual(len(intervals), len(index))
+        for start, end in [(5, 6), (100, 102), (2999, 3001), (200000, 200001)]:
+            expected = sorted(value for s, e, value in intervals if s <= start and e >= end)
+            self.assertEqual(expected, sorted(index.containing(start, end)))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -11,3 +11,4 @@ from .tokenizer import Tokenizer
 from .codedupdetect import CodeDupDetect
 from .matchstore import MatchData
 from .rabinkarp import RabinKarp
+from .tokenstore import TokenStore
@@ -13,51 +13,312 @@ TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 
 
 import logging
+import heapq
 import tempfile
 import os
 import shutil
+import multiprocessing
+from functools import partial
 from itertools import tee
 
 from . import matchstore
-from .rabinkarp import RabinKarp
+from .rabinkarp import RabinKarp, tokenize_file
+from .tokenizer import Tokenizer, create_tokenizer
+from .tokenstore import TokenStore, VOCABULARY
+from .suffixarray import SuffixArrayDetector
+from .shardeddetect import ShardedDetector, DEFAULT_PARTITIONS
+from .minhashdetect import MinHashDetector, DEFAULT_SIMILARITY
+from .functionindex import FunctionIndex, FunctionTokenizer, create_function_tokenizer
+from .tokencache import TokenCache, DEFAULT_CACHE_SIZE
+from .dupindex import DuplicationIndex
+from .sourcelines import LINE_INDEXES
+
+# duplicate detection engines supported by CodeDupDetect
+ENGINES = ['rabinkarp', 'suffix', 'sharded', 'minhash', 'function']
 
 
 class CodeDupDetect(object):
 
-    def __init__(self, filelist, chunk=5, fuzzy=False, min_lines=3, blameflag=False):
+    def __init__(self, filelist, chunk=5, fuzzy=False, min_lines=3, blameflag=False, jobs=1,
+                 engine='rabinkarp', cachedir=None, cachesize=DEFAULT_CACHE_SIZE,
+                 indexfile=None, changedfiles=None, tokentable=None, prefilter=False,
+                 partitions=DEFAULT_PARTITIONS, spilldir=None, similarity=DEFAULT_SIMILARITY,
+                 rootdir=None, tokenizer_options=None):
+        assert engine in ENGINES
+        assert indexfile is None or engine == 'rabinkarp', "duplication index requires rabinkarp engine"
         self.chunk = chunk  # minimum number of tokens to be matched.
         self.matchstore = matchstore.MatchStore(chunk, blameflag)
         self.min_lines = min_lines  # minimum number of lines to match
         self.filelist = filelist
         self.foundcopies = False
         self.fuzzy = fuzzy
+        self.jobs = jobs  # number of worker processes used for tokenizing the files
+        self.engine = engine
+        self.cachedir = cachedir  # directory for the token cache. None disables the cache.
+        self.cachesize = cachesize
+        self.indexfile = indexfile  # persistent duplication index for incremental runs
+        self.changedfiles = changedfiles  # changed files since the index was saved (optional)
+        self.rootdir = rootdir  # scanned directory. Relative changed file paths are resolved from it
+        self.tokentable = tokentable  # file to persist the token hash table across runs
+        # two pass mode. Hashes which occur only once are not stored in the matchstore.
+        self.prefilter = prefilter
+        # sharded engine : number of hash range partitions and directory for the spill files
+        self.partitions = partitions
+        self.spilldir = spilldir
+        # minhash engine : minimum (Jaccard) similarity of the near-miss clones
+        self.similarity = similarity
+        # TokenizerOptions given to all tokenizers (including the ones in worker processes)
+        self.tokenizer_options = tokenizer_options
 
     def __find_rk_copies(self):
         '''
         detect exact copies using the RabinKarp algorithm
         '''
+        cachedir = self.cachedir
+        if self.prefilter and not cachedir:
+            # files are read twice in the prefilter mode. Second pass loads the tokens stored
+            # by the first pass in a temporary cache.
+            cachedir = tempfile.mkdtemp(prefix='cdd-')
+        tokencache = None
+        if cachedir:
+            tokencache = TokenCache(cachedir, self.cachesize)
+        rk = RabinKarp(self.chunk, self.min_lines, self.matchstore, self.fuzzy,
+                       tokencache=tokencache, tokenizer_options=self.tokenizer_options)
+
+        try:
+            if self.prefilter:
+                candidates, totalhashes = rk.findCandidates(self.__iter_tokenized(rk, cachedir))
+                print("Prefilter : %d candidate hashes of %d\n" % (len(candidates), totalhashes))
+                self.matchstore.setCandidates(candidates)
+            for tknzr, hashes in self.__iter_tokenized(rk, cachedir):
+                rk.addHashes(tknzr, hashes)
+        finally:
+            if cachedir != self.cachedir:
+                shutil.rmtree(cachedir, ignore_errors=True)
+        print("Total Hashes Stored %d\n" % len(self.matchstore.hashset))
+        if self.matchstore.nestedmatches:
+            print("Nested matches ignored %d\n" % self.matchstore.nestedmatches)
+        if self.jobs <= 1:
+            self.__print_token_stats()
+        if tokencache is not None and cachedir == self.cachedir:
+            cachesize = tokencache.trim()
+            if self.jobs <= 1:
+                print("Token cache hits %d, misses %d" % (tokencache.hits, tokencache.misses))
+            print("Token cache size %.1f MB\n" % (cachesize / (1024.0 * 1024.0)))
+
+        self.foundcopies = True
+
+    def __iter_tokenized(self, rk, cachedir):
+        '''
+        yields (tokenizer, window hashes) of every file in the filelist order. Files are
+        tokenized in worker processes if 'jobs' is more than 1.
+        '''
         totalfiles = len(self.filelist)
+        if self.jobs > 1 and totalfiles > 1:
+            tokenize = partial(tokenize_file, chunk=self.chunk, fuzzy=self.fuzzy,
+                               cachedir=cachedir, tokenizer_options=self.tokenizer_options)
+            for srcfile, (tknzr, hashes) in self.__iter_parallel(tokenize):
+                rk.addTokenizer(tknzr)
+                yield tknzr, hashes
+        else:
+            for i, srcfile in enumerate(self.filelist):
+                self.__log_progress(srcfile, i, totalfiles)
+                yield rk.getTokensAndHashes(srcfile)
 
-        rk = RabinKarp(self.chunk, self.min_lines, self.matchstore, self.fuzzy)
+    def __find_indexed_copies(self):
+        '''
+        detect exact copies using the RabinKarp algorithm and the persistent duplication index.
+        Only the files changed since the last run are analyzed.
+        '''
+        index = DuplicationIndex.load(self.indexfile)
+        changedfiles = self.changedfiles
+        if index is None or not index.is_compatible(self.chunk, self.min_lines, self.fuzzy):
+            # build a new index from all the files.
+            index = DuplicationIndex(self.chunk, self.min_lines, self.fuzzy,
+                                     self.matchstore.blameflag)
+            changedfiles = None
 
-        for i, srcfile in enumerate(self.filelist):
-            print("Analyzing file %s (%d of %d)" % (srcfile, i + 1, totalfiles))
-            logging.info("Analyzing file %s (%d of %d)" %
-                         (srcfile, i + 1, totalfiles))
-            rk.addAllTokens(srcfile)
-        print("Total Hashes Stored %d\n" % len(self.matchstore.hashset))
+        added, modified, deleted = index.get_changes(self.filelist, changedfiles, self.rootdir)
+        print("Duplication index : %d added, %d modified, %d deleted files" %
+              (len(added), len(modified), len(deleted)))
+
+        tokencache = None
+        if self.cachedir:
+            tokencache = TokenCache(self.cachedir, self.cachesize)
+        affected = index.update(self.filelist, added, modified, deleted, tokencache=tokencache,
+                                progress=self.__log_progress,
+                                tokenizer_options=self.tokenizer_options)
+        print("Match sets affected by the changed files %d\n" % affected)
+        self.__print_token_stats()
+        if tokencache is not None:
+            tokencache.trim()
+        index.save(self.indexfile)
+
+        self.matchstore = index.matchstore
+        self.foundcopies = True
+
+    def __find_sa_copies(self):
+        '''
+        detect exact copies using the suffix array and LCP array of all tokens
+        '''
+        tokenstore = TokenStore()
+        detector = SuffixArrayDetector(self.chunk, self.min_lines, self.matchstore, tokenstore)
+        for filetokens in self.__iter_filetokens(tokenstore):
+            detector.addTokens(filetokens)
+        detector.findMatches()
+
+        self.foundcopies = True
+
+    def __find_minhash_copies(self):
+        '''
+        detect near-miss copies using MinHash signatures of the token blocks and LSH
+        '''
+        tokenstore = TokenStore()
+        detector = MinHashDetector(self.chunk, self.min_lines, self.matchstore, tokenstore,
+                                   similarity=self.similarity)
+        for filetokens in self.__iter_filetokens(tokenstore):
+            detector.addTokens(filetokens)
+        detector.findMatches()
+        print("MinHash : %d candidate pairs, %d pairs with similarity >= %.2f\n" %
+              (detector.candidates, detector.verified, self.similarity))
+        if self.matchstore.nestedmatches:
+            print("Nested matches ignored %d\n" % self.matchstore.nestedmatches)
+
+        self.foundcopies = True
+
+    def __find_function_copies(self):
+        '''
+        detect duplicate functions using the exact and fuzzy fingerprints of the function units
+        '''
+        tokenstore = TokenStore()
+        index = FunctionIndex(self.chunk, self.min_lines, self.matchstore)
+        totalfiles = len(self.filelist)
+        if self.jobs > 1 and totalfiles > 1:
+            tokenize = partial(create_function_tokenizer, options=self.tokenizer_options)
+            for srcfile, tknzr in self.__iter_parallel(tokenize):
+                tknzr.set_token_store(tokenstore)
+                index.addTokenizer(tknzr)
+        else:
+            for i, srcfile in enumerate(self.filelist):
+                self.__log_progress(srcfile, i, totalfiles)
+                tknzr = FunctionTokenizer(srcfile, tokenstore=tokenstore,
+                                          options=self.tokenizer_options)
+                tknzr.update_token_list()
+                index.addTokenizer(tknzr)
+        groups = index.findMatches(fuzzy=self.fuzzy)
+        print("Function index : %d functions, %d duplicate function groups\n" %
+              (index.numunits, groups))
+
+        self.foundcopies = True
+
+    def __iter_filetokens(self, tokenstore):
+        '''
+        yields FileTokens (with values interned in the tokenstore) of every file in the filelist
+        order. Files are tokenized in worker processes if 'jobs' is more than 1.
+        '''
+        totalfiles = len(self.filelist)
+        if self.jobs > 1 and totalfiles > 1:
+            tokenize = partial(create_tokenizer, fuzzy=self.fuzzy, options=self.tokenizer_options)
+            for srcfile, tknzr in self.__iter_parallel(tokenize):
+                tknzr.set_token_store(tokenstore)
+                yield tknzr.get_token_list()
+        else:
+            for i, srcfile in enumerate(self.filelist):
+                self.__log_progress(srcfile, i, totalfiles)
+                tknzr = Tokenizer(srcfile, fuzzy=self.fuzzy, tokenstore=tokenstore,
+                                  options=self.tokenizer_options)
+                yield tknzr.get_token_list()
+
+    def __find_sharded_copies(self):
+        '''
+        detect exact copies using map/reduce over file shards and hash range partitions
+        '''
+        detector = ShardedDetector(self.chunk, self.min_lines, self.matchstore, fuzzy=self.fuzzy,
+                                   jobs=self.jobs, partitions=self.partitions,
+                                   spilldir=self.spilldir, cachedir=self.cachedir,
+                                   cachesize=self.cachesize,
+                                   tokenizer_options=self.tokenizer_options)
+        detector.findMatches(self.filelist)
+        if self.matchstore.nestedmatches:
+            print("Nested matches ignored %d\n" % self.matchstore.nestedmatches)
 
         self.foundcopies = True
 
+    def __iter_parallel(self, func):
+        '''
+        call func(srcfile) for every file in a pool of 'jobs' worker processes (e.g. for
+        tokenizing the files). Yields (srcfile, result) in the same order as the filelist, hence
+        the detected matches are same as the serial run.
+        '''
+        totalfiles = len(self.filelist)
+        chunksize = max(1, min(16, totalfiles // (self.jobs * 4)))
+
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            results = pool.imap(func, self.filelist, chunksize)
+            for i, (srcfile, result) in enumerate(zip(self.filelist, results)):
+                self.__log_progress(srcfile, i, totalfiles)
+                yield srcfile, result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __print_token_stats(self):
+        lookups = VOCABULARY.hits + VOCABULARY.misses
+        if lookups > 0:
+            print("Token hash table : %d distinct tokens, hits %d, misses %d (%.1f%% hits)\n" %
+                  (len(VOCABULARY), VOCABULARY.hits, VOCABULARY.misses,
+                   100.0 * VOCABULARY.hits / lookups))
+
+    def __log_progress(self, srcfile, i, totalfiles):
+        print("Analyzing file %s (%d of %d)" % (srcfile, i + 1, totalfiles))
+        logging.info("Analyzing file %s (%d of %d)" %
+                     (srcfile, i + 1, totalfiles))
+
     def findcopies(self):
         if self.foundcopies == False:
-            self.__find_rk_copies()
+            if self.tokentable and os.path.exists(self.tokentable):
+                VOCABULARY.load(self.tokentable)
+            if self.indexfile:
+                self.__find_indexed_copies()
+            elif self.engine == 'suffix':
+                self.__find_sa_copies()
+            elif self.engine == 'sharded':
+                self.__find_sharded_copies()
+            elif self.engine == 'minhash':
+                self.__find_minhash_copies()
+            elif self.engine == 'function':
+                self.__find_function_copies()
+            else:
+                self.__find_rk_copies()
+            if self.tokentable:
+                VOCABULARY.save(self.tokentable)
         return self.matchstore.iter_matches()
 
-    def printmatches(self, output):
+    def sortedmatches(self, topk=None):
+        '''
+        return the match sets sorted on the matched line count (in reverse). If 'topk' is given,
+        only the 'topk' largest match sets are returned. These are selected using a bounded heap,
+        hence the list does not grow with the number of matches found.
+        '''
         exactmatches = self.findcopies()
-        # now sort the matches based on the matched line count (in reverse)
-        exactmatches = sorted(exactmatches, reverse=True, key=lambda x: x.matchedlines)
+        if topk:
+            return heapq.nlargest(topk, exactmatches, key=lambda x: x.matchedlines)
+        return sorted(exactmatches, reverse=True, key=lambda x: x.matchedlines)
+
+    def reportmatches(self, topk=None):
+        '''
+        return the match sets to report. If 'topk' is given, the 'topk' largest match sets are
+        returned (see sortedmatches). Otherwise the match sets are iterated lazily from the
+        match store in the order they were found, hence the report is written without
+        collecting and sorting all the match sets first.
+        '''
+        if topk:
+            return self.sortedmatches(topk)
+        return self.findcopies()
+
+    def printmatches(self, output, topk=None):
+        exactmatches = self.reportmatches(topk)
         duplicateLineCount = 0
         for matchidx, matches in enumerate(exactmatches, 1):
             output.write('%s\n' % ('=' * 50))
@@ -75,37 +336,53 @@ class CodeDupDetect(object):
         return exactmatches
 
     def insert_comments(self, dirname):
+        '''
+        mark the duplicates in the source files with '//!DUPLICATE BEGIN' and '//!DUPLICATE END'
+        comments. Comments are inserted at the line numbers found in the original file and all
+        the comments of a file are inserted in a single pass.
+        '''
+        comments = dict()  # file name -> list of (line index, order, begin no, comment)
         begin_no = 0
-        for matches in sorted(self.findcopies(), reverse=True, key=lambda x: x.matchedlines):
+        for matches in self.sortedmatches():
             for match in matches:
                 fn = match.srcfile()
                 infostring = ' '.join(['%s:%i+%i' % (f.srcfile(), f.getStartLine(), f.getLineCount())
                                        for f in matches if f.srcfile() != fn]).replace(dirname, '')
-                tmp_source = tempfile.NamedTemporaryFile(
-                    mode='wb', delete=False, prefix='cdd-')
-                with open(fn, 'r') as srcfile:
-                    for i in range(match.getStartLine()):
-                        tmp_source.write(srcfile.readline())
-                    comment = '//!DUPLICATE BEGIN %i -- %s\n' % (
-                        begin_no, infostring)
-                    tmp_source.write(comment)
-                    for i in range(match.getLineCount()):
-                        line = srcfile.readline()
-                        tmp_source.write(line)
-                        # with open('/tmp/%i.dup'%begin_no, 'a') as dup:
-                        #    dup.write(line)
-                    comment = '//!DUPLICATE END %i\n' % begin_no
-                    tmp_source.write(comment)
-                    line = srcfile.readline()
-                    while line:
-                        tmp_source.write(line)
-                        line = srcfile.readline()
-                # this should also work on windows
-                tmp_source_name = tmp_source.name
-                tmp_source.close()
-                shutil.copy(tmp_source_name, fn)
+                startline = match.getStartLine()
+                filecomments = comments.setdefault(fn, list())
+                # on the same line, END comment of a match is inserted before the BEGIN comment
+                # of next match
+                filecomments.append((startline, 1, begin_no,
+                                     '//!DUPLICATE BEGIN %i -- %s\n' % (begin_no, infostring)))
+                filecomments.append((startline + match.getLineCount(), 0, begin_no,
+                                     '//!DUPLICATE END %i\n' % begin_no))
                 begin_no += 1
 
+        for fn, filecomments in comments.items():
+            self.__insert_file_comments(fn, sorted(filecomments))
+
+    def __insert_file_comments(self, fn, filecomments):
+        lines = LINE_INDEXES.get(fn)
+        tmp_source = tempfile.NamedTemporaryFile(mode='wb', delete=False, prefix='cdd-')
+        try:
+            with tmp_source:
+                pos = 0
+                for lineidx, order, begin_no, comment in filecomments:
+                    offset = lines.offset(lineidx)
+                    tmp_source.write(lines.data[pos:offset])
+                    # comment after the last line, when the file does not end with new line
+                    if offset == len(lines.data) and pos < offset and lines.data[offset - 1:offset] != b'\n':
+                        tmp_source.write(b'\n')
+                    tmp_source.write(comment.encode('utf-8'))
+                    pos = offset
+                tmp_source.write(lines.data[pos:])
+            # source file is memory mapped. Close it before overwriting.
+            LINE_INDEXES.invalidate(fn)
+            # this should also work on windows
+            shutil.copy(tmp_source.name, fn)
+        finally:
+            os.remove(tmp_source.name)
+
     def getCooccuranceData(self, dirname):
         '''
         create a co-occurance data in nodes and links list format. Something that can be
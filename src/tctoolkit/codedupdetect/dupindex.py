@@ -0,0 +1,436 @@
+'''
+dupindex.py
+Persistent duplication index for incremental Code Duplication Detector runs. Index stores the
+MatchStore (hashes and matches) along with the hash keys of every file. When some files are
+added, modified or deleted, hashes and matches of the files after the first changed file are
+retracted and those files are added again in the file list order. Only the changed files are
+tokenized again. Index is saved in a versioned binary format (header followed by typed
+arrays), like the token cache.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import logging
+import struct
+import tempfile
+from array import array
+
+from . import matchstore
+from .rabinkarp import RabinKarp
+from .tokenstore import TokenStore, FileTokens
+
+INDEX_MAGIC = b'TCDI'
+INDEX_VERSION = 4
+# magic, version, chunk, minimum lines, flags (fuzzy, blame), number of nested matches
+INDEX_HEADER = struct.Struct('<4sIIIII')
+INDEX_COUNT = struct.Struct('<Q')  # number of items of the array following it
+FLAG_FUZZY = 1
+FLAG_BLAME = 2
+# HashIndex arrays saved in the index
+HASHINDEX_ARRAYS = [('keys', 'Q'), ('heads', 'q'), ('counts', 'I'), ('postfile', 'I'),
+                    ('posttoken', 'I'), ('postnext', 'q')]
+# directories which mark the top level directory of a working copy. 'git diff --name-only'
+# (and 'hg status') print the paths relative to it.
+VCS_DIRS = ['.git', '.hg']
+
+
+def file_signature(srcfile):
+    '''
+    signature used to detect the changed files when the changed file list is not given.
+    '''
+    stat = os.stat(srcfile)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def find_vcs_root(dirname):
+    '''
+    return the top level directory of the git (or mercurial) working copy containing dirname
+    or None
+    '''
+    dirname = os.path.abspath(dirname)
+    while True:
+        if any(os.path.exists(os.path.join(dirname, vcsdir)) for vcsdir in VCS_DIRS):
+            return dirname
+        parent = os.path.dirname(dirname)
+        if parent == dirname:
+            return None
+        dirname = parent
+
+
+def resolve_changed_files(changedfiles, knownfiles, rootdir=None):
+    '''
+    return the set of known files (scanned or indexed) listed in changedfiles. Relative paths
+    are resolved against the scanned directory (rootdir), the top level directory of its working
+    copy and the current directory. Paths which do not match any known file are reported.
+    '''
+    basedirs = list()
+    if rootdir is not None:
+        basedirs.append(os.path.abspath(rootdir))
+        vcsroot = find_vcs_root(rootdir)
+        if vcsroot is not None:
+            basedirs.append(vcsroot)
+    basedirs.append(os.getcwd())
+
+    resolved = set()
+    for fname in changedfiles:
+        found = set(os.path.normpath(os.path.join(basedir, fname)) for basedir in basedirs)
+        found.intersection_update(knownfiles)
+        if not found:
+            msg = "changed file %s is not in the scanned or indexed files" % fname
+            logging.warning(msg)
+            print(msg)
+        resolved.update(found)
+    return resolved
+
+
+class _Reader(object):
+    '''
+    reads the arrays and strings written by DuplicationIndex.save
+    '''
+
+    def __init__(self, data, offset):
+        self.data = data
+        self.offset = offset
+
+    def read_array(self, typecode):
+        count, = INDEX_COUNT.unpack_from(self.data, self.offset)
+        values = array(typecode)
+        start = self.offset + INDEX_COUNT.size
+        end = start + count * values.itemsize
+        values.frombytes(self.data[start:end])
+        if len(values) != count:
+            raise ValueError("truncated duplication index")
+        self.offset = end
+        return values
+
+    def read_strings(self):
+        lengths = self.read_array('I')
+        strings = list()
+        offset = self.offset
+        for length in lengths:
+            strings.append(self.data[offset:offset + length].decode('utf-8', 'surrogatepass'))
+            offset = offset + length
+        self.offset = offset
+        return strings
+
+
+def _pack_array(values):
+    return [INDEX_COUNT.pack(len(values)), values.tobytes()]
+
+
+def _pack_strings(strings):
+    encoded = [value.encode('utf-8', 'surrogatepass') for value in strings]
+    return _pack_array(array('I', [len(value) for value in encoded])) + [b''.join(encoded)]
+
+
+class DuplicationIndex(object):
+    '''
+    persistent index of the hashes and matches found by the Rabin Karp detector.
+    '''
+
+    def __init__(self, chunk, min_lines, fuzzy=False, blameflag=False):
+        self.chunk = chunk
+        self.min_lines = min_lines
+        self.fuzzy = fuzzy
+        self.matchstore = matchstore.MatchStore(chunk, blameflag, trackfiles=True)
+        self.tokenstore = TokenStore()  # interned token values of all the indexed files
+        # source file -> file signature at the time of indexing. Files are in the order they
+        # are added to the matchstore.
+        self.signatures = dict()
+
+    @classmethod
+    def load(cls, indexfile):
+        '''
+        load the index saved earlier. Returns None if the index file is not there or it
+        is incompatible.
+        '''
+        try:
+            with open(indexfile, 'rb') as indexf:
+                data = indexf.read()
+            return cls._decode(data)
+        except (IOError, OSError, ValueError, IndexError, struct.error, UnicodeDecodeError) as exp:
+            logging.info("unable to load duplication index %s : %s" % (indexfile, exp))
+            return None
+
+    def save(self, indexfile):
+        '''
+        save the index. Index is written to a temporary file first and then renamed.
+        '''
+        indexdir = os.path.dirname(os.path.abspath(indexfile))
+        fd, tmppath = tempfile.mkstemp(dir=indexdir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as indexf:
+                indexf.write(b''.join(self._encode()))
+            os.replace(tmppath, indexfile)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    def _encode(self):
+        '''
+        return the list of byte strings of the index. Index is a header followed by the arrays
+        (number of items and native byte order items) of the files, tokens, hash index and
+        matches. Token values and file names are stored once and referred by their position.
+        '''
+        store = self.matchstore
+        flags = (FLAG_FUZZY if self.fuzzy else 0) | (FLAG_BLAME if store.blameflag else 0)
+        parts = [INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.chunk, self.min_lines, flags,
+                                   store.nestedmatches)]
+
+        srcfiles = [None] * len(store.filetokens)
+        for srcfile, fileid in store.file_ids.items():
+            srcfiles[fileid] = srcfile
+        signed = list(self.signatures)
+        parts += _pack_strings(srcfiles)
+        parts += _pack_strings(signed)
+        parts += _pack_array(array('q', [self.signatures[srcfile][0] for srcfile in signed]))
+        parts += _pack_array(array('Q', [self.signatures[srcfile][1] for srcfile in signed]))
+
+        # tokens of the files (removed files have no tokens). Token ids are local to the index.
+        localids = dict()
+        values = list()
+        numtokens = array('q')
+        valueids = array('I')
+        linenos = array('I')
+        charpos = array('I')
+        for filetokens in store.filetokens:
+            if filetokens is None:
+                numtokens.append(-1)
+                continue
+            numtokens.append(len(filetokens))
+            tokenstore = filetokens.tokenstore
+            for tokenid in filetokens.valueids:
+                localid = localids.get(tokenid)
+                if localid is None:
+                    localid = len(values)
+                    localids[tokenid] = localid
+                    values.append(tokenstore.get_value(tokenid))
+                valueids.append(localid)
+            linenos.extend(filetokens.linenos)
+            charpos.extend(filetokens.charpos)
+        parts += _pack_strings(values)
+        for values in (numtokens, valueids, linenos, charpos):
+            parts += _pack_array(values)
+
+        # number of nested matches ignored while adding every file (in the file id order)
+        filenested = array('I', [0] * len(srcfiles))
+        for srcfile, count in store.filenested.items():
+            filenested[store.file_ids[srcfile]] = count
+        parts += _pack_array(filenested)
+
+        # hash keys added for every file (in the file id order)
+        keyfiles = array('I')
+        numkeys = array('I')
+        filekeys = array('Q')
+        for srcfile, keys in store.filekeys.items():
+            keyfiles.append(store.file_ids[srcfile])
+            numkeys.append(len(keys))
+            filekeys.extend(keys)
+        for values in (keyfiles, numkeys, filekeys):
+            parts += _pack_array(values)
+
+        hashset = store.hashset
+        parts += _pack_array(array('q', [hashset.bits, hashset.numkeys, hashset.numslots]))
+        for name, typecode in HASHINDEX_ARRAYS:
+            parts += _pack_array(getattr(hashset, name))
+
+        # matches : match key (start hash, match length and sequence number or -1) and the
+        # (file id, match length, start token index, end token index, id of the file added
+        # when the match was found) of every match. First match of every set is stored first.
+        owners = dict()
+        for srcfile, filematches in store.filematches.items():
+            for matchkey, matchdata in filematches:
+                owners[id(matchdata)] = store.file_ids[srcfile]
+        matchkeys = array('q')
+        nummatches = array('I')
+        matches = array('Q')
+        authors = list()
+        revisions = list()
+        for matchkey, matchset in store.matchlist.items():
+            matchkeys.extend(list(matchkey) + [-1] * (3 - len(matchkey)))
+            ordered = [matchset.firstMatch] + [matchdata for matchdata in matchset
+                                               if matchdata is not matchset.firstMatch]
+            nummatches.append(len(ordered))
+            for matchdata in ordered:
+                fileid = store.file_ids[matchdata.srcfile()]
+                filetokens = store.filetokens[fileid]
+                matches.extend([fileid, matchdata.matchlen,
+                                filetokens.index_of(matchdata.starttoken.charpos),
+                                filetokens.index_of(matchdata.endtoken.charpos),
+                                owners.get(id(matchdata), fileid)])
+                author, revision = matchdata.revisioninfo
+                authors.append('' if author is None else str(author))
+                revisions.append('' if revision is None else str(revision))
+        for values in (matchkeys, nummatches, matches):
+            parts += _pack_array(values)
+        if store.blameflag:
+            parts += _pack_strings(authors)
+            parts += _pack_strings(revisions)
+        return parts
+
+    @classmethod
+    def _decode(cls, data):
+        magic, version, chunk, min_lines, flags, nestedmatches = INDEX_HEADER.unpack_from(data, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError("unsupported duplication index version")
+        index = cls(chunk, min_lines, bool(flags & FLAG_FUZZY), bool(flags & FLAG_BLAME))
+        store = index.matchstore
+        store.nestedmatches = nestedmatches
+        reader = _Reader(data, INDEX_HEADER.size)
+
+        srcfiles = reader.read_strings()
+        signed = reader.read_strings()
+        mtimes = reader.read_array('q')
+        sizes = reader.read_array('Q')
+        index.signatures = dict(zip(signed, zip(mtimes, sizes)))
+
+        tokenstore = index.tokenstore
+        idmap = [tokenstore.intern(value) for value in reader.read_strings()]
+        numtokens = reader.read_array('q')
+        valueids = reader.read_array('I')
+        linenos = reader.read_array('I')
+        charpos = reader.read_array('I')
+        if len(numtokens) != len(srcfiles):
+            raise ValueError("invalid duplication index")
+        offset = 0
+        for fileid, (srcfile, count) in enumerate(zip(srcfiles, numtokens)):
+            store.file_ids[srcfile] = fileid
+            if count < 0:
+                store.filetokens.append(None)
+                continue
+            filetokens = FileTokens(tokenstore, srcfile)
+            filetokens.valueids = array('I', [idmap[localid] for localid in valueids[offset:offset + count]])
+            filetokens.linenos = linenos[offset:offset + count]
+            filetokens.charpos = charpos[offset:offset + count]
+            store.filetokens.append(filetokens)
+            offset = offset + count
+
+        for srcfile, count in zip(srcfiles, reader.read_array('I')):
+            if count:
+                store.filenested[srcfile] = count
+
+        keyfiles = reader.read_array('I')
+        numkeys = reader.read_array('I')
+        filekeys = reader.read_array('Q')
+        offset = 0
+        for fileid, count in zip(keyfiles, numkeys):
+            store.filekeys[srcfiles[fileid]] = filekeys[offset:offset + count]
+            offset = offset + count
+
+        hashset = store.hashset
+        hashset.bits, hashset.numkeys, hashset.numslots = reader.read_array('q')
+        for name, typecode in HASHINDEX_ARRAYS:
+            setattr(hashset, name, reader.read_array(typecode))
+
+        matchkeys = reader.read_array('q')
+        nummatches = reader.read_array('I')
+        matches = reader.read_array('Q')
+        revisioninfo = None
+        if store.blameflag:
+            revisioninfo = zip(reader.read_strings(), reader.read_strings())
+        matchidx = 0
+        for setidx, count in enumerate(nummatches):
+            matchkey = tuple(key for key in matchkeys[3 * setidx:3 * setidx + 3] if key >= 0)
+            matchset = matchstore.MatchSet(False)
+            for pos in range(5 * matchidx, 5 * (matchidx + count), 5):
+                fileid, matchlen, startidx, endidx, owner = matches[pos:pos + 5]
+                filetokens = store.filetokens[fileid]
+                info = (None, None)
+                if revisioninfo is not None:
+                    info = tuple(value or None for value in next(revisioninfo))
+                matchdata = matchstore.MatchData(matchlen, filetokens[startidx], filetokens[endidx], info)
+                matchset.matchset.add(matchdata)
+                if matchset.firstMatch is None:
+                    matchset.firstMatch = matchdata
+                store.addInterval(matchdata, matchkey)
+                store.filematches.setdefault(srcfiles[owner], list()).append((matchkey, matchdata))
+            store.matchlist[matchkey] = matchset
+            matchidx = matchidx + count
+        return index
+
+    def is_compatible(self, chunk, min_lines, fuzzy):
+        return (self.chunk, self.min_lines, self.fuzzy) == (chunk, min_lines, fuzzy)
+
+    def get_changes(self, filelist, changedfiles=None, rootdir=None):
+        '''
+        return tuple of (added, modified, deleted) file lists. Added and modified files are in
+        the filelist order, hence an index built from scratch finds the same matches as a run
+        without the index. If changedfiles is given (e.g. output of 'git diff --name-only'),
+        only those files are checked. Relative paths in changedfiles are resolved against the
+        scanned directory 'rootdir' (see resolve_changed_files). Otherwise the file signatures
+        are compared with the signatures at the time of indexing.
+        '''
+        filelistset = set(filelist)
+        knownfiles = filelistset.union(self.signatures.keys())
+        if changedfiles is None:
+            candidates = knownfiles
+        else:
+            candidates = resolve_changed_files(changedfiles, knownfiles, rootdir)
+
+        added, modified, deleted = list(), list(), list()
+        for srcfile in filelist:
+            if srcfile not in candidates:
+                continue
+            if not os.path.exists(srcfile):
+                if srcfile in self.signatures:
+                    deleted.append(srcfile)
+            elif srcfile not in self.signatures:
+                added.append(srcfile)
+            elif changedfiles is not None or self.signatures[srcfile] != file_signature(srcfile):
+                modified.append(srcfile)
+        deleted.extend(srcfile for srcfile in sorted(self.signatures)
+                       if srcfile in candidates and srcfile not in filelistset)
+        return added, modified, deleted
+
+    def update(self, filelist, added, modified, deleted, tokencache=None, progress=None,
+               tokenizer_options=None):
+        '''
+        update the index for the added, modified and deleted files (see get_changes). Rabin
+        Karp matches depend on the order in which the files are added. Hence the files indexed
+        after the first changed file are retracted (i.e. their hashes and the matches found
+        while adding them) and the files are added again in the filelist order. Matches are
+        same as a run without the index. Tokens of the unchanged files are reused. Returns the
+        number of match sets affected by the retraction.
+        '''
+        store = self.matchstore
+        changed = set(added + modified + deleted)
+        indexed = list(self.signatures)
+        keep = 0
+        while keep < min(len(indexed), len(filelist)) and indexed[keep] == filelist[keep] and \
+                indexed[keep] not in changed:
+            keep = keep + 1
+
+        unchanged = dict()  # source file -> (file signature, FileTokens) of the unchanged files
+        for srcfile in indexed[keep:]:
+            fileid = store.file_ids.get(srcfile)
+            if srcfile not in changed and fileid is not None and store.filetokens[fileid] is not None:
+                unchanged[srcfile] = (self.signatures[srcfile], store.filetokens[fileid])
+        affected = set()
+        for srcfile in reversed(indexed[keep:]):
+            affected.update(id(matchset) for matchset in store.removeFile(srcfile))
+            del self.signatures[srcfile]
+
+        rk = RabinKarp(self.chunk, self.min_lines, store, self.fuzzy, tokencache=tokencache,
+                       tokenstore=self.tokenstore, tokenizer_options=tokenizer_options)
+        readded = [srcfile for srcfile in filelist[keep:] if srcfile not in deleted]
+        for i, srcfile in enumerate(readded):
+            if progress:
+                progress(srcfile, i, len(readded))
+            if srcfile in unchanged:
+                self.signatures[srcfile], filetokens = unchanged[srcfile]
+                tknzr = rk.getTokanizer(srcfile)
+                tknzr.set_token_list(filetokens)
+                rk.addHashes(tknzr, rk.getHashes(tknzr))
+            else:
+                self.signatures[srcfile] = file_signature(srcfile)
+                rk.addAllTokens(srcfile)
+        return len(affected)
+
+    def iter_matches(self):
+        return self.matchstore.iter_matches()
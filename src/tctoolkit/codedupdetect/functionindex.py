@@ -0,0 +1,166 @@
+'''
+functionindex.py
+Function level clone index for the Code Duplication Detector. Files are divided in function
+units using the function name tokens (Token.Name.Function) found by Pygments. Every unit is
+fingerprinted twice : exact (token values) and fuzzy (names and literals ignored). Units with
+the same fingerprint are the duplicated functions, hence they are found in a single pass over
+the index (hash join) without extending the token matches.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import hashlib
+from array import array
+from collections import namedtuple
+
+from pygments.token import Token
+
+from .tokenizer import Tokenizer
+from .tokenstore import TokenStore, TokenVocabulary
+
+FUZZY_VALUE = '#FUZZY#'
+
+# one function unit. 'start' and 'end' are token indices (end is exclusive)
+FunctionUnit = namedtuple('FunctionUnit', ['filetokens', 'name', 'start', 'end'])
+
+
+class FunctionTokenizer(Tokenizer):
+    '''
+    tokenizer which also records the token index of the function names and whether a token is
+    'fuzzy' (i.e. name or literal) or not. Tokens are always exact (not fuzzy) values.
+    '''
+
+    def __init__(self, srcfile, tokenstore=None, options=None):
+        super(FunctionTokenizer, self).__init__(srcfile, fuzzy=False, tokenstore=tokenstore,
+                                                options=options)
+        self.functions = array('I')  # token indices of the function name tokens
+        self.fuzzyflags = array('B')  # 1 for the tokens ignored in fuzzy fingerprint
+        self.lastsrctoken = None
+
+    def _parse_tokens(self):
+        for srctoken in super(FunctionTokenizer, self)._parse_tokens():
+            self.lastsrctoken = srctoken
+            yield srctoken
+
+    def get_tokens(self):
+        self.functions = array('I')
+        self.fuzzyflags = array('B')
+        # base class generator yields the token immediately after parsing its source token,
+        # hence 'lastsrctoken' is the source token of the yielded token.
+        for duptoken in super(FunctionTokenizer, self).get_tokens():
+            srctoken = self.lastsrctoken
+            if srctoken.is_type(Token.Name.Function):
+                self.functions.append(len(self.fuzzyflags))
+            self.fuzzyflags.append(1 if self.is_fuzzy_token(srctoken) else 0)
+            yield duptoken
+        self.lastsrctoken = None
+
+    def get_units(self):
+        '''
+        return the list of FunctionUnits of the file. Unit starts at the first token of the
+        line with the function name and ends before the next unit (or end of file).
+        '''
+        tokens = self.get_token_list()
+        linenos = tokens.linenos
+        starts = list()
+        for nameidx in self.functions:
+            start = nameidx
+            while start > 0 and linenos[start - 1] == linenos[nameidx]:
+                start = start - 1
+            if not starts or start > starts[-1][0]:
+                starts.append((start, nameidx))
+        units = list()
+        for i, (start, nameidx) in enumerate(starts):
+            end = starts[i + 1][0] if i + 1 < len(starts) else len(tokens)
+            units.append(FunctionUnit(tokens, tokens.tokenstore.get_value(tokens.valueids[nameidx]),
+                                      start, end))
+        return units
+
+
+def create_function_tokenizer(srcfile, options=None):
+    '''
+    create the FunctionTokenizer for srcfile and update its token list. Module level function
+    so that it can be used with multiprocessing pool. 'options' is the TokenizerOptions.
+    '''
+    tknzr = FunctionTokenizer(srcfile, tokenstore=TokenStore(TokenVocabulary()), options=options)
+    tknzr.update_token_list()
+    return tknzr
+
+
+class FunctionIndex(object):
+    '''
+    index of the function units keyed by exact and fuzzy fingerprints
+    '''
+
+    def __init__(self, chunk, min_lines, matchstore):
+        self.chunk = chunk  # minimum number of tokens in a function unit
+        self.min_lines = min_lines  # minimum number of lines in a function unit
+        self.matchstore = matchstore
+        self.exact = dict()  # exact fingerprint -> list of FunctionUnits
+        self.fuzzy = dict()  # fuzzy fingerprint -> list of FunctionUnits
+        self.numunits = 0
+
+    def addTokenizer(self, tknzr):
+        '''
+        add the function units of the (updated) FunctionTokenizer to the index. Units smaller
+        than 'chunk' tokens or 'min_lines' lines are ignored.
+        '''
+        names = frozenset(tknzr.functions)
+        for unit in tknzr.get_units():
+            linenos = unit.filetokens.linenos
+            if unit.end - unit.start < self.chunk or \
+                    linenos[unit.end - 1] - linenos[unit.start] < self.min_lines:
+                continue
+            exact, fuzzy = self.getFingerprints(unit, tknzr.fuzzyflags, names)
+            self.exact.setdefault(exact, list()).append(unit)
+            self.fuzzy.setdefault(fuzzy, list()).append(unit)
+            self.numunits = self.numunits + 1
+
+    def getFingerprints(self, unit, fuzzyflags, names):
+        '''
+        return (exact, fuzzy) SHA1 fingerprints of the unit. 'names' is the set of token indices
+        of the function names of the file. Function names are ignored in both, so that a copied
+        and renamed function is still an exact duplicate.
+        '''
+        values = unit.filetokens.tokenstore.values
+        valueids = unit.filetokens.valueids
+        exact = hashlib.sha1()
+        fuzzy = hashlib.sha1()
+        for i in range(unit.start, unit.end):
+            value = values[valueids[i]]
+            if i in names:
+                value = FUZZY_VALUE
+            value = value.encode('utf-8', 'surrogatepass') + b'\x00'
+            exact.update(value)
+            fuzzy.update(FUZZY_VALUE.encode('utf-8') + b'\x00' if fuzzyflags[i] else value)
+        return exact.digest(), fuzzy.digest()
+
+    def duplicates(self, fuzzy=False):
+        '''
+        yields the lists of duplicate function units (i.e. units with same fingerprint)
+        '''
+        index = self.fuzzy if fuzzy else self.exact
+        for units in index.values():
+            if len(units) > 1:
+                yield units
+
+    def findMatches(self, fuzzy=False):
+        '''
+        add the duplicate functions to the matchstore. Exact duplicates are added first. With
+        'fuzzy' flag, fuzzy duplicates which are not same as an exact duplicate group are
+        added too.
+        '''
+        groups = 0
+        for kind in ([False, True] if fuzzy else [False]):
+            for units in self.duplicates(fuzzy=kind):
+                matches = [(unit.filetokens[unit.start], unit.filetokens[unit.end - 1]) for unit in units]
+                first = units[0]
+                matchkey = ('function', kind, first.filetokens.srcfile, first.start)
+                self.matchstore.addMatchGroup(first.end - first.start, matchkey, matches)
+                groups = groups + 1
+        return groups
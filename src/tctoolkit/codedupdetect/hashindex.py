@@ -0,0 +1,204 @@
+'''
+hashindex.py
+Compact hash index of the rolling hashes for the Code Duplication Detector. Maps 64 bit keys to
+the postings i.e. (file id, token index) pairs. Keys are stored in an open addressing table
+(linear probing) and postings are stored in flat typed arrays, instead of a dict of lists of
+token tuples.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+from array import array
+from itertools import repeat
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+FIBONACCI_MULTIPLIER = 0x9E3779B97F4A7C15  # 2**64 / golden ratio
+
+EMPTY = -1  # slot is not used
+END = -2  # end of the postings chain. Slot of a key with all postings removed remains END
+
+
+class HashIndex(object):
+    '''
+    open addressing hash table of 64 bit keys. Every used slot points to the last posting
+    added for its key. Postings of a key are linked (newest first) using 'postnext' array.
+    Slot of a key depends only on the key value, hence the index is same across processes.
+    '''
+
+    def __init__(self, capacity=1024):
+        self.numkeys = 0  # number of keys with at least one posting
+        self.numslots = 0  # number of used slots
+        self._allocate(max(16, capacity))
+        self.postfile = array('I')  # posting -> file id
+        self.posttoken = array('I')  # posting -> token index
+        self.postnext = array('q')  # posting -> next (older) posting of the same key
+
+    def _allocate(self, capacity):
+        bits = 4
+        while (1 << bits) < capacity:
+            bits = bits + 1
+        self.bits = bits
+        self.keys = array('Q', bytes(8 << bits))
+        self.heads = array('q', [EMPTY]) * (1 << bits)
+        self.counts = array('I', bytes(4 << bits))
+
+    def __len__(self):
+        return self.numkeys
+
+    def _slot(self, key):
+        '''
+        return the slot of the key. If the key is not there, returns the empty slot where the
+        key can be added.
+        '''
+        mask = (1 << self.bits) - 1
+        slot = ((key * FIBONACCI_MULTIPLIER) & MASK64) >> (64 - self.bits)
+        keys = self.keys
+        heads = self.heads
+        while heads[slot] != EMPTY and keys[slot] != key:
+            slot = (slot + 1) & mask
+        return slot
+
+    def _grow(self):
+        oldkeys, oldheads, oldcounts = self.keys, self.heads, self.counts
+        self._allocate(2 << self.bits)
+        numslots = 0
+        for oldslot, head in enumerate(oldheads):
+            # drop the keys without postings
+            if head != EMPTY and oldcounts[oldslot] > 0:
+                slot = self._slot(oldkeys[oldslot])
+                self.keys[slot] = oldkeys[oldslot]
+                self.heads[slot] = head
+                self.counts[slot] = oldcounts[oldslot]
+                numslots = numslots + 1
+        self.numslots = numslots
+
+    def add(self, key, fileid, tokenidx):
+        '''
+        add the posting (fileid, tokenidx) for the key
+        '''
+        slot = self._slot(key)
+        if self.heads[slot] == EMPTY:
+            if 2 * (self.numslots + 1) > len(self.heads):
+                self._grow()
+                slot = self._slot(key)
+            self.keys[slot] = key
+            self.numslots = self.numslots + 1
+        if self.counts[slot] == 0:
+            self.numkeys = self.numkeys + 1
+        self.postfile.append(fileid)
+        self.posttoken.append(tokenidx)
+        self.postnext.append(self.heads[slot] if self.counts[slot] > 0 else END)
+        self.heads[slot] = len(self.postfile) - 1
+        self.counts[slot] = self.counts[slot] + 1
+
+    def add_many(self, keys, fileid, tokenindices):
+        '''
+        add the postings (fileid, tokenidx) of all the keys of a file, in the order of 'keys'.
+        'keys' and 'tokenindices' are sequences (e.g. lists) of the same length. Same as calling
+        'add' for every key but the postings are appended in bulk and the table is probed inline.
+        '''
+        assert len(keys) == len(tokenindices)
+        posting = len(self.postfile)
+        self.postfile.extend(repeat(fileid, len(keys)))
+        self.posttoken.extend(tokenindices)
+        postnext = self.postnext
+        mask = (1 << self.bits) - 1
+        tablekeys, heads, counts = self.keys, self.heads, self.counts
+        for key in keys:
+            slot = ((key * FIBONACCI_MULTIPLIER) & MASK64) >> (64 - self.bits)
+            while heads[slot] != EMPTY and tablekeys[slot] != key:
+                slot = (slot + 1) & mask
+            if heads[slot] == EMPTY:
+                if 2 * (self.numslots + 1) > len(heads):
+                    self._grow()
+                    mask = (1 << self.bits) - 1
+                    tablekeys, heads, counts = self.keys, self.heads, self.counts
+                    slot = self._slot(key)
+                tablekeys[slot] = key
+                self.numslots = self.numslots + 1
+            count = counts[slot]
+            if count == 0:
+                self.numkeys = self.numkeys + 1
+                postnext.append(END)
+            else:
+                postnext.append(heads[slot])
+            heads[slot] = posting
+            counts[slot] = count + 1
+            posting = posting + 1
+
+    def count(self, key):
+        '''
+        return the number of postings of the key
+        '''
+        return self.counts[self._slot(key)]
+
+    def get(self, key):
+        '''
+        return the list of (fileid, tokenidx) postings of the key in the order they are added.
+        Returns None if the key is not there.
+        '''
+        slot = self._slot(key)
+        if self.counts[slot] == 0:
+            return None
+        postings = list()
+        posting = self.heads[slot]
+        while posting != END:
+            postings.append((self.postfile[posting], self.posttoken[posting]))
+            posting = self.postnext[posting]
+        postings.reverse()
+        return postings
+
+    def remove(self, key, fileid):
+        '''
+        remove the postings of the given file id from the key. Removed postings are only unlinked,
+        the posting arrays are not compacted.
+        '''
+        slot = self._slot(key)
+        if self.counts[slot] == 0:
+            return
+        prev = END
+        posting = self.heads[slot]
+        while posting != END:
+            nextposting = self.postnext[posting]
+            if self.postfile[posting] == fileid:
+                if prev == END:
+                    self.heads[slot] = nextposting
+                else:
+                    self.postnext[prev] = nextposting
+                self.counts[slot] = self.counts[slot] - 1
+            else:
+                prev = posting
+            posting = nextposting
+        if self.counts[slot] == 0:
+            self.numkeys = self.numkeys - 1
+
+
+if __name__ == '__main__':
+    index = HashIndex(4)
+    for i in range(1000):
+        index.add(i * 7919, i % 3, i)
+        index.add(i * 7919, 5, i + 1)
+    assert len(index) == 1000
+    assert index.get(7919 * 10) == [(1, 10), (5, 11)]
+    assert index.count(7919 * 10) == 2
+    assert index.get(12345678901) is None
+    index.remove(7919 * 10, 5)
+    assert index.get(7919 * 10) == [(1, 10)]
+    index.remove(7919 * 10, 1)
+    assert index.get(7919 * 10) is None and len(index) == 999
+    index.add(7919 * 10, 2, 3)
+    assert index.get(7919 * 10) == [(2, 3)] and len(index) == 1000
+    # bulk insert is same as adding the keys one by one
+    bulk = HashIndex(4)
+    keys = [i * 7919 % 613 for i in range(2000)]
+    bulk.add_many(keys[:1000], 1, list(range(1000)))
+    bulk.add_many(keys[1000:], 2, list(range(1000)))
+    single = HashIndex(4)
+    for i, key in enumerate(keys):
+        single.add(key, 1 + i // 1000, i % 1000)
+    assert len(bulk) == len(single) == 613
+    assert all(bulk.get(key) == single.get(key) for key in keys)
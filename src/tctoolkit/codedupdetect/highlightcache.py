@@ -0,0 +1,124 @@
+'''
+highlightcache.py
+Cache of the syntax highlighted (html) sources of the matches for the Code Duplication Detector
+html report. Entries are keyed by lexer name and the digest of the source, hence the identical
+fragments are highlighted only once. Cache is saved beside the report, so the report can be
+created again without running Pygments for the same matches.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import hashlib
+import logging
+import pickle
+import tempfile
+
+import pygments
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+
+HIGHLIGHT_CACHE_VERSION = 1
+HIGHLIGHT_CACHE_EXTENSION = '.hlcache'
+
+FORMATTER = HtmlFormatter(encoding='utf-8')
+
+
+def highlight_source(lexer_source):
+    '''
+    return the syntax highlighted html of the source. Argument is (lexer, source code) tuple so
+    that the function can be used with multiprocessing pool.
+    '''
+    lexer, source_code = lexer_source
+    # token tables of a lexer class are created when the class is instantiated first time. In a
+    # worker process, the unpickled lexer may not have them, hence lexer is created again.
+    lexer = type(lexer)(**lexer.options)
+    highlighted = highlight(source_code, lexer, FORMATTER, outfile=None)
+    # out of 'highlight' function is string, encoded with 'FORMATTER.encoding'. Hence we have to
+    # decode it with appropriate encoding and then covert it to unicode.
+    return str(highlighted.decode(FORMATTER.encoding))
+
+
+class HighlightCache(object):
+    '''
+    highlighted html of the sources keyed by (lexer name, source digest)
+    '''
+
+    def __init__(self):
+        self.version = (HIGHLIGHT_CACHE_VERSION, pygments.__version__)
+        self.entries = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    @staticmethod
+    def get_key(lexer, source_code):
+        digest = hashlib.sha1(source_code.encode('utf-8', 'surrogatepass')).digest()
+        return (lexer.name, digest)
+
+    def add(self, key, highlighted):
+        self.entries[key] = highlighted
+
+    def get(self, lexer, source_code):
+        '''
+        return the highlighted html of the source. Source is highlighted if it is not in
+        the cache.
+        '''
+        key = self.get_key(lexer, source_code)
+        highlighted = self.entries.get(key)
+        if highlighted is None:
+            self.misses = self.misses + 1
+            highlighted = highlight_source((lexer, source_code))
+            self.entries[key] = highlighted
+        else:
+            self.hits = self.hits + 1
+        return highlighted
+
+    @staticmethod
+    def get_cache_file(reportfile):
+        return reportfile + HIGHLIGHT_CACHE_EXTENSION
+
+    @classmethod
+    def load(cls, cachefile):
+        '''
+        load the cache saved earlier. Returns an empty cache if the file is not there or
+        it was saved by a different version (of this module or of Pygments).
+        '''
+        try:
+            with open(cachefile, 'rb') as cachef:
+                cache = pickle.load(cachef)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError) as exp:
+            logging.info("unable to load highlight cache %s : %s" % (cachefile, exp))
+            return cls()
+        if not isinstance(cache, cls) or cache.version != (HIGHLIGHT_CACHE_VERSION, pygments.__version__):
+            return cls()
+        cache.hits = 0
+        cache.misses = 0
+        return cache
+
+    def save(self, cachefile, keys=None):
+        '''
+        save the cache. If 'keys' is given, only those entries are saved (e.g. the entries used
+        by the current report). Cache is written to a temporary file first and then renamed.
+        '''
+        if keys is not None:
+            self.entries = dict((key, self.entries[key]) for key in keys if key in self.entries)
+        cachedir = os.path.dirname(os.path.abspath(cachefile))
+        fd, tmppath = tempfile.mkstemp(dir=cachedir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as cachef:
+                pickle.dump(self, cachef, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, cachefile)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
@@ -0,0 +1,135 @@
+'''
+intervalindex.py
+Interval tree used by the MatchStore to find the matches containing a new match in a file.
+The tree is a treap ordered on the start position. Every node also keeps the largest end of
+its subtree, hence the subtrees which cannot contain the query range are skipped. Add, remove
+and query are O(log n) on average (plus k for the k intervals found), even if some of the
+intervals are very long.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+import random
+
+
+class _Node(object):
+    __slots__ = ('start', 'end', 'value', 'priority', 'left', 'right', 'maxend')
+
+    def __init__(self, start, end, value):
+        self.start = start
+        self.end = end
+        self.value = value
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.maxend = end
+
+    def update(self):
+        maxend = self.end
+        if self.left is not None and self.left.maxend > maxend:
+            maxend = self.left.maxend
+        if self.right is not None and self.right.maxend > maxend:
+            maxend = self.right.maxend
+        self.maxend = maxend
+
+
+def _split(node, start):
+    '''
+    split the tree in the nodes starting before 'start' and the nodes starting at or after it
+    '''
+    if node is None:
+        return None, None
+    if node.start < start:
+        node.right, right = _split(node.right, start)
+        node.update()
+        return node, right
+    left, node.left = _split(node.left, start)
+    node.update()
+    return left, node
+
+
+def _merge(left, right):
+    '''
+    merge two trees. All the nodes of 'left' start at or before the nodes of 'right'
+    '''
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+def _remove(node, start, end, value):
+    '''
+    remove the interval from the tree. Returns the new root of the tree and True if the
+    interval was found
+    '''
+    if node is None:
+        return None, False
+    if start < node.start:
+        node.left, removed = _remove(node.left, start, end, value)
+    elif start > node.start:
+        node.right, removed = _remove(node.right, start, end, value)
+    elif node.end == end and node.value == value:
+        return _merge(node.left, node.right), True
+    else:
+        # intervals with the same start can be on both the sides
+        node.left, removed = _remove(node.left, start, end, value)
+        if not removed:
+            node.right, removed = _remove(node.right, start, end, value)
+    if removed:
+        node.update()
+    return node, removed
+
+
+class IntervalIndex(object):
+    '''
+    closed intervals [start, end] with a value (e.g. match key) for every interval
+    '''
+
+    def __init__(self):
+        self.root = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, start, end, value):
+        assert start <= end
+        left, right = _split(self.root, start)
+        self.root = _merge(_merge(left, _Node(start, end, value)), right)
+        self.count = self.count + 1
+
+    def remove(self, start, end, value):
+        '''
+        remove the interval. Returns False if the interval is not there.
+        '''
+        self.root, removed = _remove(self.root, start, end, value)
+        if removed:
+            self.count = self.count - 1
+        return removed
+
+    def containing(self, start, end):
+        '''
+        yields the values of intervals containing [start, end]
+        '''
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.maxend < end:
+                continue
+            stack.append(node.left)
+            if node.start <= start:
+                if node.end >= end:
+                    yield node.value
+                stack.append(node.right)
@@ -11,10 +11,19 @@ TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 
 '''
 
-import codecs
+import zlib
+from array import array
 from . import tokenizer
+from .hashindex import HashIndex
+from .intervalindex import IntervalIndex
+from .sourcelines import LINE_INDEXES
 from functools import reduce
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 try:
     from .svn_blame import *
     BLAME_SUPPORT = True
@@ -95,7 +104,8 @@ class MatchSet(object):
 
     def addMatch(self, matchlen, matchstart, matchend):
         '''
-        add the match information in the match data set
+        add the match information in the match data set. Returns the MatchData if it is
+        added (i.e. it was not there in the set).
         '''
         revisioninfo = (None, None)
 
@@ -107,9 +117,12 @@ class MatchSet(object):
                 dupFileName, startlinenum, endlinenum)
 
         matchdata = MatchData(matchlen, matchstart, matchend, revisioninfo)
+        if matchdata in self.matchset:
+            return None
         self.matchset.add(matchdata)
         if self.firstMatch is None:
             self.firstMatch = matchdata
+        return matchdata
 
     @property
     def matchedlines(self):
@@ -126,21 +139,44 @@ class MatchSet(object):
     def __iter__(self):
         return self.matchset.__iter__()
 
+    def removeFile(self, srcfile):
+        '''
+        remove the matches in the given source file. Returns True if any match is removed.
+        '''
+        matchset = set(matchdata for matchdata in self.matchset if matchdata.srcfile() != srcfile)
+        if len(matchset) == len(self.matchset):
+            return False
+        self.matchset = matchset
+        if self.firstMatch is not None and self.firstMatch.srcfile() == srcfile:
+            self.firstMatch = min(self.matchset) if self.matchset else None
+        return True
+
+    def removeMatch(self, matchdata):
+        '''
+        remove the given MatchData object (not an equal match added later). Returns True if
+        it is removed.
+        '''
+        if not any(existing is matchdata for existing in self.matchset):
+            return False
+        self.matchset.remove(matchdata)
+        if self.firstMatch is matchdata:
+            self.firstMatch = min(self.matchset) if self.matchset else None
+        return True
+
     def getMatchSource(self):
         '''
         extract the source code from the first file in matchset.
         '''
         match = self.firstMatch
-        with codecs.open(match.srcfile(), "rb", encoding='utf-8', errors='ignore') as src:
-            for i in range(match.getStartLine()):
-                src.readline()
-            return [src.readline() for i in range(match.getLineCount())]
+        return LINE_INDEXES.get(match.srcfile()).get_lines(match.getStartLine(),
+                                                           match.getLineCount())
 
     def getSourceLexer(self):
         '''
-        get lexer for firstMatch of this matcheset
+        get lexer for firstMatch of this matcheset. (File has matches, hence its lexer was
+        found from the extension or from the content.)
         '''
-        return tokenizer.Tokenizer.get_lexer_for_file(self.firstMatch.srcfile())
+        return tokenizer.Tokenizer.get_lexer_for_file(self.firstMatch.srcfile(), sniff=True)
 
     def getDuplicateLineCount(self):
         '''
@@ -155,23 +191,226 @@ class MatchStore(object):
     '''
     store the hashes and duplicates (i.e.matches)
     '''
-    def __init__(self, minmatch, blameflag):
+    def __init__(self, minmatch, blameflag, trackfiles=False):
         self.minmatch = minmatch
         self.blameflag = blameflag
-        self.hashset = dict()
+        self.hashset = HashIndex()  # hash key -> (file id, token index) postings
         self.matchlist = dict()
+        # token lists of the files added. Postings refer these by file id.
+        self.filetokens = list()
+        self.file_ids = dict()
+        # hash keys added for every file. Required for removing a file later (e.g. incremental
+        # update of the duplication index)
+        self.filekeys = dict() if trackfiles else None
+        # matches are found while adding a file (i.e. current file). Matches ((match key,
+        # MatchData) tuples) found while adding a file and the number of nested matches ignored
+        # are tracked per file, so that removing the file retracts them too.
+        self.currentfile = None
+        self.filematches = dict() if trackfiles else None
+        self.filenested = dict() if trackfiles else None
+        # source file -> IntervalIndex of the (charpos) ranges of the matches in the file
+        self.intervals = dict()
+        self.nestedmatches = 0  # number of matches ignored since they are nested in other matches
+        # if candidates (set of hash keys) is given, only the hashes of candidate keys are
+        # stored. (e.g. keys seen more than once in the first pass of prefilter mode)
+        self.candidates = None
+
+    def getHashKey(self, rhash, duptoken):
+        '''
+        create a new hash with (rolling hash value and actual token string). Python 'hash' of
+        string changes from process to process. Hence CRC32 of the token string is used to make
+        the key same across processes (e.g. when matchstore is saved and loaded again)
+        '''
+        return (rhash << 32) | self.getValueKey(duptoken.value)
 
-    def addHash(self, rhash, duptoken):
-        # create a new hash with (rolling hash value and actual token string)
-        rhash = hash((rhash, duptoken.value))
-        hashdata = self.hashset.setdefault(rhash, list())
-        hashdata.append(duptoken)
-        self.hashset[rhash] = hashdata
+    def getValueKey(self, value):
+        '''
+        token value part (lower 32 bits) of the hash key
+        '''
+        return zlib.crc32(value.encode('utf-8', 'surrogatepass'))
+
+    def addTokens(self, filetokens):
+        '''
+        add the FileTokens of a source file. Has to be called before adding the hashes of
+        the file. Duptokens returned by getHashMatch are created from these token lists.
+        '''
+        srcfile = filetokens.srcfile
+        self.currentfile = srcfile
+        fileid = self.file_ids.get(srcfile)
+        if fileid is None:
+            fileid = len(self.filetokens)
+            self.file_ids[srcfile] = fileid
+            self.filetokens.append(filetokens)
+        else:
+            self.filetokens[fileid] = filetokens
+        return fileid
+
+    def addHashKeys(self, filetokens, keys, tokenindices):
+        '''
+        add the hash keys (see getHashKey) of all the windows of a file. 'tokenindices' are the
+        indices of the first tokens of the windows in filetokens. Both are lists or NumPy
+        arrays. Keys are added in bulk.
+        '''
+        if self.candidates is not None:
+            keys, tokenindices = self.selectCandidates(keys, tokenindices)
+        if hasattr(keys, 'tolist'):
+            keys, tokenindices = keys.tolist(), tokenindices.tolist()
+        fileid = self.file_ids[filetokens.srcfile]
+        self.hashset.add_many(keys, fileid, tokenindices)
+        if self.filekeys is not None:
+            self.filekeys.setdefault(filetokens.srcfile, array('Q')).extend(keys)
+
+    def setCandidates(self, candidates):
+        '''
+        store only the hashes with the given keys (sorted NumPy array or a set). Hashes with
+        other keys cannot have any match.
+        '''
+        self.candidates = candidates
+
+    def selectCandidates(self, keys, tokenindices):
+        '''
+        return the candidate keys and their token indices. NumPy arrays are filtered with
+        numpy.isin.
+        '''
+        candidates = self.candidates
+        if numpy is not None and isinstance(candidates, numpy.ndarray):
+            selected = numpy.isin(numpy.asarray(keys, dtype=numpy.uint64), candidates)
+            return numpy.asarray(keys)[selected], numpy.asarray(tokenindices)[selected]
+        selected = [i for i, key in enumerate(keys) if key in candidates]
+        return [keys[i] for i in selected], [tokenindices[i] for i in selected]
 
     def getHashMatch(self, rhash, duptoken):
-        # create a new hash with (rolling hash value and actual token string)
-        rhash = hash((rhash, duptoken.value))
-        return(self.hashset.get(rhash))
+        '''
+        return the list of duptokens added with the same rolling hash and token value as
+        duptoken (or None)
+        '''
+        rhash = self.getHashKey(rhash, duptoken)
+        postings = self.hashset.get(rhash)
+        if postings is None:
+            return None
+        filetokens = self.filetokens
+        return [filetokens[fileid][tokenidx] for fileid, tokenidx in postings]
+
+    def getHashKeyCount(self, key):
+        '''
+        return the number of duptokens added with the hash key. Faster than
+        len(getHashMatch(...)) since the duptokens are not created.
+        '''
+        return self.hashset.count(key)
+
+    def getMatchSet(self, matchkey):
+        return self.matchlist.get(matchkey)
+
+    def getMatchKey(self, starthash, matchlen, is_same):
+        '''
+        return the key of a match of 'matchlen' tokens. Key is (start window hash, matchlen).
+        Existing match set with same key is verified with is_same(first match of the set). If
+        tokens are different (i.e. hash collision), a sequence number is added to the key.
+        '''
+        matchkey = (starthash, matchlen)
+        seqno = 0
+        matchset = self.matchlist.get(matchkey)
+        while matchset is not None and not is_same(matchset.firstMatch):
+            seqno = seqno + 1
+            matchkey = (starthash, matchlen, seqno)
+            matchset = self.matchlist.get(matchkey)
+        return matchkey
+
+    def removeFile(self, srcfile):
+        '''
+        remove the hashes of the given source file, the matches found while adding it and the
+        matches in it. Returns the list of match sets affected by the removal. Requires
+        'trackfiles' flag. Removing the files in the reverse order of adding them is faster
+        since the matches in a file are found while adding it or a later file.
+        '''
+        assert self.filekeys is not None
+        keys = self.filekeys.pop(srcfile, None)
+        fileid = self.file_ids.get(srcfile)
+        if keys is not None and fileid is not None:
+            for key in set(keys):
+                self.hashset.remove(key, fileid)
+        if fileid is not None:
+            # file id is reused if the file is added again
+            self.filetokens[fileid] = None
+        self.nestedmatches = self.nestedmatches - self.filenested.pop(srcfile, 0)
+
+        affected = dict()
+        for matchkey, matchdata in self.filematches.pop(srcfile, []):
+            matchset = self.matchlist.get(matchkey)
+            if matchset is not None and matchset.removeMatch(matchdata):
+                self.removeInterval(matchdata, matchkey)
+                affected[matchkey] = matchset
+        index = self.intervals.get(srcfile)
+        if index is not None and len(index) > 0:
+            # matches found while adding a later file
+            for matchkey, matchset in self.matchlist.items():
+                if matchset.removeFile(srcfile):
+                    affected[matchkey] = matchset
+        self.intervals.pop(srcfile, None)
+
+        for matchkey, matchset in list(affected.items()):
+            if len(matchset) <= 1:
+                del self.matchlist[matchkey]
+                del affected[matchkey]
+                for matchdata in matchset:
+                    self.removeInterval(matchdata, matchkey)
+        return list(affected.values())
+
+    def addInterval(self, matchdata, matchkey):
+        index = self.intervals.get(matchdata.srcfile())
+        if index is None:
+            index = IntervalIndex()
+            self.intervals[matchdata.srcfile()] = index
+        index.add(matchdata.starttoken.charpos, matchdata.endtoken.charpos, matchkey)
+
+    def removeInterval(self, matchdata, matchkey):
+        index = self.intervals.get(matchdata.srcfile())
+        if index is not None:
+            index.remove(matchdata.starttoken.charpos, matchdata.endtoken.charpos, matchkey)
+
+    def getContainingMatches(self, matchstart, matchend):
+        '''
+        return the set of match keys of the matches containing the range matchstart-matchend
+        '''
+        index = self.intervals.get(matchstart.srcfile)
+        if index is None:
+            return set()
+        return set(index.containing(matchstart.charpos, matchend.charpos))
+
+    def is_nested(self, matches):
+        '''
+        check if all the ranges in 'matches' (list of (matchstart, matchend) tuples) are inside
+        the ranges of one existing match set. Such matches are duplicates of a part of the
+        existing match set. Nested matches are ignored if they create a new match set. Matches
+        with the key of an existing match set are always added to it.
+        '''
+        commonkeys = None
+        for matchstart, matchend in matches:
+            keys = self.getContainingMatches(matchstart, matchend)
+            commonkeys = keys if commonkeys is None else commonkeys.intersection(keys)
+            if not commonkeys:
+                return False
+        return True
+
+    def addToMatchSet(self, matchkey, matchlen, matches):
+        '''
+        add the ranges in 'matches' (list of (matchstart, matchend) tuples) to match set with
+        'matchkey'. Match set is stored only if it has more than one match.
+        '''
+        matchset = self.matchlist.get(matchkey)
+        if matchset is None:
+            matchset = MatchSet(self.blameflag)
+        added = [matchset.addMatch(matchlen, matchstart, matchend) for matchstart, matchend in matches]
+
+        if len(matchset) > 1:
+            if matchkey not in self.matchlist:
+                self.matchlist[matchkey] = matchset
+                added = list(matchset)
+            for matchdata in added:
+                if matchdata is not None:
+                    self.addInterval(matchdata, matchkey)
+                    if self.filematches is not None:
+                        self.filematches.setdefault(self.currentfile, list()).append((matchkey, matchdata))
 
     def is_overlapping(self, matchstart1, matchend1, matchstart2, matchend2):
         '''
@@ -187,7 +426,7 @@ class MatchStore(object):
                 (matchstart2.charpos <= matchstart1.charpos and matchstart1.charpos < matchend2.charpos)  \
                 or (matchstart2.charpos <= matchend1.charpos and matchend1.charpos < matchend2.charpos))
             
-    def addExactMatch(self, matchlen, sha1_hash, matchstart1, matchend1, matchstart2, matchend2):
+    def addExactMatch(self, matchlen, matchkey, matchstart1, matchend1, matchstart2, matchend2):
         # ensure filenames of start and end are same
         assert matchstart1[0] == matchend1[0]
         # ensure filenames of start and end are same
@@ -199,14 +438,29 @@ class MatchStore(object):
         assert matchlen >= self.minmatch
 
         if not self.is_overlapping(matchstart1, matchend1, matchstart2, matchend2):
-            matchset = self.matchlist.get(sha1_hash)
-            if matchset is None:
-                matchset = MatchSet(self.blameflag)
-            matchset.addMatch(matchlen, matchstart1, matchend1)
-            matchset.addMatch(matchlen, matchstart2, matchend2)
-
-            if len(matchset) > 1:
-                self.matchlist[sha1_hash] = matchset
+            matches = [(matchstart1, matchend1), (matchstart2, matchend2)]
+            if matchkey not in self.matchlist and self.is_nested(matches):
+                self.addNestedMatch()
+            else:
+                self.addToMatchSet(matchkey, matchlen, matches)
+
+    def addNestedMatch(self):
+        self.nestedmatches = self.nestedmatches + 1
+        if self.filenested is not None:
+            self.filenested[self.currentfile] = self.filenested.get(self.currentfile, 0) + 1
+
+    def addMatchGroup(self, matchlen, matchkey, matches):
+        '''
+        add a group of matches of the same token sequence found together (e.g. by the suffix
+        array detector). 'matches' is a list of (matchstart, matchend) tuples
+        '''
+        assert matchlen >= self.minmatch
+        for matchstart, matchend in matches:
+            assert matchstart[0] == matchend[0]
+        if matchkey not in self.matchlist and self.is_nested(matches):
+            self.addNestedMatch()
+        else:
+            self.addToMatchSet(matchkey, matchlen, matches)
         
     def iter_matches(self):
         # print "number hashes : %d" % len(self.hashset)
@@ -0,0 +1,327 @@
+'''
+minhashdetect.py
+Near-miss (Type-3) clone detection using MinHash and LSH (locality sensitive hashing). Files
+are divided in overlapping blocks of tokens, a block starts at first token of every line. (Hence
+the blocks of copied code are aligned even if some lines are inserted or deleted.) MinHash
+signature of every block is computed over its token shingles (sequence of a few tokens).
+Blocks with same signature in any LSH band are candidate pairs. Hence the candidates are found
+without comparing all pairs of blocks. Blocks with identical signatures (e.g. the rows of a table)
+are collapsed in one group before pairing, hence the pairs are not quadratic in the group size.
+Candidates are verified by computing the (Jaccard)
+similarity of their shingle sets and the consecutive similar blocks are merged into one match.
+
+reference : Leskovec, Rajaraman, Ullman, 'Mining of Massive Datasets', chapter 3
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+import random
+from array import array
+
+from .rabinkarp import token_hash
+
+try:
+    import numpy
+    from numpy.lib.stride_tricks import sliding_window_view
+    NUMPY_SUPPORT = True
+except ImportError:
+    NUMPY_SUPPORT = False
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+SHINGLE_PRIME = 0x100000001B3  # FNV 64 bit prime
+SHINGLE_SIZE = 4  # number of tokens in a shingle
+NUM_PERMUTATIONS = 64  # number of hash functions in the MinHash signature
+PERMUTATION_SEED = 12345  # signatures have to be same across runs and processes
+SIGNATURE_BATCH = 4096  # signatures are computed for the blocks in these many shingles at a time
+
+DEFAULT_SIMILARITY = 0.8
+
+
+def lsh_bands(numperm, threshold):
+    '''
+    return (bands, rows) for dividing the signature of 'numperm' hashes in LSH bands. Pairs
+    with similarity more than (1/bands)**(1/rows) are likely to be candidates, hence the
+    values for which it is nearest to the threshold are selected.
+    '''
+    choices = [(bands, numperm // bands) for bands in range(1, numperm + 1) if numperm % bands == 0]
+    return min(choices, key=lambda choice: abs((1.0 / choice[0]) ** (1.0 / choice[1]) - threshold))
+
+
+def permutations(numperm, seed=PERMUTATION_SEED):
+    '''
+    return the (multiplier, increment) of the hash functions. Hash of a shingle x is upper 32
+    bits of (multiplier * x + increment) mod 2**64. Multiplier is odd.
+    '''
+    rand = random.Random(seed)
+    return [(rand.getrandbits(64) | 1, rand.getrandbits(64)) for i in range(numperm)]
+
+
+def jaccard(set1, set2):
+    if not set1 and not set2:
+        return 1.0
+    return len(set1 & set2) / float(len(set1 | set2))
+
+
+class MinHashDetector(object):
+    '''
+    Detect the similar blocks of tokens in all files. Blocks are 'chunk' tokens long (at least
+    two shingles) and a new block starts at the first token of every line.
+    '''
+
+    def __init__(self, chunk, min_lines, matchstore, tokenstore, similarity=DEFAULT_SIMILARITY,
+                 numperm=NUM_PERMUTATIONS):
+        assert 0.0 < similarity <= 1.0
+        self.shingle = SHINGLE_SIZE
+        self.blocksize = max(chunk, 2 * self.shingle)  # number of tokens in a block
+        self.min_lines = min_lines  # minimum number of lines to match.
+        self.similarity = similarity
+        self.matchstore = matchstore
+        self.tokenstore = tokenstore
+        self.bands, self.rows = lsh_bands(numperm, similarity)
+        self.permutations = permutations(numperm)
+        self.filetokens = list()
+        self.shingles = list()  # file index -> shingle hashes of the file
+        self.blockstarts = list()  # file index -> token index of the start of every block
+        self.signatures = list()  # file index -> MinHash signatures of the blocks of the file
+        self.candidates = 0  # number of candidate pairs found with LSH
+        self.verified = 0  # number of candidate pairs with similarity above threshold
+
+    def addTokens(self, filetokens):
+        '''
+        add the FileTokens of one source file and compute the signatures of its blocks.
+        '''
+        assert filetokens.tokenstore is self.tokenstore
+        self.filetokens.append(filetokens)
+        shingles = self.getShingles(filetokens)
+        blockstarts = self.getBlockStarts(filetokens)
+        self.shingles.append(shingles)
+        self.blockstarts.append(blockstarts)
+        self.signatures.append(self.getSignatures(shingles, blockstarts))
+
+    def getBlockStarts(self, filetokens):
+        '''
+        return the token indices of first tokens of the lines (with at least a block of tokens
+        after it)
+        '''
+        linenos = filetokens.linenos
+        return array('I', [i for i in range(len(linenos) - self.blocksize + 1)
+                           if i == 0 or linenos[i] != linenos[i - 1]])
+
+    def getShingles(self, filetokens):
+        '''
+        return the hashes of all the shingles of the file. Hash of the shingle at index i is
+        computed from the token hashes of tokens i to i+SHINGLE_SIZE-1.
+        '''
+        tokenhashes = self.tokenstore.vocabulary.get_hash_table(token_hash)
+        numshingles = max(0, len(filetokens) - self.shingle + 1)
+        if NUMPY_SUPPORT:
+            hashes = numpy.frombuffer(tokenhashes, dtype=numpy.uint32)
+            valuehashes = hashes[numpy.frombuffer(filetokens.valueids, dtype=numpy.uint32)].astype(numpy.uint64)
+            shingles = numpy.zeros(numshingles, dtype=numpy.uint64)
+            for i in range(self.shingle):
+                shingles = shingles * numpy.uint64(SHINGLE_PRIME) + valuehashes[i:i + numshingles]
+            return shingles
+
+        valueids = filetokens.valueids
+        shingles = array('Q')
+        for start in range(numshingles):
+            shingle = 0
+            for i in range(start, start + self.shingle):
+                shingle = (shingle * SHINGLE_PRIME + tokenhashes[valueids[i]]) & MASK64
+            shingles.append(shingle)
+        return shingles
+
+    def getBlockShingles(self, fileidx, blockidx):
+        start = self.blockstarts[fileidx][blockidx]
+        return self.shingles[fileidx][start:start + self.blocksize - self.shingle + 1]
+
+    def getSignatures(self, shingles, blockstarts):
+        '''
+        return the MinHash signatures (one row of NUM_PERMUTATIONS values per block). Shingles
+        are hashed for a batch of blocks at a time, hence the memory used does not depend on
+        the file size.
+        '''
+        if len(blockstarts) == 0:
+            return list()
+        blockshingles = self.blocksize - self.shingle + 1
+        if NUMPY_SUPPORT:
+            multipliers = numpy.array([a for a, b in self.permutations], dtype=numpy.uint64)
+            increments = numpy.array([b for a, b in self.permutations], dtype=numpy.uint64)
+            starts = numpy.frombuffer(blockstarts, dtype=numpy.uint32)
+            signatures = numpy.empty((len(starts), len(self.permutations)), dtype=numpy.uint32)
+            first = 0
+            while first < len(starts):
+                last = max(first + 1, int(numpy.searchsorted(starts, starts[first] + SIGNATURE_BATCH)))
+                low, high = int(starts[first]), int(starts[last - 1]) + blockshingles
+                hashed = (multipliers[:, None] * shingles[None, low:high] + increments[:, None]) >> numpy.uint64(32)
+                # minimum of the window starting at every shingle and then select the block starts
+                minimums = sliding_window_view(hashed, blockshingles, axis=1).min(axis=2)
+                signatures[first:last] = minimums[:, starts[first:last] - low].T
+                first = last
+            return signatures
+
+        signatures = list()
+        for start in blockstarts:
+            block = shingles[start:start + blockshingles]
+            signatures.append(tuple(min((((a * x) + b) & MASK64) >> 32 for x in block)
+                                    for a, b in self.permutations))
+        return signatures
+
+    def getBandKey(self, signature, band):
+        values = signature[band * self.rows:(band + 1) * self.rows]
+        if NUMPY_SUPPORT:
+            return (band, values.tobytes())
+        return (band, values)
+
+    def getSignatureKey(self, signature):
+        if NUMPY_SUPPORT:
+            return signature.tobytes()
+        return signature
+
+    def findCandidates(self):
+        '''
+        return set of candidate pairs of blocks ((file index, block index) tuples). Blocks with
+        identical signatures are one group and every block is paired with one earlier block of
+        its group only (see getGroupPartner). First blocks of the groups having same signature
+        values in at least one LSH band are paired.
+        '''
+        candidates = set()
+        groups = dict()  # signature -> group id
+        firsts = list()  # group id -> first block of the group
+        groupids = list()  # file index -> group id of every block of the file
+        members = dict()  # (group id, file index) -> blocks of the group in the file
+        for fileidx, signatures in enumerate(self.signatures):
+            groupids.append(array('I'))
+            partner = None
+            for blockidx, signature in enumerate(signatures):
+                groupid = groups.setdefault(self.getSignatureKey(signature), len(firsts))
+                if groupid == len(firsts):
+                    firsts.append((fileidx, blockidx))
+                groupids[fileidx].append(groupid)
+                filemembers = members.setdefault((groupid, fileidx), list())
+                partner = self.getGroupPartner((fileidx, blockidx), partner, groupids,
+                                               firsts[groupid], filemembers)
+                if partner is not None:
+                    candidates.add((partner, (fileidx, blockidx)))
+                filemembers.append(blockidx)
+
+        buckets = dict()
+        for fileidx, blockidx in firsts:
+            signature = self.signatures[fileidx][blockidx]
+            for band in range(self.bands):
+                buckets.setdefault(self.getBandKey(signature, band), list()).append((fileidx, blockidx))
+
+        for blocks in buckets.values():
+            for i, block1 in enumerate(blocks):
+                for block2 in blocks[i + 1:]:
+                    # overlapping blocks of the same file are always similar.
+                    if block1[0] == block2[0] and self.isOverlapping(block1, block2):
+                        continue
+                    candidates.add((block1, block2))
+        return candidates
+
+    def getGroupPartner(self, block, prevpartner, groupids, first, filemembers):
+        '''
+        return the earlier block of the group of 'block' to pair it with (or None). Blocks are
+        paired on the diagonal of the previous block (i.e. copied region continues), else with
+        the last block of the group not overlapping it in the same file, else with the first
+        block of the group. 'filemembers' are the earlier blocks of the group in the same file.
+        '''
+        fileidx, blockidx = block
+        groupid = groupids[fileidx][blockidx]
+        if prevpartner is not None:
+            file2, block2 = prevpartner[0], prevpartner[1] + 1
+            if block2 < len(groupids[file2]) and groupids[file2][block2] == groupid and \
+                    (file2 != fileidx or not self.isRegionOverlapping(fileidx, block2, blockidx, 1)):
+                return (file2, block2)
+        starts = self.blockstarts[fileidx]
+        for member in reversed(filemembers):
+            if starts[blockidx] - starts[member] >= self.blocksize:
+                return (fileidx, member)
+        if first[0] != fileidx:
+            return first
+        return None
+
+    def isOverlapping(self, block1, block2):
+        starts = self.blockstarts[block1[0]]
+        return abs(starts[block2[1]] - starts[block1[1]]) < self.blocksize
+
+    def isRegionOverlapping(self, fileidx, block1, block2, length):
+        '''
+        check if the region of 'length' blocks starting at block1 overlaps the region starting
+        at block2 (block1 < block2) in the same file
+        '''
+        starts = self.blockstarts[fileidx]
+        return starts[block1 + length - 1] + self.blocksize > starts[block2]
+
+    def isSimilar(self, block1, block2):
+        shingles1 = set(self.getBlockShingles(*block1))
+        shingles2 = set(self.getBlockShingles(*block2))
+        return jaccard(shingles1, shingles2) >= self.similarity
+
+    def findMatches(self):
+        '''
+        find the similar blocks and add the merged runs of similar blocks to the matchstore.
+        '''
+        candidates = self.findCandidates()
+        similar = set(pair for pair in candidates if self.isSimilar(*pair))
+        self.candidates = len(candidates)
+        self.verified = len(similar)
+
+        regions = list()
+        for (file1, block1), (file2, block2) in similar:
+            # start of a run of similar blocks on the same diagonal
+            if ((file1, block1 - 1), (file2, block2 - 1)) in similar:
+                continue
+            length = 1
+            while ((file1, block1 + length), (file2, block2 + length)) in similar:
+                length = length + 1
+            if file1 == file2 and self.isRegionOverlapping(file1, block1, block2, length):
+                block1, block2, length = self.collapseRun(file1, block1, block2, length)
+                if length == 0:
+                    continue
+            regions.append((length, file1, block1, file2, block2))
+
+        # longer regions are added first, so that regions nested in them are ignored.
+        regions.sort(key=lambda region: (-region[0],) + region[1:])
+        for length, file1, block1, file2, block2 in regions:
+            self._addRegion(length, file1, block1, file2, block2)
+
+    def collapseRun(self, fileidx, block1, block2, length):
+        '''
+        region of similar blocks overlapping its copy in the same file is a periodic run (e.g.
+        table of similar rows). Returns (block1, block2, length) of the first and second half of
+        the run (rounded to the period). Length is 0 if the halves cannot be separated.
+        '''
+        starts = self.blockstarts[fileidx]
+        period = block2 - block1
+        runlen = length + period
+        repeats = (runlen + 2 * period - 1) // (2 * period)
+        length = runlen - repeats * period
+        block2 = block1 + repeats * period
+        # last block of the first half may still overlap the first block of the second half
+        while length > 0 and self.isRegionOverlapping(fileidx, block1, block2, length):
+            length = length - 1
+        return block1, block2, length
+
+    def _addRegion(self, length, file1, block1, file2, block2):
+        tokens1 = self.filetokens[file1]
+        tokens2 = self.filetokens[file2]
+        starts1 = self.blockstarts[file1]
+        starts2 = self.blockstarts[file2]
+        start1, end1 = starts1[block1], starts1[block1 + length - 1] + self.blocksize - 1
+        start2, end2 = starts2[block2], starts2[block2 + length - 1] + self.blocksize - 1
+        numtokens = end1 - start1 + 1
+        matchstart1, matchend1 = tokens1[start1], tokens1[end1]
+        matchstart2, matchend2 = tokens2[start2], tokens2[end2]
+        if matchend1.lineno - matchstart1.lineno >= self.min_lines and \
+                matchend2.lineno - matchstart2.lineno >= self.min_lines:
+            # match sets are keyed by the first region. Regions similar to the same region
+            # are in one match set.
+            matchkey = ('similar', matchstart1.srcfile, start1, end1)
+            self.matchstore.addExactMatch(numtokens, matchkey, matchstart1, matchend1,
+                                          matchstart2, matchend2)
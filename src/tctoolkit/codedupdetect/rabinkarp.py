@@ -16,9 +16,18 @@ import logging
 from collections import deque
 from itertools import groupby
 import operator
-import hashlib
+from array import array
 
 from . import tokenizer
+from .tokenstore import TokenStore, TokenVocabulary, VOCABULARY
+from .tokencache import TokenCache
+from ..tctoolkitutil.bloomfilter import ScalableBloomFilter
+
+try:
+    import numpy
+    NUMPY_SUPPORT = True
+except ImportError:
+    NUMPY_SUPPORT = False
 
 HASH_BASE = (256*256*256*256)  #a single token hash value is made up of 4 bytes
 HASH_MOD = 16777619  # make sure it is a prime
@@ -31,6 +40,10 @@ HASH_MOD = 16777619  # make sure it is a prime
 FNV_OFFSET_BASIS = 2166136261
 FNV_PRIME = 16777619
 
+# prefilter mode : initial capacity of the bloom filter of the keys seen. Candidate keys of the
+# files are merged in the sorted candidate array after these many keys.
+PREFILTER_CAPACITY = 1 << 20
+
 
 def int_mod(a, b):
     return (a % b + b) % b
@@ -57,6 +70,104 @@ def FNV_hash(str):
     return(fhash)
 
 
+def token_hash(token):
+    '''
+    hash of a single token value used by the rolling hash
+    '''
+    return FNV_hash(token) % HASH_BASE
+
+
+def window_hashes(tokenhashes, window_size):
+    '''
+    vectorized (NumPy) version of the rolling hash computation of RabinKarp.getHashes.
+    tokenhashes : NumPy array of token hashes (i.e. getTokenHash values) of all tokens of a file.
+    Returns NumPy array of window hashes. Window hash at index i is the polynomial hash of the
+    (at most window_size-1) tokens ending at token i. Result is same as RollingHash (bit by bit)
+    '''
+    numtokens = len(tokenhashes)
+    if numtokens < 2:
+        return numpy.zeros(0, dtype=numpy.uint32)
+    tokenhashes = tokenhashes.astype(numpy.int64) % HASH_MOD
+    hashes = numpy.zeros(numtokens - 1, dtype=numpy.int64)
+    base = HASH_BASE % HASH_MOD
+    power = 1
+    # add the contribution of the token at 'offset' positions before the end of window.
+    # values are less than 2**24, hence the products fit in 64 bit integers.
+    for offset in range(0, min(window_size - 1, numtokens - 1)):
+        hashes[offset:] = (hashes[offset:] + tokenhashes[:numtokens - 1 - offset] * power) % HASH_MOD
+        power = (power * base) % HASH_MOD
+    return hashes.astype(numpy.uint32)
+
+
+# matches shorter than this are compared token by token. Longer matches are compared in blocks.
+SHORT_MATCH = 16
+
+
+def match_length(ids1, idx1, ids2, idx2, maxlen):
+    '''
+    return the length of common prefix of ids1[idx1:] and ids2[idx2:] (at most maxlen).
+    ids1/ids2 are token id arrays. First few tokens are compared one by one. Longer matches
+    are compared in blocks of increasing size (NumPy or memoryview). Arrays are not copied.
+    '''
+    length = 0
+    shortlen = min(maxlen, SHORT_MATCH)
+    while length < shortlen and ids1[idx1 + length] == ids2[idx2 + length]:
+        length = length + 1
+    if length < shortlen:
+        return length
+
+    if NUMPY_SUPPORT:
+        view1 = numpy.frombuffer(ids1, dtype=numpy.uint32)
+        view2 = numpy.frombuffer(ids2, dtype=numpy.uint32)
+        step = 4 * SHORT_MATCH
+        while length < maxlen:
+            blocklen = min(step, maxlen - length)
+            mismatch = numpy.flatnonzero(view1[idx1 + length:idx1 + length + blocklen] !=
+                                         view2[idx2 + length:idx2 + length + blocklen])
+            if len(mismatch):
+                return length + int(mismatch[0])
+            length = length + blocklen
+            step = step * 4
+        return maxlen
+
+    view1 = memoryview(ids1)
+    view2 = memoryview(ids2)
+    step = SHORT_MATCH
+    while length < maxlen:
+        blocklen = min(step, maxlen - length)
+        if view1[idx1 + length:idx1 + length + blocklen] != view2[idx2 + length:idx2 + length + blocklen]:
+            # mismatch is in this block
+            while ids1[idx1 + length] == ids2[idx2 + length]:
+                length = length + 1
+            return length
+        length = length + blocklen
+        step = step * 2
+    return maxlen
+
+
+def window_hash(tokenhashes, valueids, idx, window_size):
+    '''
+    compute the rolling hash of the (full) window starting at token index idx. 'tokenhashes' is
+    the token hash table (indexed by token id) of the vocabulary of 'valueids'. Same as the
+    window hash computed by the RollingHash.
+    '''
+    curhash = 0
+    for i in range(idx, min(idx + window_size - 1, len(valueids))):
+        curhash = (curhash * HASH_BASE + tokenhashes[valueids[i]]) % HASH_MOD
+    return curhash
+
+
+def is_same_match(matchdata, matchtokens, tokens, idx, matchlen):
+    '''
+    check if the tokens of the matchdata are same as 'matchlen' tokens starting at idx.
+    'matchtokens' is the FileTokens of the source file of the matchdata.
+    '''
+    if matchdata.matchlen != matchlen:
+        return False
+    idx2 = matchtokens.index_of(matchdata.starttoken.charpos)
+    return match_length(tokens.valueids, idx, matchtokens.valueids, idx2, matchlen) == matchlen
+
+
 class RollingHash(object):
     '''
     separated out rolling hash algorithm so that it can be indepdently tested.
@@ -64,7 +175,7 @@ class RollingHash(object):
     window_size : window size for calculating rolling hash. Every hash is computed for 'windows_size'
      number of previous tokens.
     '''
-    def __init__(self, window_size, value_func=lambda tokendata:tokendata.value):
+    def __init__(self, window_size, value_func=lambda tokendata:tokendata.value, vocabulary=None):
         assert window_size > 1
         self.__rollhashbase = 1
         self.curhash = 0
@@ -74,14 +185,11 @@ class RollingHash(object):
         for i in range(0, self.window_size - 1):
             self.__rollhashbase = (self.__rollhashbase * HASH_BASE) % HASH_MOD
         self.tokenqueue = deque()
-        self.token_hash = dict()
+        # token hashes are memoized in the vocabulary shared by all RollingHash instances
+        self.vocabulary = vocabulary if vocabulary is not None else VOCABULARY
 
     def getTokenHash(self, token):
-        # if token size is only one charater (i.e. tokens like '{', '+' etc)
-        # then don't call FNV hash. Just use the single character.
-        thash = FNV_hash(token)
-        thash = thash % HASH_BASE
-        return(thash)
+        return self.vocabulary.get_hash(token, token_hash)
     
     def addToken(self, tokendata):
         thash = self.getTokenHash(self.value_func(tokendata))
@@ -125,7 +233,8 @@ class RabinKarp(object):
     '''
     Rabin Karp duplication detection algorithm
     '''
-    def __init__(self, chunk, min_lines, matchstore, fuzzy=False, blameflag=False):
+    def __init__(self, chunk, min_lines, matchstore, fuzzy=False, blameflag=False, tokencache=None,
+                 tokenstore=None, tokenizer_options=None):
         self.chunk = chunk  # minimum number of tokens to match
         self.min_lines = min_lines  # minimum number of lines to match.
         self.patternsize = self.chunk
@@ -133,69 +242,218 @@ class RabinKarp(object):
         self.fuzzy = fuzzy
         self.blameflag = blameflag
         self.tokenizers = dict()
+        if tokenstore is None:
+            tokenstore = TokenStore()
+        self.tokenstore = tokenstore  # interned token values shared by all tokenizers
+        self.tokencache = tokencache  # optional on-disk cache of tokens and hashes
+        self.tokenizer_options = tokenizer_options  # TokenizerOptions of the tokenizers
         self.curfilematches = 0  # number of matches found the current file.
-        self.rollinghash = RollingHash(self.chunk)
+        # (other file, diagonal offset) -> end token index (in the current file) of the last
+        # maximal match found on that diagonal.
+        self.covered = dict()
+        self.skippedmatches = 0  # pairs not compared since they are inside a known match
+        self.rollinghash = RollingHash(self.chunk, vocabulary=tokenstore.vocabulary)
+        self.valuekeys = array('I')  # matchstore value key for every token id
             
     def addAllTokens(self, srcfile):
         '''
         add all token in the srcfile to matchstore.
         '''
-        #self.curfilematches = 0
-        hashlist = list()
-        self.rollinghash.restart()
+        tknzr, hashes = self.getTokensAndHashes(srcfile)
+        self.addHashes(tknzr, hashes)
+
+    def getTokensAndHashes(self, srcfile, cachekey=None):
+        '''
+        return the tokenizer (with updated token list) and the window hashes of the srcfile.
+        If the token cache is available, unchanged files are loaded from the cache. Matchstore
+        is not modified, hence it can be called in a worker process.
+        '''
         tknzr = self.getTokanizer(srcfile)
+        if self.tokencache is None:
+            return tknzr, self.getHashes(tknzr)
+
+        key = cachekey if cachekey is not None else self.getCacheKey(tknzr)
+        cached = self.tokencache.load(key, srcfile, self.tokenstore)
+        if cached is not None:
+            filetokens, hashes = cached
+            tknzr.set_token_list(filetokens)
+        else:
+            hashes = self.getHashes(tknzr)
+            self.tokencache.store(key, tknzr.get_token_list(), hashes)
+        return tknzr, hashes
+
+    def getCacheKey(self, tknzr):
+        '''
+        return the token cache key of the source file of the tokenizer
+        '''
+        lexer = tknzr.get_lexer()
+        lexername = lexer.name if lexer is not None else ''
+        policy = tknzr.read_policy()
+        if policy != 'whole':
+            # skipped or sampled file has different tokens
+            lexername = '%s|%s|%d' % (lexername, policy, tknzr.options.max_file_size)
+        return self.tokencache.get_key(tknzr.srcfile, lexername, self.fuzzy, self.chunk)
+
+    def getHashes(self, tknzr):
+        '''
+        compute the rolling hashes for all tokens of the tokenizer. Returns array of the
+        window hashes. Hash at index i is the hash of the window ending before token i+1.
+        Uses vectorized computation if NumPy is available.
+        '''
+        if NUMPY_SUPPORT:
+            return self.getHashesVectorized(tknzr)
+        hashes = array('I')
+        self.rollinghash.restart()
         for token in tknzr:
-            curhash, firsttoken = self.addHashInMatchStore()
+            if len(self.rollinghash.tokenqueue) > 0:
+                hashes.append(self.rollinghash.curhash)
             self.rollinghash.addToken(token)
-            if curhash and firsttoken:
-                hashlist.append((firsttoken, curhash))
+        return hashes
 
-        self.detectMatches(hashlist, srcfile)
+    def getHashesVectorized(self, tknzr):
+        '''
+        NumPy version of getHashes. Token hashes are looked up from the per vocabulary token
+        hash table instead of computing the FNV hash for every token.
+        '''
+        tokens = tknzr.get_token_list()
+        tokenhashes = numpy.frombuffer(self.getTokenHashTable(len(tokens)), dtype=numpy.uint32)
+        valueids = numpy.frombuffer(tokens.valueids, dtype=numpy.uint32)
+        hashes = array('I')
+        hashes.frombytes(window_hashes(tokenhashes[valueids], self.chunk).tobytes())
+        return hashes
+
+    def getTokenHashTable(self, lookups=0):
+        '''
+        return the array of token hashes indexed by the token id. Hashes of the token values
+        added to the vocabulary since the last call are computed now.
+        '''
+        return self.tokenstore.vocabulary.get_hash_table(token_hash, lookups)
 
-        #print("Current number of matches %d" % self.curfilematches)
+    def getHashKeys(self, tknzr, hashes):
+        '''
+        return the matchstore hash keys of the window hashes of a file. Returns NumPy array
+        if NumPy is available.
+        '''
+        valueids = tknzr.get_token_list().valueids
+        valuekeys = self.getValueKeyTable()
+        window = self.rollinghash.window_size - 1
+        if not NUMPY_SUPPORT:
+            return [(curhash << 32) | valuekeys[valueids[max(0, i - window)]]
+                    for i, curhash in enumerate(hashes, 1)]
+        valueids = numpy.frombuffer(valueids, dtype=numpy.uint32)
+        valuekeys = numpy.frombuffer(valuekeys, dtype=numpy.uint32)
+        keys = numpy.frombuffer(hashes, dtype=numpy.uint32).astype(numpy.uint64) << numpy.uint64(32)
+        return keys | valuekeys[valueids[self.getFirstTokenIndices(len(hashes))]]
+
+    def getFirstTokenIndices(self, numhashes):
+        '''
+        return the index of the first token of the window of every window hash. Returns NumPy
+        array if NumPy is available.
+        '''
+        window = self.rollinghash.window_size - 1
+        if not NUMPY_SUPPORT:
+            return [max(0, i - window) for i in range(1, numhashes + 1)]
+        return numpy.maximum(numpy.arange(1, numhashes + 1) - window, 0)
 
-    def findPossibleMatches(self, hashlist):
+    def getValueKeyTable(self):
         '''
-        return location/tokens in current file with possible matches
+        return the array of matchstore value keys indexed by the token id
         '''
-        def possibledup(tokendata):
-            token, thash = tokendata
-            matches = self.matchstore.getHashMatch(thash, token)
+        values = self.tokenstore.values
+        getValueKey = self.matchstore.getValueKey
+        self.valuekeys.extend([getValueKey(values[tokenid])
+                               for tokenid in range(len(self.valuekeys), len(values))])
+        return self.valuekeys
 
-            bFoundMatch = (matches != None and len(matches) > 1)
-            return bFoundMatch
-         
-        for hasmatch, matchgroup in groupby(hashlist, possibledup):
+    def findCandidates(self, tokenized, error_rate=0.001):
+        '''
+        first pass of the prefilter (two pass) mode. 'tokenized' yields (tokenizer, window
+        hashes) of all files. Files are not kept after computing their keys. Most of the windows
+        occur only once. Hence the keys are added to a bloom filter and only keys seen again are
+        candidates. (Some candidates may be false positives. That doesn't change the matches
+        found.) Returns tuple of (candidates, total number of hashes). Candidates are a sorted
+        NumPy array if NumPy is available, else a set.
+        '''
+        seen = ScalableBloomFilter(initial_capacity=PREFILTER_CAPACITY, error_rate=error_rate)
+        totalhashes = 0
+        candidates = numpy.zeros(0, dtype=numpy.uint64) if NUMPY_SUPPORT else set()
+        pending = list()  # candidate arrays of the files not merged in candidates yet
+        numpending = 0
+        for tknzr, hashes in tokenized:
+            totalhashes = totalhashes + len(hashes)
+            keys = self.getHashKeys(tknzr, hashes)
+            self.tokenizers.pop(tknzr.srcfile, None)
+            if NUMPY_SUPPORT:
+                # keys repeated in the same file are candidates too.
+                keys, counts = numpy.unique(keys, return_counts=True)
+                found = seen.add_many(keys)
+                pending.append(keys[found | (counts > 1)])
+                numpending = numpending + len(pending[-1])
+                if numpending > PREFILTER_CAPACITY:
+                    candidates = numpy.unique(numpy.concatenate([candidates] + pending))
+                    pending, numpending = list(), 0
+            else:
+                for key in keys:
+                    if seen.add(key):
+                        candidates.add(key)
+        if pending:
+            candidates = numpy.unique(numpy.concatenate([candidates] + pending))
+        return candidates, totalhashes
+
+    def addHashes(self, tknzr, hashes):
+        '''
+        add the window hashes of a file to the matchstore and then detect the matches
+        of the file with the files added earlier. Hash keys are computed for all the windows
+        together and added in bulk. DupTokens are created only for the windows with a match.
+        '''
+        tokens = tknzr.get_token_list()
+        self.matchstore.addTokens(tokens)
+        keys = self.getHashKeys(tknzr, hashes)
+        firstidx = self.getFirstTokenIndices(len(hashes))
+        self.matchstore.addHashKeys(tokens, keys, firstidx)
+        if NUMPY_SUPPORT:
+            keys = keys.tolist()
+            firstidx = firstidx.tolist()
+        self.detectMatches(tokens, hashes, keys, firstidx)
+
+    def addTokenizer(self, tknzr):
+        '''
+        add a tokenizer created outside (e.g. in a worker process) so that the source file
+        is not tokenized again while comparing the matches.
+        '''
+        tknzr.set_token_store(self.tokenstore)
+        self.tokenizers[tknzr.srcfile] = tknzr
+
+    def findPossibleMatches(self, hashes, keys):
+        '''
+        return groups (lists of window numbers) of consecutive windows of the current file with
+        possible matches. Windows with zero hash are skipped.
+        '''
+        count = self.matchstore.getHashKeyCount
+
+        def possibledup(window):
+            return count(keys[window]) > 1
+
+        windows = [window for window, curhash in enumerate(hashes) if curhash]
+        for hasmatch, matchgroup in groupby(windows, possibledup):
             if hasmatch:
                 matchgroup = list(matchgroup)
                 if len(matchgroup) > 1:
                     yield matchgroup
 
-    def detectMatches(self, hashlist, srcfile):
+    def detectMatches(self, tokens, hashes, keys, firstidx):
         '''
-        detect matches in the hash list of current file.
+        detect matches in the window hashes of current file. 'keys' and 'firstidx' are the
+        hash keys and the first token indices of the windows.
         '''
-        for matchgroup in self.findPossibleMatches(hashlist):
-            #last duptoken in the each match group is current source file i.e. srcfile
-            starttoken, starthash = matchgroup[0]
-            endtoken, endhash = matchgroup[-1]
-            assert starttoken.srcfile == srcfile
-            assert endtoken.srcfile == srcfile
-            if (endtoken.lineno-starttoken.lineno >= self.min_lines):
-                self.findMatches(starthash, starttoken)
-    
+        self.covered.clear()
+        linenos = tokens.linenos
+        for matchgroup in self.findPossibleMatches(hashes, keys):
+            startidx = firstidx[matchgroup[0]]
+            endidx = firstidx[matchgroup[-1]]
+            if (linenos[endidx] - linenos[startidx] >= self.min_lines):
+                self.findMatches(hashes[matchgroup[0]], tokens[startidx])
 
-    def addHashInMatchStore(self):
-        '''
-        At appropriate point, the 'first token' is removed from the token queue and then 
-        the rolling hash is added to match store. Later new token is added in 'rolling hash'        
-        '''
-        curhash, firsttoken = None, None
-        if len(self.rollinghash.tokenqueue) > 0:
-            (curhash, thash, firsttoken) = self.rollinghash.firstToken()
-            self.matchstore.addHash(curhash, firsttoken)
-        return curhash, firsttoken
-        
     def findMatches(self, curhash, tokendata1):
         '''
         search for matches for the current rolling hash in the matchstore.
@@ -205,17 +463,30 @@ class RabinKarp(object):
 
         matches = self.matchstore.getHashMatch(curhash, tokendata1)
         assert matches != None
-        
+        tokens1 = self.getTokanizer(tokendata1.srcfile).get_token_list()
+        idx1 = tokens1.index_of(tokendata1.charpos)
+
         for tokendata2 in filter(lambda tokendata: tokendata1 != tokendata, matches):
-            matchlen, sha1_hash, match_end1, match_end2 = self.findMatchLength(tokendata1, tokendata2)
+            # if the tokendata1 is inside the match found earlier on the same diagonal, then
+            # the match is just a suffix of that match.
+            tokens2 = self.getTokanizer(tokendata2.srcfile).get_token_list()
+            diagonal = (tokendata2.srcfile, idx1 - tokens2.index_of(tokendata2.charpos))
+            if idx1 < self.covered.get(diagonal, 0):
+                self.skippedmatches = self.skippedmatches + 1
+                continue
+            matchlen, match_end1, match_end2 = self.findMatchLength(tokendata1, tokendata2)
+            # overlapping matches in the same file are ignored. Their suffixes may not overlap.
+            if tokendata2.srcfile != tokendata1.srcfile or abs(diagonal[1]) >= matchlen:
+                self.covered[diagonal] = idx1 + matchlen
 
             # matchlen has to be at least pattern size
             # and matched line count has to be atleast self.min_lines
             if matchlen >= self.patternsize and (match_end1.lineno - tokendata1.lineno) >= self.min_lines \
                     and (match_end2.lineno - tokendata2.lineno) >= self.min_lines:
                 # add the exact match to match store.
+                matchkey = self.getMatchKey(curhash, tokens1, idx1, matchlen)
                 self.matchstore.addExactMatch(
-                    matchlen, sha1_hash, tokendata1, match_end1, tokendata2, match_end2)
+                    matchlen, matchkey, tokendata1, match_end1, tokendata2, match_end2)
                 maxmatchlen = max(maxmatchlen, matchlen)
                 self.curfilematches = self.curfilematches + 1
 
@@ -224,11 +495,11 @@ class RabinKarp(object):
     def findMatchLength(self, tokendata1, tokendata2):
         '''
         find how many tokens (characters) are matching between tokendata1 and tokendata2.
+        Returns tuple of (matchlen, last matching token 1, last matching token 2)
         '''
         matchend1 = None
         matchend2 = None
         matchlen = 0
-        sha1_hash = None
 
         # make a basic sanity check token value is same
         # if the filename is same then distance between the token positions has to be at least patternsize
@@ -244,18 +515,48 @@ class RabinKarp(object):
 
             assert tknzr1.srcfile == tokendata1.srcfile
             assert tknzr2.srcfile == tokendata2.srcfile
-            sha1 = hashlib.sha1()
+            tokens1 = tknzr1.get_token_list()
+            tokens2 = tknzr2.get_token_list()
+            idx1 = tokens1.index_of(tokendata1.charpos)
+            idx2 = tokens2.index_of(tokendata2.charpos)
 
-            for matchdata1, matchdata2 in zip(tknzr1.get_tokens_frompos(tokendata1.charpos), tknzr2.get_tokens_frompos(tokendata2.charpos)):
-                if matchdata1.value != matchdata2.value:
-                    break
-                sha1.update(matchdata1.value.encode('utf-8'))
-                matchend1 = matchdata1
-                matchend2 = matchdata2
-                matchlen = matchlen + 1
-            sha1_hash = sha1.digest()
+            # both tokenizers share the same token store. Hence comparing the token ids is
+            # same as comparing the token values.
+            valueids1 = tokens1.valueids
+            valueids2 = tokens2.valueids
+            maxlen = min(len(valueids1) - idx1, len(valueids2) - idx2)
+            matchlen = match_length(valueids1, idx1, valueids2, idx2, maxlen)
 
-        return(matchlen, sha1_hash, matchend1, matchend2)
+            if matchlen > 0:
+                matchend1 = tokens1[idx1 + matchlen - 1]
+                matchend2 = tokens2[idx2 + matchlen - 1]
+
+        return(matchlen, matchend1, matchend2)
+
+    def getWindowHash(self, tokens, idx):
+        '''
+        compute the rolling hash of the (full) window starting at token index idx. Same as the
+        window hash computed by the RollingHash.
+        '''
+        return window_hash(self.getTokenHashTable(), tokens.valueids, idx, self.rollinghash.window_size)
+
+    def getMatchKey(self, starthash, tokens, idx, matchlen):
+        '''
+        return the matchstore key of the match of 'matchlen' tokens starting at token index idx.
+        See MatchStore.getMatchKey.
+        '''
+        if idx == 0:
+            # window hash at the start of a file may be of a partial window.
+            starthash = self.getWindowHash(tokens, idx)
+        return self.matchstore.getMatchKey(
+            starthash, matchlen, lambda matchdata: self.isSameMatch(matchdata, tokens, idx, matchlen))
+
+    def isSameMatch(self, matchdata, tokens, idx, matchlen):
+        '''
+        check if the tokens of the matchdata are same as 'matchlen' tokens starting at idx
+        '''
+        tokens2 = self.getTokanizer(matchdata.srcfile()).get_token_list()
+        return is_same_match(matchdata, tokens2, tokens, idx, matchlen)
 
     def getTokanizer(self, srcfile):
         '''
@@ -263,13 +564,29 @@ class RabinKarp(object):
         '''
         tknizer = self.tokenizers.get(srcfile)
         if tknizer == None:
-            tknizer = tokenizer.Tokenizer(srcfile, fuzzy=self.fuzzy)
+            tknizer = tokenizer.Tokenizer(srcfile, fuzzy=self.fuzzy, tokenstore=self.tokenstore,
+                                          options=self.tokenizer_options)
             self.tokenizers[srcfile] = tknizer
 
         assert tknizer.srcfile == srcfile
 
         return tknizer
 
+
+def tokenize_file(srcfile, chunk, fuzzy=False, cachedir=None, tokenizer_options=None):
+    '''
+    tokenize the srcfile and compute its rolling hashes. Module level function so that it can
+    be used with multiprocessing pool. Returns the tokenizer (with updated token list) and
+    the window hashes.
+    '''
+    tokencache = TokenCache(cachedir) if cachedir else None
+    # separate vocabulary, so that only the token values of this file are sent back to the
+    # main process.
+    rk = RabinKarp(chunk, 0, None, fuzzy, tokencache=tokencache,
+                   tokenstore=TokenStore(TokenVocabulary()), tokenizer_options=tokenizer_options)
+    return rk.getTokensAndHashes(srcfile)
+
+
 if __name__ == '__main__':
     def addtokens(rh, inputval):
         for token in inputval:
@@ -286,6 +603,36 @@ if __name__ == '__main__':
         addtokens(rhash2, inputval[1:])
         assert rhash1.curhash == rhash2.curhash
     
+    def test_window_hashes(inputval, window_size):
+        rhash = RollingHash(window_size, value_func=lambda x:x)
+        expected = list()
+        for token in inputval:
+            if len(rhash.tokenqueue) > 0:
+                expected.append(rhash.curhash)
+            rhash.addToken(token)
+        tokenhashes = numpy.array([rhash.getTokenHash(token) for token in inputval], dtype=numpy.uint32)
+        assert window_hashes(tokenhashes, window_size).tolist() == expected
+
+    def test_vocabulary():
+        vocabulary = TokenVocabulary()
+        rhash = RollingHash(5, value_func=lambda x:x, vocabulary=vocabulary)
+        addtokens(rhash, 'aabab')
+        assert (vocabulary.hits, vocabulary.misses) == (3, 2)
+        assert rhash.getTokenHash('a') == token_hash('a')
+
+    def test_match_length(length):
+        ids1 = array('I', range(1000))
+        ids2 = array('I', [5] + list(range(10, 10 + length)) + [0])
+        assert match_length(ids1, 10, ids2, 1, len(ids2) - 1) == length
+        assert match_length(ids2, 1, ids1, 10, length) == length
+
     test_rolling_hash('nitin bhide')
+    test_vocabulary()
+    for length in (0, 3, SHORT_MATCH, 100, 900):
+        test_match_length(length)
+    if NUMPY_SUPPORT:
+        test_window_hashes('never argue with idiots'.split() * 3, 5)
+        test_window_hashes(list('nitin bhide'), 20)
+        test_window_hashes(list('a'), 3)
     #test_rolling_hash('never argue with idiots')
     
\ No newline at end of file
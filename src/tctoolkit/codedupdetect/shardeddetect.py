@@ -0,0 +1,344 @@
+'''
+shardeddetect.py
+Sharded (map/reduce) duplicate detection for the code bases too large for the hash index of a
+single process.
+
+Map : every worker tokenizes one shard (subset) of the files, stores the tokens in the shared
+token cache and writes the (window hash key, posting) records into one spill file per hash
+range (partition).
+Reduce : every worker loads the spill files of one partition and groups the records on the key.
+Postings of a key are sorted on their tokens (i.e. a small suffix array of the suffixes starting
+with the same window) and the repeats are found from its lcp intervals like the suffix array
+engine does. Tokens are loaded from the shared token cache. Keys whose postings all have the same
+previous token are skipped, since such repeats are a part of a longer repeat. Hence every
+repeat is found only at its first window and it is found by one reducer only.
+
+Map and reduce functions only exchange file names (of the source files, spill files and the
+token cache directory). Hence they can run on different machines sharing a file system. The
+ShardedDetector runs them in a local process pool.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+from array import array
+from functools import partial, cmp_to_key
+
+from . import matchstore
+from .rabinkarp import RabinKarp, match_length, token_hash, window_hash, is_same_match
+from .suffixarray import supermaximal_repeats, select_occurrences
+from .tokenstore import TokenStore, TokenVocabulary
+from .tokencache import TokenCache, DEFAULT_CACHE_SIZE
+
+try:
+    import numpy
+    NUMPY_SUPPORT = True
+except ImportError:
+    NUMPY_SUPPORT = False
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+FIBONACCI_MULTIPLIER = 0x9E3779B97F4A7C15  # 2**64 / golden ratio
+SPILL_EXTENSION = '.spill'
+
+DEFAULT_PARTITIONS = 16
+
+
+def spill_file(spilldir, shardno, partition):
+    return os.path.join(spilldir, 'map%04d-part%04d%s' % (shardno, partition, SPILL_EXTENSION))
+
+
+def key_partitions(keys, partitions):
+    '''
+    return the partition number of every key. Keys are mixed with Fibonacci hashing, so that
+    every partition gets an (almost) equal hash range.
+    '''
+    if NUMPY_SUPPORT:
+        mixed = numpy.asarray(keys, dtype=numpy.uint64) * numpy.uint64(FIBONACCI_MULTIPLIER)
+        return ((mixed >> numpy.uint64(32)) * numpy.uint64(partitions)) >> numpy.uint64(32)
+    return [((((key * FIBONACCI_MULTIPLIER) & MASK64) >> 32) * partitions) >> 32 for key in keys]
+
+
+def map_shard(shard, spilldir, partitions, chunk, fuzzy=False, cachedir=None,
+              cachesize=DEFAULT_CACHE_SIZE, tokenizer_options=None):
+    '''
+    map step. 'shard' is tuple of (shard number, list of (file id, source file)). Tokens of the
+    files are stored in the token cache and the keys of the full windows are written in the
+    spill files of their partitions. Every record is (key, file id << 32 | token index).
+    Returns the list of (file id, source file, token cache key).
+    '''
+    shardno, files = shard
+    tokencache = TokenCache(cachedir, cachesize)
+    rk = RabinKarp(chunk, 0, matchstore.MatchStore(chunk, False), fuzzy, tokencache=tokencache,
+                   tokenstore=TokenStore(TokenVocabulary()), tokenizer_options=tokenizer_options)
+    window = rk.rollinghash.window_size - 1
+    spillfiles = [open(spill_file(spilldir, shardno, partition), 'wb')
+                  for partition in range(partitions)]
+    manifest = list()
+    try:
+        for fileid, srcfile in files:
+            cachekey = rk.getCacheKey(rk.getTokanizer(srcfile))
+            tknzr, hashes = rk.getTokensAndHashes(srcfile, cachekey)
+            manifest.append((fileid, srcfile, cachekey))
+            # keys of the partial windows at the start of the file are not required. Matches
+            # starting at token 0 are found from the first full window.
+            keys = rk.getHashKeys(tknzr, hashes)[window - 1:]
+            parts = key_partitions(keys, partitions)
+            if NUMPY_SUPPORT:
+                postings = (numpy.uint64(fileid) << numpy.uint64(32)) | numpy.arange(len(keys), dtype=numpy.uint64)
+                records = numpy.column_stack((keys, postings))
+                for partition in numpy.unique(parts).tolist():
+                    spillfiles[partition].write(records[parts == partition].tobytes())
+            else:
+                records = [array('Q') for partition in range(partitions)]
+                for tokenidx, (key, partition) in enumerate(zip(keys, parts)):
+                    records[partition].extend((key, (fileid << 32) | tokenidx))
+                for partition, partrecords in enumerate(records):
+                    spillfiles[partition].write(partrecords.tobytes())
+            # tokens are read again (from the cache) by the reducers.
+            rk.tokenizers.pop(srcfile, None)
+    finally:
+        for spillf in spillfiles:
+            spillf.close()
+    return manifest
+
+
+def load_partition(spilldir, numshards, partition):
+    '''
+    load the records of a partition written by all the mappers. Returns list of posting lists
+    (sorted (file id, token index) tuples) of the keys with more than one posting.
+    '''
+    records = array('Q')
+    for shardno in range(numshards):
+        with open(spill_file(spilldir, shardno, partition), 'rb') as spillf:
+            records.frombytes(spillf.read())
+    keys = records[0::2]
+    postings = records[1::2]
+
+    if NUMPY_SUPPORT:
+        keys = numpy.frombuffer(keys, dtype=numpy.uint64)
+        postings = numpy.frombuffer(postings, dtype=numpy.uint64)
+        order = numpy.lexsort((postings, keys))
+        keys = keys[order]
+        postings = postings[order]
+        boundaries = (numpy.flatnonzero(keys[1:] != keys[:-1]) + 1).tolist()
+        groups = list()
+        for start, end in zip([0] + boundaries, boundaries + [len(keys)]):
+            if end - start > 1:
+                groups.append([(posting >> 32, posting & 0xFFFFFFFF) for posting in postings[start:end].tolist()])
+        return groups
+
+    keygroups = dict()
+    for key, posting in zip(keys, postings):
+        keygroups.setdefault(key, list()).append((posting >> 32, posting & 0xFFFFFFFF))
+    return [sorted(group) for group in keygroups.values() if len(group) > 1]
+
+
+class CachedTokens(object):
+    '''
+    FileTokens of the mapped files loaded (on demand) from the token cache. 'manifest' maps the
+    file id to (source file, token cache key).
+    '''
+
+    def __init__(self, manifest, cachedir, cachesize=DEFAULT_CACHE_SIZE):
+        self.manifest = manifest
+        self.tokencache = TokenCache(cachedir, cachesize)
+        self.tokenstore = TokenStore(TokenVocabulary())
+        self.filetokens = dict()
+
+    def get(self, fileid):
+        tokens = self.filetokens.get(fileid)
+        if tokens is None:
+            srcfile, cachekey = self.manifest[fileid]
+            cached = self.tokencache.load(cachekey, srcfile, self.tokenstore)
+            if cached is None:
+                raise IOError("tokens of %s not found in the token cache" % srcfile)
+            tokens = cached[0]
+            self.filetokens[fileid] = tokens
+        return tokens
+
+    def window_hash(self, tokens, idx, window_size):
+        tokenhashes = self.tokenstore.vocabulary.get_hash_table(token_hash)
+        return window_hash(tokenhashes, tokens.valueids, idx, window_size)
+
+
+def sort_suffixes(postings, get_valueids):
+    '''
+    sort the (file id, token index) postings on the tokens starting at them. Returns the sorted
+    postings and the lcp array (lcp[i] is the number of tokens common to postings i-1 and i).
+    '''
+    def compare(posting1, posting2):
+        ids1, ids2 = get_valueids(posting1[0]), get_valueids(posting2[0])
+        len1, len2 = len(ids1) - posting1[1], len(ids2) - posting2[1]
+        length = match_length(ids1, posting1[1], ids2, posting2[1], min(len1, len2))
+        if length < min(len1, len2):
+            return -1 if ids1[posting1[1] + length] < ids2[posting2[1] + length] else 1
+        # end of file is before any token
+        if len1 != len2:
+            return -1 if len1 < len2 else 1
+        return -1 if posting1 < posting2 else 1
+
+    postings = sorted(postings, key=cmp_to_key(compare))
+    lcp = [0]
+    for (fileid1, idx1), (fileid2, idx2) in zip(postings, postings[1:]):
+        ids1, ids2 = get_valueids(fileid1), get_valueids(fileid2)
+        lcp.append(match_length(ids1, idx1, ids2, idx2, min(len(ids1) - idx1, len(ids2) - idx2)))
+    return postings, lcp
+
+
+def reduce_partition(partition, spilldir, numshards, manifest, chunk, min_lines, cachedir=None,
+                     cachesize=DEFAULT_CACHE_SIZE):
+    '''
+    reduce step. Find the repeats starting with the keys of a partition. 'manifest' maps the
+    file id to (source file, token cache key). Returns list of repeats as tuples of (matchlen,
+    start window hash, list of (file id, token index, start, end)) where start and end are
+    DupTokens.
+    '''
+    cachedtokens = CachedTokens(manifest, cachedir, cachesize)
+
+    def get_valueids(fileid):
+        return cachedtokens.get(fileid).valueids
+
+    def prevtoken(posting):
+        fileid, idx = posting
+        # every posting at the start of a file has a unique previous token
+        return get_valueids(fileid)[idx - 1] if idx > 0 else (-1 - fileid)
+
+    repeats = list()
+    for postings in load_partition(spilldir, numshards, partition):
+        # if the previous tokens of all postings are same, all the repeats are a part of the
+        # repeats starting at the previous token.
+        if len(set(prevtoken(posting) for posting in postings)) < 2:
+            continue
+        postings, lcp = sort_suffixes(postings, get_valueids)
+        prevtokens = [prevtoken(posting) for posting in postings]
+        for matchlen, leftbound, rightbound in supermaximal_repeats(lcp, prevtokens.__getitem__, chunk):
+            occurrences, matchlen = select_occurrences(sorted(postings[leftbound:rightbound + 1]),
+                                                       matchlen, get_valueids)
+            if matchlen < chunk:
+                continue
+            matches = list()
+            for fileid, idx in occurrences:
+                tokens = cachedtokens.get(fileid)
+                start, end = tokens[idx], tokens[idx + matchlen - 1]
+                if end.lineno - start.lineno >= min_lines:
+                    matches.append((fileid, idx, start, end))
+            if len(matches) > 1:
+                fileid, idx = occurrences[0]
+                starthash = cachedtokens.window_hash(cachedtokens.get(fileid), idx, chunk)
+                repeats.append((matchlen, starthash, matches))
+    return repeats
+
+
+class ShardedDetector(object):
+    '''
+    find the exact matches using map/reduce over the file shards and hash range partitions.
+    Spill files are created in 'spilldir' (temporary directory if not given). Token cache is
+    required to share the tokens between mappers and reducers. If 'cachedir' is not given, a
+    temporary cache is created inside the spill directory.
+    '''
+
+    def __init__(self, chunk, min_lines, matchstore, fuzzy=False, jobs=1,
+                 partitions=DEFAULT_PARTITIONS, spilldir=None, cachedir=None,
+                 cachesize=DEFAULT_CACHE_SIZE, tokenizer_options=None):
+        self.chunk = chunk  # minimum number of tokens to match
+        self.min_lines = min_lines  # minimum number of lines to match.
+        self.matchstore = matchstore
+        self.fuzzy = fuzzy
+        self.jobs = jobs
+        self.partitions = partitions
+        self.spilldir = spilldir
+        self.cachedir = cachedir
+        self.cachesize = cachesize
+        self.tokenizer_options = tokenizer_options  # sent to the mappers with other arguments
+
+    def getShards(self, filelist):
+        '''
+        split the files in shards (a few shards per worker so that the slow shards are balanced)
+        '''
+        numshards = max(1, min(len(filelist), self.jobs * 4))
+        files = list(enumerate(filelist))
+        return [(shardno, files[shardno::numshards]) for shardno in range(numshards)]
+
+    def findMatches(self, filelist):
+        spilldir = self.spilldir
+        if spilldir is None:
+            spilldir = tempfile.mkdtemp(prefix='cdd-')
+        elif not os.path.isdir(spilldir):
+            os.makedirs(spilldir)
+        cachedir = self.cachedir
+        if cachedir is None:
+            cachedir = os.path.join(spilldir, 'tokens')
+        shards = self.getShards(filelist)
+        try:
+            mapper = partial(map_shard, spilldir=spilldir, partitions=self.partitions,
+                             chunk=self.chunk, fuzzy=self.fuzzy, cachedir=cachedir,
+                             cachesize=self.cachesize, tokenizer_options=self.tokenizer_options)
+            manifest = dict()
+            for shardmanifest in self.__map(mapper, shards):
+                for fileid, srcfile, cachekey in shardmanifest:
+                    manifest[fileid] = (srcfile, cachekey)
+            print("Sharded detection : %d files mapped in %d shards" % (len(manifest), len(shards)))
+
+            reducer = partial(reduce_partition, spilldir=spilldir, numshards=len(shards),
+                              manifest=manifest, chunk=self.chunk, min_lines=self.min_lines,
+                              cachedir=cachedir, cachesize=self.cachesize)
+            repeats = list()
+            for partrepeats in self.__map(reducer, range(self.partitions)):
+                repeats.extend(partrepeats)
+            print("Sharded detection : %d repeats found in %d partitions\n" %
+                  (len(repeats), self.partitions))
+            # tokens are required to verify the match keys with the same start window hash
+            self.addRepeats(repeats, CachedTokens(manifest, cachedir, self.cachesize))
+        finally:
+            if self.spilldir is None:
+                shutil.rmtree(spilldir, ignore_errors=True)
+            else:
+                for shardno, files in shards:
+                    for partition in range(self.partitions):
+                        path = spill_file(spilldir, shardno, partition)
+                        if os.path.exists(path):
+                            os.remove(path)
+                if self.cachedir is None:
+                    shutil.rmtree(cachedir, ignore_errors=True)
+
+    def addRepeats(self, repeats, cachedtokens):
+        '''
+        add the repeats found by the reducers to the matchstore. Every repeat is one match group.
+        '''
+        fileids = dict((srcfile, fileid) for fileid, (srcfile, cachekey) in cachedtokens.manifest.items())
+
+        def is_same(matchdata, tokens, idx, matchlen):
+            matchtokens = cachedtokens.get(fileids[matchdata.srcfile()])
+            return is_same_match(matchdata, matchtokens, tokens, idx, matchlen)
+
+        # longer repeats are added first, so that repeats nested in them are ignored. Order is
+        # independent of the order in which the reducers finished.
+        repeats.sort(key=lambda repeat: (-repeat[0], [(fileid, idx) for fileid, idx, start, end in repeat[2]]))
+        for matchlen, starthash, matches in repeats:
+            fileid, idx = matches[0][:2]
+            tokens = cachedtokens.get(fileid)
+            matchkey = self.matchstore.getMatchKey(
+                starthash, matchlen, lambda matchdata: is_same(matchdata, tokens, idx, matchlen))
+            self.matchstore.addMatchGroup(matchlen, matchkey, [(start, end) for fileid, idx, start, end in matches])
+
+    def __map(self, func, items):
+        '''
+        call func(item) for every item in a pool of 'jobs' worker processes
+        '''
+        items = list(items)
+        if self.jobs <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            return pool.map(func, items, 1)
+        finally:
+            pool.terminate()
+            pool.join()
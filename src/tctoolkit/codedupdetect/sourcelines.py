@@ -0,0 +1,139 @@
+'''
+sourcelines.py
+Line offset index of the source files for the Code Duplication Detector. Source file is memory
+mapped (by the shared file content cache) and start offsets of all the lines are computed once.
+Hence the source of a match can be extracted without reading the file from the beginning.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+from array import array
+from collections import OrderedDict
+
+from tctoolkit.tctoolkitutil.filecontent import FILE_CONTENTS
+
+try:
+    import numpy
+    NUMPY_SUPPORT = True
+except ImportError:
+    NUMPY_SUPPORT = False
+
+DEFAULT_MAX_FILES = 64  # maximum number of files kept open (memory mapped) by the cache
+
+
+def line_offsets(data):
+    '''
+    return the array of start offsets of all the lines in 'data' (bytes or mmap). Last
+    element is the length of the data (i.e. end of the last line).
+    '''
+    offsets = array('Q', [0])
+    if NUMPY_SUPPORT and len(data) > 0:
+        newlines = numpy.flatnonzero(numpy.frombuffer(data, dtype=numpy.uint8) == ord('\n'))
+        offsets.frombytes((newlines + 1).astype(numpy.uint64).tobytes())
+    else:
+        pos = data.find(b'\n')
+        while pos >= 0:
+            offsets.append(pos + 1)
+            pos = data.find(b'\n', pos + 1)
+    if offsets[-1] != len(data):
+        offsets.append(len(data))
+    return offsets
+
+
+class LineIndex(object):
+    '''
+    memory mapped source file and the start offsets of its lines. Line indices are 0 based.
+    '''
+
+    def __init__(self, filename, contents=FILE_CONTENTS):
+        self.filename = filename
+        # mapped data is shared with the tokenizers through the file content cache
+        content = contents.get(filename)
+        self.stamp = content.stamp
+        self.data = content.data
+        self.offsets = line_offsets(self.data)
+
+    def __len__(self):
+        '''
+        return number of lines in the file
+        '''
+        return len(self.offsets) - 1
+
+    def offset(self, lineidx):
+        '''
+        return the start offset of the line. For lines after the end of file, returns the
+        file size.
+        '''
+        return self.offsets[min(lineidx, len(self.offsets) - 1)]
+
+    def get_bytes(self, start, count):
+        '''
+        return the 'count' lines starting at line index 'start' as bytes
+        '''
+        return self.data[self.offset(start):self.offset(start + count)]
+
+    def get_lines(self, start, count, encoding='utf-8', errors='ignore'):
+        '''
+        return list of 'count' lines (with line endings) starting at line index 'start'.
+        List is shorter if the file ends earlier.
+        '''
+        offsets = self.offsets
+        data = self.data
+        return [data[offsets[i]:offsets[i + 1]].decode(encoding, errors)
+                for i in range(start, min(start + count, len(self)))]
+
+    def close(self):
+        # mapped data is owned (and closed) by the file content cache
+        self.data = b''
+        self.offsets = array('Q', [0])
+
+
+class LineIndexCache(object):
+    '''
+    LineIndex objects of the recently used files. Index is created again if the file is
+    modified. At most 'maxfiles' files are kept open; least recently used file is closed first.
+    '''
+
+    def __init__(self, maxfiles=DEFAULT_MAX_FILES):
+        self.maxfiles = maxfiles
+        self.indexes = OrderedDict()  # file name -> LineIndex
+
+    def get(self, filename):
+        '''
+        return the LineIndex of the file
+        '''
+        index = self.indexes.pop(filename, None)
+        if index is not None:
+            stat = os.stat(filename)
+            if index.stamp != (stat.st_mtime_ns, stat.st_size):
+                index.close()
+                index = None
+        if index is None:
+            index = LineIndex(filename)
+            while len(self.indexes) >= self.maxfiles:
+                self.indexes.popitem(last=False)[1].close()
+        self.indexes[filename] = index
+        return index
+
+    def invalidate(self, filename):
+        '''
+        close the file (e.g. before modifying it) and remove its index
+        '''
+        index = self.indexes.pop(filename, None)
+        if index is not None:
+            index.close()
+        FILE_CONTENTS.invalidate(filename)
+
+    def clear(self):
+        while self.indexes:
+            self.indexes.popitem()[1].close()
+
+
+# line indexes of source files shared by all the match sets of this process
+LINE_INDEXES = LineIndexCache()
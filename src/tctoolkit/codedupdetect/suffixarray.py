@@ -0,0 +1,298 @@
+'''
+suffixarray.py
+Duplicate detection using suffix array and LCP (longest common prefix) array of the token
+stream. Alternative to the Rabin Karp algorithm. Repeats are found directly from the lcp
+intervals, hence there is no pairwise comparison of the candidate matches. Only the repeats with
+an occurrence which is not a part of a longer repeat (i.e. supermaximal repeats and the repeats
+with an extra occurrence) are reported.
+
+reference : Abouelhoda, Kurtz, Ohlebusch, 'Replacing suffix trees with enhanced suffix arrays'
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+from array import array
+from bisect import bisect_right
+
+from .rabinkarp import token_hash, window_hash, is_same_match, match_length
+
+try:
+    import numpy
+    NUMPY_SUPPORT = True
+except ImportError:
+    NUMPY_SUPPORT = False
+
+# previous token of the suffix at the start of the text. Suffixes at the start of the other
+# files have a unique separator as their previous token.
+TEXT_START = -1
+
+
+def suffix_array(text):
+    '''
+    create the suffix array of 'text' (sequence of non negative integers) using prefix doubling.
+    Uses NumPy if it is available.
+    '''
+    if len(text) == 0:
+        return array('i')
+    if NUMPY_SUPPORT:
+        return array('i', _suffix_array_numpy(text).tolist())
+    return array('i', _suffix_array_python(text))
+
+
+def _suffix_array_numpy(text):
+    n = len(text)
+    # dense ranks of the tokens
+    rank = numpy.unique(numpy.frombuffer(text, dtype=numpy.uint32) if isinstance(text, array)
+                        else numpy.asarray(text), return_inverse=True)[1].astype(numpy.int64)
+    k = 1
+    while True:
+        rank2 = numpy.full(n, -1, dtype=numpy.int64)
+        rank2[:n - k] = rank[k:]
+        sa = numpy.lexsort((rank2, rank))
+        rank1_sorted = rank[sa]
+        rank2_sorted = rank2[sa]
+        diff = numpy.empty(n, dtype=numpy.int64)
+        diff[0] = 0
+        diff[1:] = (rank1_sorted[1:] != rank1_sorted[:-1]) | (rank2_sorted[1:] != rank2_sorted[:-1])
+        rank = numpy.empty(n, dtype=numpy.int64)
+        rank[sa] = numpy.cumsum(diff)
+        # stop when all suffixes have unique rank
+        if rank[sa[-1]] == n - 1 or k >= n:
+            return sa
+        k = k * 2
+
+
+def _suffix_array_python(text):
+    n = len(text)
+    rank = list(text)
+    sa = list(range(n))
+    k = 1
+    while True:
+        def sortkey(i):
+            return (rank[i], rank[i + k] if i + k < n else -1)
+        sa.sort(key=sortkey)
+        newrank = [0] * n
+        prevkey = sortkey(sa[0])
+        currank = 0
+        for i in sa:
+            key = sortkey(i)
+            if key != prevkey:
+                currank = currank + 1
+                prevkey = key
+            newrank[i] = currank
+        rank = newrank
+        if currank == n - 1 or k >= n:
+            return sa
+        k = k * 2
+
+
+def lcp_array(text, sa):
+    '''
+    create the LCP array using Kasai's algorithm. lcp[i] is the length of longest common prefix
+    of suffixes sa[i-1] and sa[i]. lcp[0] is 0.
+    '''
+    n = len(text)
+    rank = array('i', bytes(4 * n))
+    for i, suffix in enumerate(sa):
+        rank[suffix] = i
+    lcp = array('i', bytes(4 * n))
+    h = 0
+    for i in range(n):
+        r = rank[i]
+        if r > 0:
+            j = sa[r - 1]
+            while i + h < n and j + h < n and text[i + h] == text[j + h]:
+                h = h + 1
+            lcp[r] = h
+            if h > 0:
+                h = h - 1
+        else:
+            h = 0
+    return lcp
+
+
+def supermaximal_repeats(lcp, prevtoken, minlen):
+    '''
+    yields (lcp value, left bound, right bound) of the lcp intervals of at least 'minlen' tokens
+    having an occurrence which is not a part of a longer repeat. i.e. a suffix which is not in a
+    child interval (repeat cannot be extended to the right) and whose previous token is unique
+    in the interval (repeat cannot be extended to the left). prevtoken(i) is the previous token
+    of the i'th suffix (a unique value for the suffixes at the start of a file).
+    Child intervals are reported before their parent.
+    '''
+    n = len(lcp)
+
+    def addleaf(interval, leaf):
+        if interval[0] >= minlen:
+            counts = interval[2]
+            prev = prevtoken(leaf)
+            counts[prev] = counts.get(prev, 0) + 1
+            interval[3].append(leaf)
+
+    def addchild(interval, child):
+        if interval[0] >= minlen:
+            # merge the smaller previous token counts into the larger one
+            if len(child[2]) > len(interval[2]):
+                interval[2], child[2] = child[2], interval[2]
+            counts = interval[2]
+            for prev, count in child[2].items():
+                counts[prev] = counts.get(prev, 0) + count
+
+    # each stack entry is [lcp value, left bound, previous token counts, direct leaves]
+    stack = [[0, 0, dict(), list()]]
+    for i in range(1, n + 1):
+        curlcp = lcp[i] if i < n else 0
+        # suffix i-1 is a direct leaf of the current interval or of the new one
+        newleaf = i - 1
+        if curlcp <= stack[-1][0]:
+            addleaf(stack[-1], newleaf)
+            newleaf = None
+        leftbound = i - 1
+        child = None
+        while curlcp < stack[-1][0]:
+            interval = stack.pop()
+            lcpvalue, leftbound, counts, leaves = interval
+            if lcpvalue >= minlen and any(counts[prevtoken(leaf)] == 1 for leaf in leaves):
+                yield lcpvalue, leftbound, i - 1
+            child = interval
+            if curlcp <= stack[-1][0]:
+                addchild(stack[-1], child)
+                child = None
+        if curlcp > stack[-1][0]:
+            interval = [curlcp, leftbound, dict(), list()]
+            if child is not None:
+                addchild(interval, child)
+            if newleaf is not None:
+                addleaf(interval, newleaf)
+            stack.append(interval)
+
+
+def select_occurrences(occurrences, matchlen, get_valueids):
+    '''
+    remove the occurrences overlapping the previous occurrence in the same file. 'occurrences'
+    is sorted list of (file index, token index) of a repeat of 'matchlen' tokens and
+    get_valueids(file index) returns the token ids of the file. Overlapping occurrences are a
+    part of a periodic run (e.g. table of similar rows). If less than two occurrences are left,
+    the run is collapsed into one repeat of its first and second half (rounded to the period).
+    Returns (occurrences, matchlen).
+    '''
+    selected = list()
+    overlap = None
+    for fileidx, tokenidx in occurrences:
+        if selected and selected[-1][0] == fileidx and tokenidx < selected[-1][1] + matchlen:
+            if overlap is None:
+                overlap = (fileidx, selected[-1][1], tokenidx)
+            continue
+        selected.append((fileidx, tokenidx))
+
+    if len(selected) < 2 and overlap is not None:
+        fileidx, idx1, idx2 = overlap
+        valueids = get_valueids(fileidx)
+        period = idx2 - idx1
+        runlen = period + match_length(valueids, idx1, valueids, idx2, len(valueids) - idx2)
+        repeats = (runlen + 2 * period - 1) // (2 * period)
+        matchlen = runlen - repeats * period
+        selected = [(fileidx, idx1), (fileidx, idx1 + repeats * period)]
+    return selected, matchlen
+
+
+class SuffixArrayDetector(object):
+    '''
+    Detect the duplicates in token streams of all files. Token id streams of the files are
+    concatenated with a unique separator after every file. Hence no repeat crosses the file
+    boundary.
+    '''
+
+    def __init__(self, chunk, min_lines, matchstore, tokenstore):
+        self.chunk = chunk  # minimum number of tokens to match
+        self.min_lines = min_lines  # minimum number of lines to match.
+        self.matchstore = matchstore
+        self.tokenstore = tokenstore
+        self.filetokens = list()
+        self.srcfiles = dict()  # source file -> FileTokens
+
+    def addTokens(self, filetokens):
+        '''
+        add the FileTokens of one source file.
+        '''
+        assert filetokens.tokenstore is self.tokenstore
+        self.filetokens.append(filetokens)
+        self.srcfiles[filetokens.srcfile] = filetokens
+
+    def _concatenated_text(self):
+        '''
+        return the concatenated text and start position of each file in the text
+        '''
+        text = array('I')
+        starts = list()
+        separator = len(self.tokenstore.values)
+        for filetokens in self.filetokens:
+            starts.append(len(text))
+            text.extend(filetokens.valueids)
+            text.append(separator)
+            separator = separator + 1
+        return text, starts
+
+    def findMatches(self):
+        '''
+        build the suffix array and LCP array and add the repeats of at least 'chunk' tokens
+        (see supermaximal_repeats) to the matchstore.
+        '''
+        text, starts = self._concatenated_text()
+        sa = suffix_array(text)
+        lcp = lcp_array(text, sa)
+
+        def prevtoken(i):
+            suffix = sa[i]
+            return text[suffix - 1] if suffix > 0 else TEXT_START
+
+        def get_valueids(fileidx):
+            return self.filetokens[fileidx].valueids
+
+        repeats = list()
+        for matchlen, leftbound, rightbound in supermaximal_repeats(lcp, prevtoken, self.chunk):
+            occurrences = list()
+            for pos in sorted(sa[leftbound:rightbound + 1]):
+                fileidx = bisect_right(starts, pos) - 1
+                occurrences.append((fileidx, pos - starts[fileidx]))
+            occurrences, matchlen = select_occurrences(occurrences, matchlen, get_valueids)
+            if matchlen >= self.chunk:
+                repeats.append((matchlen, occurrences))
+
+        # longer repeats are added first, so that the repeats nested in them are ignored.
+        repeats.sort(key=lambda repeat: (-repeat[0], repeat[1]))
+        for matchlen, occurrences in repeats:
+            self._addRepeat(matchlen, occurrences)
+
+    def _addRepeat(self, matchlen, occurrences):
+        '''
+        add the repeat of 'matchlen' tokens at 'occurrences' (list of (file index, token index))
+        as one match set. Occurrences with less than min_lines are ignored.
+        '''
+        matches = list()
+        for fileidx, tokenidx in occurrences:
+            filetokens = self.filetokens[fileidx]
+            starttoken = filetokens[tokenidx]
+            endtoken = filetokens[tokenidx + matchlen - 1]
+            if endtoken.lineno - starttoken.lineno >= self.min_lines:
+                matches.append((starttoken, endtoken))
+
+        if len(matches) > 1:
+            fileidx, tokenidx = occurrences[0]
+            matchkey = self.getMatchKey(self.filetokens[fileidx], tokenidx, matchlen)
+            self.matchstore.addMatchGroup(matchlen, matchkey, matches)
+
+    def getMatchKey(self, tokens, idx, matchlen):
+        '''
+        return the matchstore key of the repeat of 'matchlen' tokens starting at token index
+        idx. Same key as the RabinKarp match key (i.e. start window hash and matchlen).
+        '''
+        tokenhashes = self.tokenstore.vocabulary.get_hash_table(token_hash)
+        starthash = window_hash(tokenhashes, tokens.valueids, idx, self.chunk)
+        return self.matchstore.getMatchKey(
+            starthash, matchlen,
+            lambda matchdata: is_same_match(matchdata, self.srcfiles[matchdata.srcfile()], tokens, idx, matchlen))
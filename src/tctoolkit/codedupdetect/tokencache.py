@@ -0,0 +1,180 @@
+'''
+tokencache.py
+Persistent on-disk cache of the tokens and rolling hashes of the source files for the Code
+Duplication Detector. Unchanged files are loaded from the cache instead of parsing them again
+with Pygments.
+
+Cache entries are keyed by the digest of file contents, lexer name, fuzzy flag and the chunk
+size. Every entry is stored in a compact binary format (native byte order). Total size of the
+cache is bounded and least recently used entries are removed first.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import hashlib
+import logging
+import struct
+import tempfile
+from array import array
+
+from .tokenstore import FileTokens
+
+CACHE_MAGIC = b'TCDC'
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('<4sIII')  # magic, version, number of values, number of tokens
+CACHE_EXTENSION = '.tok'
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024  # 1 GB
+
+
+class TokenCache(object):
+    '''
+    directory based cache of the FileTokens and the window hashes of the source files
+    '''
+
+    def __init__(self, cachedir, maxsize=DEFAULT_CACHE_SIZE):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(cachedir):
+            # worker processes (e.g. sharded mappers) may create it at the same time
+            os.makedirs(cachedir, exist_ok=True)
+
+    def get_key(self, srcfile, lexername, fuzzy, chunk):
+        '''
+        return the cache key for the source file. Reads the file contents to compute the digest.
+        '''
+        digest = hashlib.sha1()
+        with open(srcfile, 'rb') as src:
+            for block in iter(lambda: src.read(1024 * 1024), b''):
+                digest.update(block)
+        digest.update(('|%s|%s|%d|%d' % (lexername, bool(fuzzy), chunk, CACHE_VERSION)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cachedir, key[:2], key + CACHE_EXTENSION)
+
+    def load(self, key, srcfile, tokenstore):
+        '''
+        load the cache entry for 'key'. Returns tuple of (FileTokens, window hashes) or None if
+        the entry is not in the cache.
+        '''
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as entry:
+                data = entry.read()
+            # touch the entry, modification time is used for LRU eviction
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses = self.misses + 1
+            return None
+
+        try:
+            filetokens, hashes = self._decode(data, srcfile, tokenstore)
+        except (ValueError, struct.error, UnicodeDecodeError) as exp:
+            logging.warning("invalid token cache entry %s : %s" % (path, exp))
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return filetokens, hashes
+
+    def store(self, key, filetokens, hashes):
+        '''
+        store the FileTokens and window hashes in the cache.
+        '''
+        path = self._entry_path(key)
+        entrydir = os.path.dirname(path)
+        if not os.path.isdir(entrydir):
+            os.makedirs(entrydir, exist_ok=True)
+        # write to a temporary file and then rename it, so that parallel runs (or worker
+        # processes) never see a partially written entry.
+        fd, tmppath = tempfile.mkstemp(dir=entrydir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as entry:
+                entry.write(self._encode(filetokens, hashes))
+            os.replace(tmppath, path)
+        except (IOError, OSError) as exp:
+            logging.warning("unable to write token cache entry %s : %s" % (path, exp))
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    def _encode(self, filetokens, hashes):
+        # token ids are local to the entry. Store the token values used in this file only.
+        localids = dict()
+        values = list()
+        tokenstore = filetokens.tokenstore
+        valueids = array('I')
+        for tokenid in filetokens.valueids:
+            localid = localids.get(tokenid)
+            if localid is None:
+                localid = len(values)
+                localids[tokenid] = localid
+                values.append(tokenstore.get_value(tokenid).encode('utf-8', 'surrogatepass'))
+            valueids.append(localid)
+
+        lengths = array('I', [len(value) for value in values])
+        parts = [CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, len(values), len(valueids)),
+                 lengths.tobytes(), b''.join(values), valueids.tobytes(),
+                 filetokens.linenos.tobytes(), filetokens.charpos.tobytes(), hashes.tobytes()]
+        return b''.join(parts)
+
+    def _decode(self, data, srcfile, tokenstore):
+        magic, version, numvalues, numtokens = CACHE_HEADER.unpack_from(data, 0)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            raise ValueError("unsupported cache entry version")
+        offset = CACHE_HEADER.size
+
+        def read_array(count):
+            values = array('I')
+            nbytes = count * values.itemsize
+            values.frombytes(data[offset:offset + nbytes])
+            if len(values) != count:
+                raise ValueError("truncated cache entry")
+            return values, offset + nbytes
+
+        lengths, offset = read_array(numvalues)
+        idmap = list()
+        for length in lengths:
+            value = data[offset:offset + length].decode('utf-8', 'surrogatepass')
+            idmap.append(tokenstore.intern(value))
+            offset = offset + length
+
+        localids, offset = read_array(numtokens)
+        filetokens = FileTokens(tokenstore, srcfile)
+        filetokens.valueids = array('I', [idmap[localid] for localid in localids])
+        filetokens.linenos, offset = read_array(numtokens)
+        filetokens.charpos, offset = read_array(numtokens)
+        hashes, offset = read_array(max(0, numtokens - 1))
+        return filetokens, hashes
+
+    def trim(self):
+        '''
+        remove the least recently used entries till the total cache size is less than maxsize.
+        '''
+        entries = list()
+        totalsize = 0
+        for root, dirs, files in os.walk(self.cachedir):
+            for fname in files:
+                if fname.endswith(CACHE_EXTENSION):
+                    path = os.path.join(root, fname)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    totalsize = totalsize + stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if totalsize <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+                totalsize = totalsize - size
+            except OSError as exp:
+                logging.warning("unable to remove token cache entry %s : %s" % (path, exp))
+        return totalsize
@@ -12,29 +12,55 @@ TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 
 import os
 import logging
-from collections import namedtuple
 from tctoolkit.tctoolkitutil import SourceCodeTokenizer
 
 from pygments.token import Token
 
-DupToken = namedtuple('DupToken', ['srcfile', 'lineno', 'charpos', 'value'])
+from .tokenstore import DupToken, TokenStore, TokenVocabulary, FileTokens
 
 class Tokenizer(SourceCodeTokenizer):
     '''
-    tokenizer for code duplication detection.
+    tokenizer for code duplication detection. Tokens are stored in compact FileTokens
+    object. Token values are interned in 'tokenstore' which is shared by all tokenizers
+    of one run.
     '''
 
-    def __init__(self, srcfile, fuzzy=False):
-        super(Tokenizer, self).__init__(srcfile)
+    def __init__(self, srcfile, fuzzy=False, tokenstore=None, options=None):
+        super(Tokenizer, self).__init__(srcfile, options=options)
         self.fuzzy = fuzzy
-        self.pos_dict = dict()
+        if tokenstore is None:
+            tokenstore = TokenStore()
+        self.tokenstore = tokenstore
 
     def update_token_list(self):
         if(self.tokenlist == None):
-            self.tokenlist = list()
-            for idx, token in enumerate(self.get_tokens()):
-                self.tokenlist.append(token)
-                self.pos_dict[token.charpos] = idx
+            tokenlist = FileTokens(self.tokenstore, self.srcfile)
+            for token in self.get_tokens():
+                tokenlist.append(token.lineno, token.charpos, token.value)
+            self.tokenlist = tokenlist
+
+    def get_token_list(self):
+        '''
+        return the FileTokens object with all tokens of the source file
+        '''
+        self.update_token_list()
+        return self.tokenlist
+
+    def set_token_list(self, filetokens):
+        '''
+        set the tokens loaded from outside (e.g. from the token cache)
+        '''
+        assert filetokens.tokenstore is self.tokenstore
+        self.tokenlist = filetokens
+
+    def set_token_store(self, tokenstore):
+        '''
+        move the tokens to a different token store (e.g. when tokenizer is created in a worker
+        process)
+        '''
+        self.update_token_list()
+        self.tokenlist = tokenstore.import_tokens(self.tokenlist)
+        self.tokenstore = tokenstore
 
     def is_fuzzy_token(self, srctoken):
         '''
@@ -74,5 +100,18 @@ class Tokenizer(SourceCodeTokenizer):
 
     def get_tokens_frompos(self, fromcharpos):
         self.update_token_list()
-        idx = self.pos_dict[fromcharpos]
-        return self.tokenlist[idx:]
+        idx = self.tokenlist.index_of(fromcharpos)
+        return self.tokenlist.iter_from(idx)
+
+
+def create_tokenizer(srcfile, fuzzy=False, options=None):
+    '''
+    create the tokenizer for srcfile and update its token list. Module level function so that
+    it can be used with multiprocessing pool. 'options' is the TokenizerOptions.
+    '''
+    # separate vocabulary, so that only the token values of this file are sent back to the
+    # main process.
+    tknzr = Tokenizer(srcfile, fuzzy=fuzzy, tokenstore=TokenStore(TokenVocabulary()),
+                      options=options)
+    tknzr.update_token_list()
+    return tknzr
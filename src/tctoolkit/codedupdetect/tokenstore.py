@@ -0,0 +1,267 @@
+'''
+tokenstore.py
+Compact (array based) storage of the tokens for the Code Duplication Detector
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import logging
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+DupToken = namedtuple('DupToken', ['srcfile', 'lineno', 'charpos', 'value'])
+
+VOCABULARY_MAGIC = b'TCDV'
+VOCABULARY_VERSION = 1
+VOCABULARY_HEADER = struct.Struct('<4sIII')  # magic, version, number of values, number of hashes
+
+
+class TokenVocabulary(object):
+    '''
+    interning table of the token values. Maps every distinct token value to a small integer id
+    and its token hash (used by the rolling hash). Token hashes are computed only once per
+    distinct value. VOCABULARY (module level instance) is shared by all the token stores (and
+    hence all RabinKarp and RollingHash instances) of a run.
+    '''
+
+    def __init__(self):
+        self.values = list()  # token id -> token value
+        self.value_ids = dict()  # token value -> token id
+        self.hashes = array('I')  # token id -> token hash. Computed lazily.
+        self.hits = 0  # token hash lookups found in the table
+        self.misses = 0  # token hash lookups which required computing the hash
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        '''
+        return the token id of the given token value. Adds the value if it is not there.
+        '''
+        tokenid = self.value_ids.get(value)
+        if tokenid is None:
+            tokenid = len(self.values)
+            self.values.append(value)
+            self.value_ids[value] = tokenid
+        return tokenid
+
+    def get_value(self, tokenid):
+        return self.values[tokenid]
+
+    def _update_hashes(self, hashfunc):
+        '''
+        compute the token hashes of the values added since the last call. Returns the number
+        of hashes computed.
+        '''
+        start = len(self.hashes)
+        values = self.values
+        self.hashes.extend([hashfunc(values[tokenid]) for tokenid in range(start, len(values))])
+        return len(self.hashes) - start
+
+    def get_hash(self, value, hashfunc):
+        '''
+        return the token hash of the value. hashfunc(value) is called only if the hash of the
+        value is not in the table.
+        '''
+        tokenid = self.intern(value)
+        if tokenid < len(self.hashes):
+            self.hits = self.hits + 1
+        else:
+            self.misses = self.misses + self._update_hashes(hashfunc)
+        return self.hashes[tokenid]
+
+    def get_hash_table(self, hashfunc, lookups=0):
+        '''
+        return the array of token hashes indexed by the token id. 'lookups' is the number of
+        tokens for which table is used and it is only used for the hit/miss statistics.
+        '''
+        computed = self._update_hashes(hashfunc)
+        self.misses = self.misses + computed
+        self.hits = self.hits + max(0, lookups - computed)
+        return self.hashes
+
+    def save(self, filename):
+        '''
+        save the token values and hashes computed so far. Table is written to a temporary
+        file first and then renamed.
+        '''
+        values = [value.encode('utf-8', 'surrogatepass') for value in self.values]
+        lengths = array('I', [len(value) for value in values])
+        parts = [VOCABULARY_HEADER.pack(VOCABULARY_MAGIC, VOCABULARY_VERSION, len(values),
+                                        len(self.hashes)),
+                 lengths.tobytes(), b''.join(values), self.hashes.tobytes()]
+        tabledir = os.path.dirname(os.path.abspath(filename))
+        fd, tmppath = tempfile.mkstemp(dir=tabledir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tablef:
+                tablef.write(b''.join(parts))
+            os.replace(tmppath, filename)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    def load(self, filename):
+        '''
+        add the token values and hashes saved earlier. Returns False if the file is not there
+        or it is not a valid token table.
+        '''
+        try:
+            with open(filename, 'rb') as tablef:
+                data = tablef.read()
+            magic, version, numvalues, numhashes = VOCABULARY_HEADER.unpack_from(data, 0)
+            if magic != VOCABULARY_MAGIC or version != VOCABULARY_VERSION:
+                raise ValueError("unsupported token table version")
+            offset = VOCABULARY_HEADER.size
+            lengths = array('I')
+            lengths.frombytes(data[offset:offset + numvalues * lengths.itemsize])
+            offset = offset + numvalues * lengths.itemsize
+            values = list()
+            for length in lengths:
+                values.append(data[offset:offset + length].decode('utf-8', 'surrogatepass'))
+                offset = offset + length
+            hashes = array('I')
+            hashes.frombytes(data[offset:offset + numhashes * hashes.itemsize])
+            if len(values) != numvalues or len(hashes) != numhashes:
+                raise ValueError("truncated token table")
+        except (IOError, OSError, ValueError, struct.error, UnicodeDecodeError) as exp:
+            logging.info("unable to load token table %s : %s" % (filename, exp))
+            return False
+
+        # ids in this table may be different if some values were already added. Saved hash
+        # is used only if the hashes of all the earlier ids are also known.
+        for i, value in enumerate(values):
+            tokenid = self.intern(value)
+            if i < numhashes and tokenid == len(self.hashes):
+                self.hashes.append(hashes[i])
+        return True
+
+
+# token values interned by all the token stores of this process
+VOCABULARY = TokenVocabulary()
+
+
+class TokenStore(object):
+    '''
+    Interned token values and source file names shared by all the files of one CDD run.
+    Token values and file names are referred by small integer ids instead of storing the
+    strings with every token. Token values are interned in the shared VOCABULARY unless a
+    separate vocabulary is given (e.g. for the tokens sent from a worker process).
+    '''
+
+    def __init__(self, vocabulary=None):
+        if vocabulary is None:
+            vocabulary = VOCABULARY
+        self.vocabulary = vocabulary
+        self.srcfiles = list()  # file id -> source file name
+        self.file_ids = dict()  # source file name -> file id
+
+    @property
+    def values(self):
+        return self.vocabulary.values
+
+    def intern(self, value):
+        '''
+        return the token id of the given token value. Adds the value if it is not there.
+        '''
+        return self.vocabulary.intern(value)
+
+    def get_value(self, tokenid):
+        return self.vocabulary.values[tokenid]
+
+    def get_file_id(self, srcfile):
+        '''
+        return the file id of the given source file. Adds the file if it is not there.
+        '''
+        fileid = self.file_ids.get(srcfile)
+        if fileid is None:
+            fileid = len(self.srcfiles)
+            self.srcfiles.append(srcfile)
+            self.file_ids[srcfile] = fileid
+        return fileid
+
+    def get_srcfile(self, fileid):
+        return self.srcfiles[fileid]
+
+    def import_tokens(self, filetokens):
+        '''
+        import the FileTokens created with a different token store (e.g. in a worker process).
+        Token ids are remapped to the ids of this store. Returns the new FileTokens object.
+        '''
+        if filetokens.tokenstore is self:
+            return filetokens
+        otherstore = filetokens.tokenstore
+        srcfile = otherstore.get_srcfile(filetokens.fileid)
+        newtokens = FileTokens(self, srcfile)
+        if otherstore.vocabulary is self.vocabulary:
+            newtokens.valueids = filetokens.valueids
+        else:
+            idmap = [self.intern(value) for value in otherstore.values]
+            newtokens.valueids = array('I', [idmap[tokenid] for tokenid in filetokens.valueids])
+        newtokens.linenos = filetokens.linenos
+        newtokens.charpos = filetokens.charpos
+        return newtokens
+
+
+class FileTokens(object):
+    '''
+    tokens of one source file stored in 'columns' of typed arrays. Token values are stored as
+    ids from the TokenStore. Indexing or iterating returns DupToken tuples.
+    '''
+    __slots__ = ['tokenstore', 'fileid', 'valueids', 'linenos', 'charpos']
+
+    def __init__(self, tokenstore, srcfile):
+        self.tokenstore = tokenstore
+        self.fileid = tokenstore.get_file_id(srcfile)
+        self.valueids = array('I')
+        self.linenos = array('I')
+        self.charpos = array('I')
+
+    @property
+    def srcfile(self):
+        return self.tokenstore.get_srcfile(self.fileid)
+
+    def append(self, lineno, charpos, value):
+        self.valueids.append(self.tokenstore.intern(value))
+        self.linenos.append(lineno)
+        self.charpos.append(charpos)
+
+    def __len__(self):
+        return len(self.valueids)
+
+    def __getitem__(self, idx):
+        return DupToken(self.srcfile, self.linenos[idx], self.charpos[idx],
+                        self.tokenstore.get_value(self.valueids[idx]))
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, idx):
+        '''
+        iterate over DupTokens starting at token index 'idx' (without copying the token list)
+        '''
+        srcfile = self.srcfile
+        values = self.tokenstore.values
+        valueids = self.valueids
+        linenos = self.linenos
+        charpos = self.charpos
+        for i in range(idx, len(valueids)):
+            yield DupToken(srcfile, linenos[i], charpos[i], values[valueids[i]])
+
+    def index_of(self, fromcharpos):
+        '''
+        return the token index of token starting at character position 'fromcharpos'.
+        Character positions are in increasing order, hence binary search is used.
+        '''
+        idx = bisect_left(self.charpos, fromcharpos)
+        if idx == len(self.charpos) or self.charpos[idx] != fromcharpos:
+            raise KeyError(fromcharpos)
+        return idx
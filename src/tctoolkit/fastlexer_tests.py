@@ -0,0 +1,186 @@
+'''
+This module is part of Thinking Craftsman Toolkit (TC Toolkit).
+and is released under the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+Purpose: Compatibility tests of the fast lexers against the Pygments lexers
+'''
+import unittest
+import os
+from pygments.lexers import get_lexer_by_name
+from tctoolkit.tctoolkitutil.fastlexers import get_fast_lexer, first_chars
+from tctoolkit.tctoolkitutil.sourcetokenizer import SourceCodeTokenizer, TokenizerOptions
+
+C_SOURCE = r'''
+#include <stdio.h>
+#define MAX(a, b) ((a) > (b) ? (a) : (b))
+
+#if 0
+int disabled(void) { return 0; }
+#endif
+
+struct point {
+    int x, y;
+};
+
+static const char *names[] = { "first", "sec\"ond", NULL };
+
+unsigned long count_points(struct point *points, size_t n)
+{
+    unsigned long total = 0;
+    for (size_t i = 0; i < n; i++) {
+        /* multi line
+           comment */
+        if (points[i].x >= -1 && points[i].y != 0x1F) total += 1.5e3;
+    }
+    return total; // done
+}
+'''
+
+CPP_SOURCE = r'''
+#include <string>
+namespace sample {
+class Shape : public Base {
+public:
+    virtual double area() const = 0;
+};
+
+template <typename T>
+bool Shape::contains(const T& value) {
+    auto text = R"(raw "string")";
+    return value != nullptr && text.size() > 0u;
+}
+}
+'''
+
+JAVA_SOURCE = r'''
+package org.sample;
+
+import java.util.List;
+
+@SuppressWarnings("unchecked")
+public class Counter implements Runnable {
+    private static final long LIMIT = 0xFFL;
+
+    @Override
+    public void run() {
+        String text = """
+            text block
+            """;
+        for (int i = 0; i < LIMIT; i++) {
+            System.out.println(text + 'c' + 1.5f);
+        }
+    }
+}
+'''
+
+CSHARP_SOURCE = r'''
+using System.Collections.Generic;
+
+namespace Sample.Shapes
+{
+    [Serializable]
+    public class Circle : IShape
+    {
+        private double radius = 1.0;
+
+        public double Area()
+        {
+            var path = @"C:\shapes\""circle""";
+            var items = new List<int>();
+            return items[0] * 3.14 * radius;
+        }
+    }
+}
+'''
+
+PYTHON_SOURCE = r'''
+"""module docstring"""
+import os.path
+from . import common
+
+class Shape(object):
+    __slots__ = ['name']
+
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+async def area(shape, *args, **kwargs):
+    match shape:
+        case Circle(radius=r) if r > 0:
+            return 3.14 * r ** 2
+    value = "shape" + rb'\x00' + \
+        str(0x1F + 1e-3j)
+    return [item for item in args if item is not None and not False]
+'''
+
+
+class FastLexerTest(unittest.TestCase):
+
+    def assertSameTokens(self, lang, text):
+        pyglexer = get_lexer_by_name(lang)
+        lexer = get_fast_lexer(pyglexer)
+        self.assertIsNotNone(lexer)
+        # same (charpos, token type, value) tokens as Pygments, token by token
+        self.assertEqual(list(pyglexer.get_tokens_unprocessed(text)),
+                         list(lexer.get_tokens_unprocessed(text)))
+
+    def test_c(self):
+        self.assertSameTokens('c', C_SOURCE)
+
+    def test_cpp(self):
+        self.assertSameTokens('cpp', CPP_SOURCE)
+
+    def test_java(self):
+        self.assertSameTokens('java', JAVA_SOURCE)
+
+    def test_csharp(self):
+        self.assertSameTokens('csharp', CSHARP_SOURCE)
+
+    def test_python(self):
+        self.assertSameTokens('python', PYTHON_SOURCE)
+
+    def test_python_sources(self):
+        srcdir = os.path.dirname(os.path.abspath(__file__))
+        for dirpath, dirnames, filenames in os.walk(srcdir):
+            for filename in filenames:
+                if filename.endswith('.py'):
+                    with open(os.path.join(dirpath, filename), encoding='utf-8', errors='ignore') as srcfile:
+                        self.assertSameTokens('python', srcfile.read())
+
+    def test_c_options(self):
+        # standard library types are Keyword.Type only if the highlighting option is set
+        text = 'size_t count(FILE *file);\n'
+        for stdlibhighlighting in (True, False):
+            pyglexer = get_lexer_by_name('c', stdlibhighlighting=stdlibhighlighting)
+            self.assertEqual(list(pyglexer.get_tokens_unprocessed(text)),
+                             list(get_fast_lexer(pyglexer).get_tokens_unprocessed(text)))
+
+    def test_unterminated_source(self):
+        # errors, unterminated strings/comments and the state reset at end of line
+        self.assertSameTokens('python', 'x = "abc\ny = $ \'\'\'doc')
+        self.assertSameTokens('c', '/* comment\nint x = \'a;\n#if 0\nint y;')
+        self.assertSameTokens('java', 'class A { String s = "abc\n}; ` }')
+
+    def test_first_chars(self):
+        self.assertEqual(frozenset(map(ord, 'FRfr')) | frozenset([128]), first_chars(r'(?i)(rf|fr)(""")'))
+        self.assertEqual(frozenset(map(ord, '0123456789')) | frozenset([128]), first_chars(r'\d+'))
+        self.assertEqual(frozenset(map(ord, 'cs')), first_chars(r'(?<!\.)(self|cls)\b'))
+        # empty match possible
+        self.assertIsNone(first_chars(''))
+        self.assertIsNone(first_chars(r'\s*'))
+
+    def test_unsupported_language(self):
+        self.assertIsNone(get_fast_lexer(get_lexer_by_name('ruby')))
+
+    def test_tokenizer_backend(self):
+        pygtokens = list(SourceCodeTokenizer(os.path.abspath(__file__)).get_tokens())
+        tknzr = SourceCodeTokenizer(os.path.abspath(__file__), options=TokenizerOptions('fast'))
+        self.assertEqual('Python (fast)', tknzr.get_lexer().name)
+        fasttokens = list(tknzr.get_tokens())
+        self.assertEqual([(token.charpos, token.ttype, token.rawvalue) for token in pygtokens],
+                         [(token.charpos, token.ttype, token.rawvalue) for token in fasttokens])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,12 +5,12 @@ Defines utility class for extracting dependencies for various types of source fi
 
 import os
 import sys
-import codecs
 
 from pygments.lexers import get_lexer_by_name
 
 from tctoolkitutil.filelist import DirFileLister
 from tctoolkitutil.common import StripAtStart
+from tctoolkitutil.filecontent import read_source
 
 from tcdepends.depfilter import get_import_filter
 
@@ -32,10 +32,9 @@ class Dependency(object):
         dependList = set()
         assert(self.filter != None)
 
-        with codecs.open(srcfile, "rb", encoding='utf-8', errors='ignore') as code:
-            for ttype, value in self.lexer.get_tokens(code.read()):
-                dependson = self.filter.findFile(value)
-                dependList.add(dependson)
+        for ttype, value in self.lexer.get_tokens(read_source(srcfile)):
+            dependson = self.filter.findFile(value)
+            dependList.add(dependson)
 
         return(dependList)
 
@@ -9,10 +9,13 @@ TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 
 from .common import *
 from .filelist import *
+from .filecontent import FileContentCache, FILE_CONTENTS, read_source, read_source_chunks
+from .lexerregistry import LexerRegistry, LEXERS
+from .fastlexers import FastLexer, FAST_LEXERS, get_fast_lexer
 from .tagcloud import TagCloud
 from .treemapdata import TreemapNode
 from .tcapp import TCApp
-from .sourcetokenizer import SourceCodeTokenizer
+from .sourcetokenizer import SourceCodeTokenizer, TokenizerOptions
 from .sourcetokenizer import TagTypeFilter, KeywordFilter, NameFilter
 from .sourcetokenizer import ClassFuncNameFilter, FuncNameFilter, ClassNameFilter
 from .sourcetokenizer import LiteralFilter
@@ -2,7 +2,8 @@
 '''
 bitarray.py
 
-Really simple bitarray implented using default 'bytearray' class
+Really simple bitarray implented using default 'bytearray' class. Bulk operations (get_many,
+set_many) use NumPy if it is available.
 
 Copyright (C) 2018 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
 
@@ -14,42 +15,81 @@ TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 from __future__ import unicode_literals
 from __future__ import print_function
 
+try:
+    import numpy
+    NUMPY_SUPPORT = True
+except ImportError:
+    NUMPY_SUPPORT = False
+
+
 class BitArray(object):
     '''
     really simple 'bitarray' which provides indexing and manipulating bit values. Uses
-    standard Python ByteArray object to store the data
+    standard Python ByteArray object to store the data. Any other writable buffer (e.g.
+    memoryview of a mmap) of the required size can be used instead of ByteArray.
     '''
-    def __init__(self, size):
+    def __init__(self, size, buffer=None):
         self.size = size
-        self.bytes = bytearray(int(size/8.0+1.0))
-    
+        if buffer is None:
+            buffer = bytearray((size >> 3) + 1)
+        assert len(buffer) >= (size >> 3) + 1
+        self.bytes = buffer
+
     def __getitem__(self, index):
         '''
         index is assumed to be integer. not checked.
         '''
-        if not (index>=0 and index < self.size):
+        if not (0 <= index < self.size):
             raise IndexError
-        byteindex = int(index/8)
-        bitindex = index % 8
-        return (self.bytes[byteindex] & (0x01 << bitindex)) >> bitindex
-    
+        return (self.bytes[index >> 3] >> (index & 7)) & 0x01
+
     def __setitem__(self, index, value):
         '''
         value must be 'true' or 'false (i.e. 0 or 1). Not checked
         '''
-        assert index>=0 and index < self.size
-        assert value == 0 or value == 1
-        byteindex = int(index/8)
-        bitindex = index % 8
-        value = 0x01 & value
-        self.bytes[byteindex] = self.bytes[byteindex] | (value << bitindex)
-    
+        assert 0 <= index < self.size
+        if value:
+            self.bytes[index >> 3] |= (0x01 << (index & 7))
+
+    def _as_numpy(self):
+        return numpy.frombuffer(self.bytes, dtype=numpy.uint8)
+
+    def get_many(self, indices):
+        '''
+        return the bit values at all the indices (sequence or NumPy array of integers)
+        '''
+        if not NUMPY_SUPPORT:
+            return [self[index] for index in indices]
+        indices = numpy.asarray(indices, dtype=numpy.uint64)
+        if len(indices) and indices.max() >= self.size:
+            raise IndexError
+        shift = (indices & numpy.uint64(7)).astype(numpy.uint8)
+        return (self._as_numpy()[indices >> numpy.uint64(3)] >> shift) & numpy.uint8(1)
+
+    def set_many(self, indices):
+        '''
+        set the bits at all the indices (sequence or NumPy array of integers) to 1
+        '''
+        if not NUMPY_SUPPORT:
+            for index in indices:
+                self[index] = 1
+            return
+        indices = numpy.asarray(indices, dtype=numpy.uint64)
+        if len(indices) and indices.max() >= self.size:
+            raise IndexError
+        masks = numpy.left_shift(numpy.uint8(1), (indices & numpy.uint64(7)).astype(numpy.uint8))
+        # ufunc.at is required since same byte may be updated for multiple indices
+        numpy.bitwise_or.at(self._as_numpy(), indices >> numpy.uint64(3), masks)
+
+    def copy(self):
+        return BitArray(self.size, bytearray(self.bytes))
+
     def hex(self):
         '''
         return hex string representation of internal bytearray. (mainly for debugging)
         Will not work with python 2.x
         '''
-        return self.bytes.hex()
+        return bytes(self.bytes).hex()
 
 if __name__ == '__main__':
     #run some simple tests
@@ -65,7 +105,9 @@ if __name__ == '__main__':
     assert bits8[0] == 1 and bits8[3] == 1
     bits9[8] = 1
     assert bits9[8] == 1 and bits9[0] == 0
-    
+    bits9.set_many([1, 2, 2, 7])
+    assert list(bits9.get_many(range(9))) == [0, 1, 1, 0, 0, 0, 0, 1, 1]
+
     #simple performance test to set 100000 bits and read them back
     from random import randrange
     from time import time
@@ -79,5 +121,5 @@ if __name__ == '__main__':
     end = time()
     #print(bits.hex())
     print(end-start)
-    
-    
\ No newline at end of file
+
+
@@ -19,7 +19,7 @@ from __future__ import absolute_import
 an a Scalable Bloom Filter that grows in size as your add more items to it
 without increasing the false positive error_rate.
 
-Requires the bitarray library: http://pypi.python.org/pypi/bitarray/
+Uses the simple BitArray class from tctoolkitutil.bitarray instead of bitarray library.
 
     >>> from pybloom import BloomFilter
     >>> f = BloomFilter(capacity=10000, error_rate=0.001)
@@ -50,14 +50,20 @@ Requires the bitarray library: http://pypi.python.org/pypi/bitarray/
 
 """
 import math
+import mmap
 import hashlib
+import numbers
+import operator
 import six
-from struct import unpack, pack, calcsize
+from struct import unpack, pack, calcsize, Struct
+
+from . import bitarray
 
 try:
-    import bitarray
+    import numpy
+    NUMPY_SUPPORT = True
 except ImportError:
-    raise ImportError('pybloom requires bitarray >= 0.3.4')
+    NUMPY_SUPPORT = False
 
 __version__ = '2.0'
 __author__  = "Jay Baird <jay.baird@me.com>, Bob Ippolito <bob@redivi.com>,\
@@ -66,6 +72,63 @@ __author__  = "Jay Baird <jay.baird@me.com>, Bob Ippolito <bob@redivi.com>,\
                Matt Bachmann <bachmann.matt@gmail.com>,\
               "
 
+MASK64 = 0xFFFFFFFFFFFFFFFF
+SPLITMIX_GAMMA = 0x9E3779B97F4A7C15
+SPLITMIX_MUL1 = 0xBF58476D1CE4E5B9
+SPLITMIX_MUL2 = 0x94D049BB133111EB
+
+# serialized filter : header (padded to FILE_HEADER_SIZE bytes) followed by the bits.
+FILE_MAGIC = b'TCBF'
+FILE_VERSION = 1
+# magic, version, error_rate, num_slices, bits_per_slice, capacity, count
+FILE_HEADER = Struct('<4sIdIQQQ')
+FILE_HEADER_SIZE = 64
+
+
+def splitmix64(x):
+    z = (x + SPLITMIX_GAMMA) & MASK64
+    z = ((z ^ (z >> 30)) * SPLITMIX_MUL1) & MASK64
+    z = ((z ^ (z >> 27)) * SPLITMIX_MUL2) & MASK64
+    return z ^ (z >> 31)
+
+
+def make_int_hashfuncs(num_slices, num_bits):
+    '''
+    hash functions for integer keys using double hashing. i'th hash is h1 + i*h2, where h1 and
+    h2 are derived from the splitmix64 mix of the key. No hash objects are created per key.
+    '''
+    def _make_int_hashfuncs(key):
+        h1 = splitmix64(key & MASK64)
+        h2 = splitmix64(h1) | 1
+        for i in six.moves.range(num_slices):
+            yield ((h1 + i * h2) & MASK64) % num_bits
+
+    return _make_int_hashfuncs
+
+
+def int_hash_indices(keys, num_slices, bits_per_slice):
+    '''
+    vectorized (NumPy) version of make_int_hashfuncs. Returns 2d array of bit indices
+    (i.e. with slice offset added). Row i has the bit indices of keys[i].
+    '''
+    def mix(z):
+        z = z + numpy.uint64(SPLITMIX_GAMMA)
+        z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(SPLITMIX_MUL1)
+        z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(SPLITMIX_MUL2)
+        return z ^ (z >> numpy.uint64(31))
+
+    keys = numpy.asarray(keys).astype(numpy.uint64)
+    h1 = mix(keys)
+    h2 = mix(h1) | numpy.uint64(1)
+    slices = numpy.arange(num_slices, dtype=numpy.uint64)
+    indices = (h1[:, None] + slices[None, :] * h2[:, None]) % numpy.uint64(bits_per_slice)
+    return indices + slices * numpy.uint64(bits_per_slice)
+
+
+def is_int_keys(keys):
+    return NUMPY_SUPPORT and numpy.asarray(keys).dtype.kind in 'iu'
+
+
 def make_hashfuncs(num_slices, num_bits):
     if num_bits >= (1 << 31):
         fmt_code, chunk_size = 'Q', 8
@@ -89,7 +152,16 @@ def make_hashfuncs(num_slices, num_bits):
     if extra:
         num_salts += 1
     salts = tuple(hashfn(hashfn(pack('I', i)).digest()) for i in six.moves.range(num_salts))
+    int_hashfuncs = make_int_hashfuncs(num_slices, num_bits)
+
     def _make_hashfuncs(key):
+        # integer like keys (e.g. numpy.uint64) are hashed as integers, same as in add_many
+        # and contains_many. Otherwise the scalar and bulk operations set different bits.
+        if isinstance(key, numbers.Integral) and not isinstance(key, bool):
+            return int_hashfuncs(operator.index(key))
+        return _make_str_hashfuncs(key)
+
+    def _make_str_hashfuncs(key):
         if six.PY3:
             if isinstance(key, str):
                 key = key.encode('utf-8')
@@ -219,6 +291,52 @@ class BloomFilter(object):
         else:
             return True
 
+    def contains_many(self, keys):
+        """Tests the membership of all the keys. Integer keys (e.g. NumPy array of
+        integers) are tested together with vectorized hashing. Returns a boolean array.
+
+        >>> b = BloomFilter(capacity=100)
+        >>> _ = b.add_many([1, 2, 3])
+        >>> list(map(bool, b.contains_many([3, 2, 1])))
+        [True, True, True]
+        >>> 3 in b
+        True
+
+        """
+        if not is_int_keys(keys):
+            return [key in self for key in keys]
+        if len(keys) == 0:
+            return numpy.zeros(0, dtype=bool)
+        indices = int_hash_indices(keys, self.num_slices, self.bits_per_slice)
+        bits = self.bitarray.get_many(indices.ravel()).reshape(indices.shape)
+        return bits.all(axis=1)
+
+    def add_many(self, keys):
+        """Adds all the keys to this bloom filter. Returns boolean array, True if the key
+        already exists in this filter before adding the keys. (i.e. keys repeated in 'keys'
+        are not reported as existing)
+
+        >>> b = BloomFilter(capacity=100)
+        >>> list(map(bool, b.add_many([5, 6])))
+        [False, False]
+        >>> list(map(bool, b.add_many([6, 7])))
+        [True, False]
+        >>> b.count
+        3
+
+        """
+        if not is_int_keys(keys):
+            return [self.add(key) for key in keys]
+        if self.count > self.capacity:
+            raise IndexError("BloomFilter is at capacity")
+        if len(keys) == 0:
+            return numpy.zeros(0, dtype=bool)
+        indices = int_hash_indices(keys, self.num_slices, self.bits_per_slice)
+        found = self.bitarray.get_many(indices.ravel()).reshape(indices.shape).all(axis=1)
+        self.bitarray.set_many(indices.ravel())
+        self.count += int(len(found) - numpy.count_nonzero(found))
+        return found
+
     def copy(self):
         """Return a copy of this bloom filter.
         """
@@ -226,9 +344,49 @@ class BloomFilter(object):
         new_filter.bitarray = self.bitarray.copy()
         return new_filter
 
+    def tofile(self, filename):
+        """Save the filter. Bits are stored after a fixed size header, hence the
+        file can be memory mapped by fromfile.
+        """
+        header = FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, self.error_rate, self.num_slices,
+                                  self.bits_per_slice, self.capacity, self.count)
+        with open(filename, 'wb') as outf:
+            outf.write(header.ljust(FILE_HEADER_SIZE, b'\0'))
+            outf.write(self.bitarray.bytes)
+
+    @classmethod
+    def fromfile(cls, filename, use_mmap=True):
+        """Load the filter saved with tofile. If use_mmap is True, the bits are not
+        read. File is memory mapped (copy on write) instead. Keys added later are
+        not written to the file.
+        """
+        with open(filename, 'rb') as inf:
+            header = inf.read(FILE_HEADER_SIZE)
+            magic, version, error_rate, num_slices, bits_per_slice, capacity, count = \
+                FILE_HEADER.unpack_from(header, 0)
+            if magic != FILE_MAGIC or version != FILE_VERSION:
+                raise ValueError("not a bloom filter file : %s" % filename)
+            num_bits = num_slices * bits_per_slice
+            numbytes = (num_bits >> 3) + 1
+            if use_mmap:
+                buf = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_COPY)
+                buf = memoryview(buf)[FILE_HEADER_SIZE:FILE_HEADER_SIZE + numbytes]
+            else:
+                buf = bytearray(inf.read(numbytes))
+            if len(buf) != numbytes:
+                raise ValueError("truncated bloom filter file : %s" % filename)
+
+        bfilter = cls.__new__(cls)
+        bfilter._setup(error_rate, num_slices, bits_per_slice, capacity, count)
+        bfilter.bitarray = bitarray.BitArray(bfilter.num_bits, buf)
+        return bfilter
+
     def __getstate__(self):
         d = self.__dict__.copy()
         del d['make_hashes']
+        if not isinstance(self.bitarray.bytes, bytearray):
+            # memory mapped bits cannot be pickled.
+            d['bitarray'] = self.bitarray.copy()
         return d
 
     def __setstate__(self, d):
@@ -311,6 +469,14 @@ class ScalableBloomFilter(object):
         """
         if key in self:
             return True
+        filter = self._get_filter()
+        filter.add(key, skip_check=True)
+        return False
+
+    def _get_filter(self):
+        """return the filter to which new keys are added. Adds a new filter if the
+        last filter is at capacity.
+        """
         if not self.filters:
             filter = BloomFilter(
                 capacity=self.initial_capacity,
@@ -323,8 +489,42 @@ class ScalableBloomFilter(object):
                     capacity=filter.capacity * self.scale,
                     error_rate=filter.error_rate * self.ratio)
                 self.filters.append(filter)
-        filter.add(key, skip_check=True)
-        return False
+        return filter
+
+    def contains_many(self, keys):
+        """Tests the membership of all the keys. Returns a boolean array.
+        """
+        if not is_int_keys(keys):
+            return [key in self for key in keys]
+        found = numpy.zeros(len(keys), dtype=bool)
+        for f in self.filters:
+            found |= f.contains_many(keys)
+        return found
+
+    def add_many(self, keys):
+        """Adds all the keys to this bloom filter. Returns boolean array, True if the
+        key already exists in this filter before adding the keys.
+
+        >>> b = ScalableBloomFilter(initial_capacity=100, error_rate=0.001, \
+                                    mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        >>> found = b.add_many(list(range(1000)))
+        >>> list(map(bool, b.add_many([10, 1001])))
+        [True, False]
+        >>> len(b.filters) > 1
+        True
+
+        """
+        if not is_int_keys(keys):
+            return [self.add(key) for key in keys]
+        keys = numpy.asarray(keys)
+        found = self.contains_many(keys)
+        newkeys = keys[~found]
+        while len(newkeys) > 0:
+            filter = self._get_filter()
+            room = max(1, filter.capacity - filter.count)
+            filter.add_many(newkeys[:room])
+            newkeys = newkeys[room:]
+        return found
 
     @property
     def capacity(self):
@@ -0,0 +1,413 @@
+'''
+fastlexers.py
+Fast lexers for the languages scanned most often (C, C++, Java, C# and Python). A fast lexer
+runs the rules of the Pygments lexer, but each state of the lexer is compiled into 'master'
+regular expressions (alternatives of the state rules in the same order) and the rules which
+can match are selected from the first character at the current position. Pygments tries the
+rules of the current state one by one, hence it is many times slower.
+
+Since the alternatives are tried in the rule order and the state transitions, rule actions
+(e.g. 'bygroups') and error handling are same as the Pygments 'RegexLexer', the fast lexers emit
+exactly the same (charpos, token type, value) stream as Pygments 'get_tokens_unprocessed'.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+'''
+
+import re
+import threading
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+from pygments.lexer import RegexLexer
+from pygments.lexers.c_cpp import CFamilyLexer
+from pygments.token import Keyword, Name, Error, Whitespace, _TokenType
+
+__all__ = ['FastLexer', 'FAST_LEXERS', 'get_fast_lexer']
+
+# name of the fast lexer is the Pygments lexer name with this suffix. (e.g. token cache keys
+# are different for the tokens created by fast lexer)
+FAST_SUFFIX = ' (fast)'
+
+# names of the Pygments lexers which have a fast lexer
+FAST_LEXERS = frozenset(['C', 'C++', 'Java', 'C#', 'Python'])
+
+# rules are selected by the character code at the current position. Codes above 127 share one
+# entry and there is one more entry for the end of the text
+NON_ASCII = 128
+END_OF_TEXT = 129
+ASCII_CHARS = frozenset(range(NON_ASCII))
+CATEGORY_CHARS = [('DIGIT', r'\d'), ('SPACE', r'\s'), ('WORD', r'\w'), ('LINEBREAK', r'\n')]
+
+# rules with back references or named groups are not combined with other rules
+BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P[=<]|\(\?\(')
+LEADING_FLAGS = re.compile(r'\(\?([aiLmsux]+)\)')
+
+
+class _AnyChar(Exception):
+    '''
+    raised when the first characters of a regular expression can not be computed
+    '''
+    pass
+
+
+def _category_chars(category):
+    negate = '_NOT_' in category
+    for suffix, regex in CATEGORY_CHARS:
+        if category.endswith(suffix):
+            chars = frozenset(c for c in ASCII_CHARS if re.match(regex, chr(c)))
+            return ASCII_CHARS - chars if negate else chars
+    return ASCII_CHARS
+
+
+def _ignore_case(chars):
+    variants = [ord(v) for c in chars for v in (chr(c).lower(), chr(c).upper())]
+    return chars | frozenset(v for v in variants if v < NON_ASCII)
+
+
+def _first_of_sequence(items, ignorecase, dotall):
+    '''
+    return (ascii chars, non ascii, nullable) for the sequence of parsed regex items
+    '''
+    chars = frozenset()
+    nonascii = False
+    for op, arg in items:
+        first, nonasc, nullable = _first_of_item(op, arg, ignorecase, dotall)
+        chars = chars | first
+        nonascii = nonascii or nonasc
+        if not nullable:
+            return chars, nonascii, False
+    return chars, nonascii, True
+
+
+def _first_of_set(items, ignorecase):
+    chars = frozenset()
+    nonascii = False
+    negate = False
+    for op, arg in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            if arg < NON_ASCII:
+                chars = chars | frozenset([arg])
+            else:
+                nonascii = True
+        elif op is sre_constants.RANGE:
+            low, high = arg
+            chars = chars | frozenset(range(low, min(high, NON_ASCII - 1) + 1))
+            nonascii = nonascii or high >= NON_ASCII
+        elif op is sre_constants.CATEGORY:
+            chars = chars | _category_chars(str(arg))
+            nonascii = True
+        else:
+            raise _AnyChar()
+    if negate:
+        # with ignore case, a negated set may still match a case variant of its characters
+        return ASCII_CHARS if ignorecase else ASCII_CHARS - chars, True, False
+    if ignorecase:
+        return _ignore_case(chars), True, False
+    return chars, nonascii, False
+
+
+def _first_of_item(op, arg, ignorecase, dotall):
+    if op is sre_constants.LITERAL:
+        if arg >= NON_ASCII:
+            return (ASCII_CHARS if ignorecase else frozenset()), True, False
+        if ignorecase:
+            return _ignore_case(frozenset([arg])), True, False
+        return frozenset([arg]), False, False
+    if op is sre_constants.NOT_LITERAL:
+        return ASCII_CHARS, True, False
+    if op is sre_constants.ANY:
+        return (ASCII_CHARS if dotall else ASCII_CHARS - frozenset([ord('\n')])), True, False
+    if op is sre_constants.IN:
+        return _first_of_set(arg, ignorecase)
+    if op is sre_constants.SUBPATTERN:
+        group, addflags, delflags, items = arg
+        if addflags & sre_constants.SRE_FLAG_IGNORECASE:
+            ignorecase = True
+        if delflags & sre_constants.SRE_FLAG_IGNORECASE:
+            ignorecase = False
+        if addflags & sre_constants.SRE_FLAG_DOTALL:
+            dotall = True
+        if delflags & sre_constants.SRE_FLAG_DOTALL:
+            dotall = False
+        return _first_of_sequence(items, ignorecase, dotall)
+    if op is sre_constants.BRANCH:
+        chars = frozenset()
+        nonascii = False
+        nullable = False
+        for items in arg[1]:
+            first, nonasc, null = _first_of_sequence(items, ignorecase, dotall)
+            chars = chars | first
+            nonascii = nonascii or nonasc
+            nullable = nullable or null
+        return chars, nonascii, nullable
+    if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) or \
+            op is getattr(sre_constants, 'POSSESSIVE_REPEAT', None):
+        low, high, items = arg
+        chars, nonascii, nullable = _first_of_sequence(items, ignorecase, dotall)
+        return chars, nonascii, nullable or low == 0
+    if op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+        return _first_of_sequence(arg, ignorecase, dotall)
+    if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        # zero width (the characters after the assertion are matched by the next item)
+        return frozenset(), False, True
+    raise _AnyChar()
+
+
+def first_chars(pattern, flags=0):
+    '''
+    return the set of character codes (NON_ASCII for all codes above 127) with which a match of
+    the regular expression can start or None if the match can be empty or the set can not be
+    computed. The set may contain more characters than the regex can actually match.
+    '''
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+        flags = parsed.state.flags
+        chars, nonascii, nullable = _first_of_sequence(list(parsed), bool(flags & re.IGNORECASE),
+                                                       bool(flags & re.DOTALL))
+    except (_AnyChar, RecursionError):
+        return None
+    if nullable:
+        return None
+    if nonascii:
+        chars = chars | frozenset([NON_ASCII])
+    return chars
+
+
+def _scoped_pattern(pattern):
+    '''
+    leading global flags (e.g. '(?i)') can not be used inside the master regex. Convert them to
+    the scoped flags (e.g. '(?i:...)')
+    '''
+    leadingflags = LEADING_FLAGS.match(pattern)
+    if leadingflags is not None:
+        return '(?%s:%s)' % (leadingflags.group(1), pattern[leadingflags.end():])
+    return pattern
+
+
+def _is_combinable(regex, flags):
+    '''
+    check if the compiled rule regex matches the same text inside the master regex
+    '''
+    pattern = regex.pattern
+    if pattern == '':
+        return True
+    if BACKREFERENCE.search(pattern) is not None:
+        return False
+    leadingflags = LEADING_FLAGS.match(pattern)
+    try:
+        inlineflags = re.compile('(?%s)' % leadingflags.group(1)).flags if leadingflags else 0
+        scopedflags = re.compile(_scoped_pattern(pattern), flags).flags
+    except re.error:
+        return False
+    return regex.flags == scopedflags | inlineflags
+
+
+def _compile_rules(rules, flags):
+    '''
+    compile the list of Pygments rules (rexmatch, action, new state) into the list of blocks.
+    A block is (match function, rules) where the rules are tried in the order by the master
+    regex of the block. Rules which can not be combined are blocks of one rule.
+    '''
+    blocks = list()
+    pending = list()
+
+    def add_pending():
+        if len(pending) == 1:
+            blocks.append((pending[0][0], tuple(pending)))
+        elif len(pending) > 1:
+            regex = '|'.join('(?P<r%d>%s)' % (index, _scoped_pattern(rule[0].__self__.pattern))
+                             for index, rule in enumerate(pending))
+            blocks.append((re.compile(regex, flags).match, tuple(pending)))
+        del pending[:]
+
+    for rule in rules:
+        if _is_combinable(rule[0].__self__, flags):
+            pending.append(rule)
+        else:
+            add_pending()
+            blocks.append((rule[0], (rule,)))
+    add_pending()
+    return blocks
+
+
+class CompiledStates(object):
+    '''
+    compiled states of the Pygments token definitions. Each state is a table of blocks for every
+    character code (see NON_ASCII and END_OF_TEXT) and the blocks contain only the rules which
+    can match at that character. Tables are filled when the state and the character are seen
+    first time (most of the lexers have many states which are rarely used).
+    '''
+
+    def __init__(self, tokendefs, flags):
+        self.tokendefs = tokendefs
+        self.flags = flags
+        self.tables = dict((state, [None] * (END_OF_TEXT + 1)) for state in tokendefs)
+        self.firstchars = dict()
+        self.blockscache = dict()
+        self.lock = threading.Lock()
+
+    def get_blocks(self, state, code):
+        with self.lock:
+            rules = self.tokendefs[state]
+            if state not in self.firstchars:
+                self.firstchars[state] = [first_chars(rule[0].__self__.pattern, rule[0].__self__.flags)
+                                          for rule in rules]
+            candidates = tuple(rule for rule, chars in zip(rules, self.firstchars[state])
+                               if chars is None or code in chars)
+            key = tuple(id(rule) for rule in candidates)
+            if key not in self.blockscache:
+                self.blockscache[key] = _compile_rules(candidates, self.flags)
+            blocks = self.blockscache[key]
+            self.tables[state][code] = blocks
+        return blocks
+
+
+# compiled states keyed by the id of the Pygments token definitions ('_tokens'). Lexers of a
+# language share the token definitions (CompiledStates keeps them alive, hence the id is valid)
+_COMPILED_STATES = dict()
+_COMPILED_STATES_LOCK = threading.Lock()
+
+
+def _compiled_states(pyglexer):
+    tokendefs = pyglexer._tokens
+    with _COMPILED_STATES_LOCK:
+        compiled = _COMPILED_STATES.get(id(tokendefs))
+        if compiled is None:
+            compiled = CompiledStates(tokendefs, pyglexer.flags)
+            _COMPILED_STATES[id(tokendefs)] = compiled
+    return compiled
+
+
+class FastLexer(object):
+    '''
+    runs the rules of Pygments RegexLexer 'pyglexer' using the compiled states.
+    '''
+
+    def __init__(self, pyglexer):
+        self.pyglexer = pyglexer
+        self.name = pyglexer.name + FAST_SUFFIX
+        self.states = _compiled_states(pyglexer)
+
+    def __repr__(self):
+        return '<FastLexer %s>' % self.name
+
+    def get_tokens_unprocessed(self, text, stack=('root',)):
+        '''
+        yields (charpos, token type, value) tuples for the whole text
+        '''
+        pyglexer = self.pyglexer
+        if not isinstance(pyglexer, CFamilyLexer):
+            return self.get_regex_tokens(text, stack)
+        return self.get_cfamily_tokens(text, stack)
+
+    def get_cfamily_tokens(self, text, stack):
+        '''
+        C and C++ lexers change the type of the standard library and platform types (same as
+        CFamilyLexer.get_tokens_unprocessed)
+        '''
+        pyglexer = self.pyglexer
+        for index, token, value in self.get_regex_tokens(text, stack):
+            if token is Name:
+                if pyglexer.stdlibhighlighting and value in pyglexer.stdlib_types:
+                    token = Keyword.Type
+                elif pyglexer.c99highlighting and value in pyglexer.c99_types:
+                    token = Keyword.Type
+                elif pyglexer.c11highlighting and value in pyglexer.c11_atomic_types:
+                    token = Keyword.Type
+                elif pyglexer.platformhighlighting and value in pyglexer.linux_types:
+                    token = Keyword.Type
+            yield index, token, value
+
+    def get_regex_tokens(self, text, stack=('root',)):
+        '''
+        same as RegexLexer.get_tokens_unprocessed. Only the rules which can match at the current
+        character are tried and the rules are matched together by the master regex.
+        '''
+        pyglexer = self.pyglexer
+        states = self.states
+        tables = states.tables
+        pos = 0
+        end = len(text)
+        statestack = list(stack)
+        statetable = tables[statestack[-1]]
+        while 1:
+            if pos < end:
+                code = ord(text[pos])
+                if code > NON_ASCII:
+                    code = NON_ASCII
+            else:
+                code = END_OF_TEXT
+            blocks = statetable[code]
+            if blocks is None:
+                blocks = states.get_blocks(statestack[-1], code)
+            for match, rules in blocks:
+                m = match(text, pos)
+                if m:
+                    if len(rules) > 1:
+                        rexmatch, action, new_state = rules[int(m.lastgroup[1:])]
+                        if action is not None and type(action) is not _TokenType:
+                            # callbacks use the groups of the rule regex
+                            m = rexmatch(text, pos)
+                    else:
+                        rexmatch, action, new_state = rules[0]
+                    if action is not None:
+                        if type(action) is _TokenType:
+                            yield pos, action, m.group()
+                        else:
+                            yield from action(pyglexer, m)
+                    pos = m.end()
+                    if new_state is not None:
+                        # state transition
+                        if isinstance(new_state, tuple):
+                            for state in new_state:
+                                if state == '#pop':
+                                    if len(statestack) > 1:
+                                        statestack.pop()
+                                elif state == '#push':
+                                    statestack.append(statestack[-1])
+                                else:
+                                    statestack.append(state)
+                        elif isinstance(new_state, int):
+                            # pop, but keep at least one state on the stack
+                            if abs(new_state) >= len(statestack):
+                                del statestack[1:]
+                            else:
+                                del statestack[new_state:]
+                        elif new_state == '#push':
+                            statestack.append(statestack[-1])
+                        statetable = tables[statestack[-1]]
+                    break
+            else:
+                # no rule matched
+                if pos >= end:
+                    break
+                if text[pos] == '\n':
+                    # at EOL, reset state to "root"
+                    statestack = ['root']
+                    statetable = tables['root']
+                    yield pos, Whitespace, '\n'
+                else:
+                    yield pos, Error, text[pos]
+                pos += 1
+
+
+def get_fast_lexer(pyglexer):
+    '''
+    return the fast lexer for the given Pygments lexer or None if there is no fast lexer for
+    its language
+    '''
+    if pyglexer is None or pyglexer.name not in FAST_LEXERS:
+        return None
+    if not isinstance(pyglexer, RegexLexer):
+        return None
+    return FastLexer(pyglexer)
@@ -0,0 +1,182 @@
+'''
+filecontent.py
+Shared source file content service for all the tools (CDD, TTC, CCOM, wc_survey, depends etc).
+Files are memory mapped and decoded (utf-8, invalid bytes ignored) only once. Recently used
+files are kept in a size bounded LRU cache, hence a file read by the tokenizer is not read again
+while creating the reports.
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+'''
+
+import os
+import mmap
+import codecs
+from collections import OrderedDict
+
+from .filelist import make_uncpath
+
+__all__ = ['FileContent', 'FileContentCache', 'FILE_CONTENTS', 'read_source', 'read_source_chunks']
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # maximum size of the (mapped and decoded) files in cache
+DEFAULT_MAX_FILES = 256  # maximum number of files kept open (memory mapped) by the cache
+STREAM_CHUNK_SIZE = 1024 * 1024  # number of bytes read at a time by 'read_source_chunks'
+
+
+class FileContent(object):
+    '''
+    memory mapped content of one source file. Decoded text is computed on first use.
+    '''
+
+    def __init__(self, filename, encoding='utf-8', errors='ignore'):
+        self.filename = filename
+        self.path = make_uncpath(filename)
+        self.encoding = encoding
+        self.errors = errors
+        self._text = None
+        with open(self.path, 'rb') as srcfile:
+            stat = os.fstat(srcfile.fileno())
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+            # empty file cannot be memory mapped
+            self.data = b''
+            if stat.st_size > 0:
+                self.data = mmap.mmap(srcfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def text(self):
+        '''
+        decoded content of the file
+        '''
+        if self._text is None:
+            # decoded directly from the mapped buffer (without copying it in a bytes object)
+            self._text = str(self.data, self.encoding, self.errors)
+        return self._text
+
+    def size(self):
+        '''
+        approximate memory used by the content (mapped bytes and decoded characters)
+        '''
+        size = len(self.data)
+        if self._text is not None:
+            size = size + len(self._text)
+        return size
+
+    def is_modified(self):
+        stat = os.stat(self.path)
+        return self.stamp != (stat.st_mtime_ns, stat.st_size)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b''
+        self._text = None
+
+
+class FileContentCache(object):
+    '''
+    FileContent objects of the recently used files. Content is read again if the file is
+    modified. Least recently used files are removed when there are more than 'maxfiles' files
+    or their total size is more than 'maxbytes'. Removed content is not closed explicitly
+    (other objects may still be using it); it is released when it is no longer referenced.
+    '''
+
+    def __init__(self, maxbytes=DEFAULT_MAX_BYTES, maxfiles=DEFAULT_MAX_FILES):
+        self.maxbytes = maxbytes
+        self.maxfiles = maxfiles
+        self.contents = OrderedDict()  # file name -> FileContent
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.contents)
+
+    def get(self, filename):
+        '''
+        return the FileContent of the file
+        '''
+        content = self.contents.pop(filename, None)
+        if content is not None and content.is_modified():
+            content.close()
+            content = None
+        if content is None:
+            self.misses = self.misses + 1
+            content = FileContent(filename)
+        else:
+            self.hits = self.hits + 1
+        self.contents[filename] = content
+        return content
+
+    def get_text(self, filename):
+        '''
+        return the decoded content of the file
+        '''
+        text = self.get(filename).text
+        self.trim()
+        return text
+
+    def trim(self):
+        '''
+        remove the least recently used files till the cache is within its limits. Most recently
+        used file is always kept.
+        '''
+        size = sum(content.size() for content in self.contents.values())
+        while len(self.contents) > 1 and (len(self.contents) > self.maxfiles or size > self.maxbytes):
+            size = size - self.contents.popitem(last=False)[1].size()
+
+    def invalidate(self, filename):
+        '''
+        close the file (e.g. before modifying it) and remove its content
+        '''
+        content = self.contents.pop(filename, None)
+        if content is not None:
+            content.close()
+
+    def clear(self):
+        while self.contents:
+            self.contents.popitem()[1].close()
+
+
+# file contents shared by all the tokenizers and reports of this process
+FILE_CONTENTS = FileContentCache()
+
+
+def read_source(filename):
+    '''
+    return the decoded source of the file. Equivalent to reading the file with
+    codecs.open(filename, 'rb', encoding='utf-8', errors='ignore')
+    '''
+    return FILE_CONTENTS.get_text(filename)
+
+
+def read_source_chunks(filename, chunksize=STREAM_CHUNK_SIZE, limit=None):
+    '''
+    yields the decoded source of the file in line aligned chunks of about 'chunksize' bytes (a
+    chunk is longer only to complete its last line). If 'limit' is given, only the complete
+    lines in the first 'limit' bytes are read. Chunks are not kept in the cache, hence the
+    memory used does not depend on the size of the file. Concatenation of the chunks is same as
+    'read_source' text.
+    '''
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    numbytes = 0
+    with open(make_uncpath(filename), 'rb') as srcfile:
+        while limit is None or numbytes < limit:
+            size = chunksize if limit is None else min(chunksize, limit - numbytes)
+            block = srcfile.read(size)
+            if not block:
+                break
+            numbytes = numbytes + len(block)
+            if limit is None or numbytes < limit:
+                block = block + srcfile.readline()
+                numbytes = numbytes + len(block) - size
+            elif not block.endswith(b'\n') and srcfile.read(1):
+                # incomplete last line within the limit
+                block = block[:block.rfind(b'\n') + 1]
+            text = decoder.decode(block)
+            if text:
+                yield text
+        text = decoder.decode(b'', True)
+        if text:
+            yield text
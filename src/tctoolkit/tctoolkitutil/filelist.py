@@ -16,8 +16,21 @@ import string
 import logging
 import sys
 import platform
+import struct
+import tempfile
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 
-__all__ = ['DirFileLister', 'FindFileInPathList', 'make_uncpath', 'make_nonunc_path','PreparePygmentsFileList']
+__all__ = ['DirFileLister', 'DirSnapshot', 'FindFileInPathList', 'make_uncpath', 'make_nonunc_path','PreparePygmentsFileList']
+
+SNAPSHOT_MAGIC = b'TCDS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sII')  # magic, version, number of directories
+SNAPSHOT_RECORD = struct.Struct('<qII')  # mtime (ns), number of subdirectories, number of files
+
+# fnmatch pattern which matches the end of the file name (e.g. '*.py'). Such patterns are matched
+# with the file name, without joining it with the directory path.
+SUFFIX_PATTERN = re.compile(r'\*([^*?\[\]/\\]*)$')
 
 __UNC_PREFIX = "\\\\?\\"
 __IS_WINDOWS = False
@@ -25,17 +38,122 @@ __IS_WINDOWS = False
 if platform.system() == 'Windows' :
     __IS_WINDOWS = True
 
+class DirSnapshot(object):
+
+    '''
+    subdirectories and files of the directories scanned earlier, keyed by directory path. Entry
+    of a directory is used only if its modification time is not changed (i.e. no file or
+    subdirectory is added, removed or renamed), hence only the modified directories are scanned
+    again.
+    Snapshot file is a header followed by one record per directory. A record is the mtime and
+    counts, lengths of the names (directory path, subdirectory names and file names) and the
+    UTF-8 encoded names.
+    '''
+
+    def __init__(self):
+        self.entries = dict()  # directory path -> (mtime, subdirectory names, file names)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path, mtime):
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry
+        return None
+
+    def update(self, path, entry):
+        self.entries[path] = entry
+
+    @classmethod
+    def load(cls, snapshotfile):
+        '''
+        load the snapshot saved earlier. Returns an empty snapshot if the file is not there,
+        it was saved by a different version or it is corrupted.
+        '''
+        snapshot = cls()
+        try:
+            with open(snapshotfile, 'rb') as snapf:
+                data = snapf.read()
+        except (IOError, OSError) as exp:
+            logging.info("unable to load directory snapshot %s : %s" % (snapshotfile, exp))
+            return snapshot
+        try:
+            snapshot.entries = snapshot._decode(data)
+        except (ValueError, struct.error, UnicodeDecodeError) as exp:
+            logging.warning("invalid directory snapshot %s : %s" % (snapshotfile, exp))
+        return snapshot
+
+    def save(self, snapshotfile, paths=None):
+        '''
+        save the snapshot. If 'paths' is given, only the entries of those directories are saved
+        (e.g. directories scanned in the current run). Snapshot is written to a temporary file
+        first and then renamed.
+        '''
+        if paths is not None:
+            self.entries = dict((path, self.entries[path]) for path in paths if path in self.entries)
+        snapdir = os.path.dirname(os.path.abspath(snapshotfile))
+        fd, tmppath = tempfile.mkstemp(dir=snapdir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as snapf:
+                snapf.write(self._encode())
+            os.replace(tmppath, snapshotfile)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    def _encode(self):
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.entries))]
+        for path, (mtime, dirs, files) in self.entries.items():
+            names = [name.encode('utf-8', 'surrogatepass') for name in [path] + list(dirs) + list(files)]
+            lengths = array('I', [len(name) for name in names])
+            parts.extend([SNAPSHOT_RECORD.pack(mtime, len(dirs), len(files)), lengths.tobytes(),
+                          b''.join(names)])
+        return b''.join(parts)
+
+    def _decode(self, data):
+        magic, version, numdirs = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("unsupported directory snapshot version")
+        offset = SNAPSHOT_HEADER.size
+        entries = dict()
+        for i in range(numdirs):
+            mtime, numsubdirs, numfiles = SNAPSHOT_RECORD.unpack_from(data, offset)
+            offset = offset + SNAPSHOT_RECORD.size
+            lengths = array('I')
+            nbytes = (1 + numsubdirs + numfiles) * lengths.itemsize
+            lengths.frombytes(data[offset:offset + nbytes])
+            if len(lengths) != 1 + numsubdirs + numfiles:
+                raise ValueError("truncated directory snapshot")
+            offset = offset + nbytes
+            names = list()
+            for length in lengths:
+                if offset + length > len(data):
+                    raise ValueError("truncated directory snapshot")
+                names.append(data[offset:offset + length].decode('utf-8', 'surrogatepass'))
+                offset = offset + length
+            entries[names[0]] = (mtime, names[1:1 + numsubdirs], names[1 + numsubdirs:])
+        if offset != len(data):
+            raise ValueError("unexpected data at the end of directory snapshot")
+        return entries
+
+
 class DirFileLister(object):
 
     '''
     creates list of files for given directory. Matching file pattern or all files handled by pygments
-    or files specific to a language etc
+    or files specific to a language etc. Directories are scanned (with os.scandir) one level at a
+    time. Directories of a level are scanned in parallel if 'threads' is more than 1 (e.g. on
+    network file systems). If 'snapshotfile' is given, the directory snapshot is loaded from it
+    and saved back after the scan.
     '''
     IGNOREDIRS = set(['.svn', '.cvs', '.hg', '.git'])
 
-    def __init__(self, dirname, exclude_dirs=[]):
+    def __init__(self, dirname, exclude_dirs=[], threads=1, snapshotfile=None):
         self.dirname = dirname
         self.exclude_dirs = exclude_dirs
+        self.threads = threads
+        self.snapshotfile = snapshotfile
         assert exclude_dirs != None
         if isinstance(self.exclude_dirs, str):
             # exclude_dirs is not unicode then convert it to unicode using the
@@ -66,29 +184,100 @@ class DirFileLister(object):
         dirs2 = list(set(dirs) - set(self.exclude_dirs))
         dirs[:] = dirs2
 
-    def getFileList(self):
+    def scanDir(self, path, snapshot=None):
         '''
-        return list of files (including files in subdirectories)
+        return (mtime, subdirectory names, file names) of the directory or None if it cannot be
+        read. Like os.walk, symbolic links to directories are not in the file names and are not
+        followed. Entry from the snapshot is returned if the directory is not modified.
         '''
-        rawfilelist = []
-        # prepare list of all files ignore the directories defined in
-        # 'ignoredirs' list.
-
-        def errfunc(err):
+        try:
+            # modification time is read before the scan. Hence the changes during the scan
+            # are found in the next scan.
+            mtime = os.stat(path).st_mtime_ns
+            if snapshot is not None:
+                entry = snapshot.get(path, mtime)
+                if entry is not None:
+                    return entry
+            dirs = []
+            files = []
+            with os.scandir(path) as direntries:
+                for direntry in direntries:
+                    try:
+                        isdir = direntry.is_dir()
+                    except OSError:
+                        isdir = False
+                    if not isdir:
+                        files.append(direntry.name)
+                    elif not direntry.is_symlink():
+                        dirs.append(direntry.name)
+        except OSError as err:
             logging.warn(err)
             print(err)
+            return None
+        return (mtime, dirs, files)
 
-        #find out the absolute path for the given directory name.
-        dirname = self.dirname
-        dirname  = make_uncpath(dirname)
+    def walk(self):
+        '''
+        yields (directory path, file names) for the directory and its subdirectories (top down,
+        subdirectories in sorted order). Directory paths are in UNC format on Windows.
+        '''
+        snapshot = None
+        if self.snapshotfile:
+            snapshot = DirSnapshot.load(self.snapshotfile)
 
+        #find out the absolute path for the given directory name.
+        dirname = make_uncpath(self.dirname)
         logging.info("Searching file list in directory %s" % dirname)
 
-        for root, dirs, files in os.walk(dirname, topdown=True, onerror=errfunc):
-            self.RemoveIgnoreDirs(dirs)
-            self.RemoveExcludedDirs(dirs)
+        scans = dict()  # directory path -> (mtime, subdirectories to search, file names)
+        level = [dirname]
+        pool = ThreadPoolExecutor(self.threads) if self.threads > 1 else None
+        try:
+            while level:
+                if pool is not None:
+                    entries = pool.map(self.scanDir, level, [snapshot] * len(level))
+                else:
+                    entries = [self.scanDir(path, snapshot) for path in level]
+                nextlevel = []
+                for path, entry in zip(level, entries):
+                    if entry is None:
+                        continue
+                    if snapshot is not None:
+                        snapshot.update(path, entry)
+                    mtime, dirs, files = entry
+                    dirs = list(dirs)
+                    self.RemoveIgnoreDirs(dirs)
+                    self.RemoveExcludedDirs(dirs)
+                    dirs = [os.path.join(path, subdir) for subdir in sorted(dirs)]
+                    scans[path] = (mtime, dirs, files)
+                    nextlevel.extend(dirs)
+                level = nextlevel
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if snapshot is not None:
+            snapshot.save(self.snapshotfile, scans.keys())
+
+        stack = [dirname]
+        while stack:
+            path = stack.pop()
+            if path not in scans:
+                continue
+            logging.info("searching directory %s" % make_nonunc_path(path))
+            mtime, dirs, files = scans[path]
+            yield path, files
+            stack.extend(reversed(dirs))
+
+    def getFileList(self):
+        '''
+        return list of files (including files in subdirectories)
+        '''
+        # prepare list of all files ignore the directories defined in
+        # 'ignoredirs' list.
+        rawfilelist = []
+        for root, files in self.walk():
             root = make_nonunc_path(root)
-            logging.info("searching directory %s" % root)
             for fname in files:
                 rawfilelist.append(os.path.join(root, fname))
         return(rawfilelist)
@@ -102,16 +291,31 @@ class DirFileLister(object):
             # pattern is a single string. Make it into a list
             patterns = [patterns]
 
-        # combine the match patterns to a single regex
-        matchregex = '|'.join([fnmatch.translate(pat) for pat in patterns])
-        matchregex = re.compile(matchregex)
-
-        rawfilelist = self.getFileList()
+        # patterns like '*.py' are checked with the file name (without joining it with the
+        # directory path). Other patterns are combined to a single regex matched with full path.
+        suffixes = []
+        fullpatterns = []
+        for pat in patterns:
+            suffix = SUFFIX_PATTERN.match(pat)
+            if suffix is not None:
+                suffixes.append(suffix.group(1))
+            else:
+                fullpatterns.append(pat)
+        suffixes = tuple(suffixes)
+        matchregex = None
+        if fullpatterns:
+            matchregex = re.compile('|'.join([fnmatch.translate(pat) for pat in fullpatterns]))
 
         filelist = []
-        for fname in rawfilelist:
-            if (matchregex.match(fname) != None):
-                filelist.append(fname)
+        for root, files in self.walk():
+            root = make_nonunc_path(root)
+            for fname in files:
+                if fname.endswith(suffixes):
+                    filelist.append(os.path.join(root, fname))
+                elif matchregex is not None:
+                    fname = os.path.join(root, fname)
+                    if (matchregex.match(fname) != None):
+                        filelist.append(fname)
         return(filelist)
 
     def getPygmentsFiles(self):
@@ -0,0 +1,161 @@
+'''
+lexerregistry.py
+Registry of the Pygments lexers used by the source code tokenizers. Lexer lookups (by language
+name or by file extension) are cached, including the failed lookups. If the extension is not
+known, the lexer can be guessed from the file content (e.g. scripts without extension), if the
+caller asks for it. Lookups are cached by extension, except for the files without extension and
+the file names which Pygments matches by name (e.g. 'Makefile', 'CMakeLists.txt'), those are
+cached by file name. Every thread gets its own lexer instances, hence the files can be tokenized
+in thread pools. (Process pools get their own copy of the registry.)
+
+Copyright (C) 2019 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+'''
+
+import os
+import re
+import fnmatch
+import threading
+
+from pygments.lexers import get_lexer_for_filename, get_lexer_by_name, guess_lexer, get_all_lexers
+from pygments.lexers.special import TextLexer
+from pygments.util import ClassNotFound
+
+__all__ = ['LexerRegistry', 'LEXERS']
+
+SNIFF_SIZE = 4096  # number of characters used for guessing the lexer from the file content
+# Pygments file name pattern which depends only on the file extension (e.g. '*.py')
+EXTENSION_PATTERN = re.compile(r'\*\.[^.*?\[\]]+$')
+
+
+def filename_patterns():
+    '''
+    return the regex matching the file names for which Pygments lexer depends on more than the
+    extension (e.g. 'Makefile', 'Makefile.*', 'CMakeLists.txt', '*.html.j2')
+    '''
+    patterns = [fnmatch.translate(pattern) for lexer in get_all_lexers() for pattern in lexer[2]
+                if not EXTENSION_PATTERN.match(pattern)]
+    return re.compile('|'.join(patterns) or '(?!)')
+
+
+class LexerRegistry(object):
+    '''
+    cache of the lexer lookups. Lookup results are stored as (lexer class, options) shared by
+    all threads; None is stored for the failed lookups. Lexer instances are created per thread.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # ('lang', name), ('ext', extension) or ('name', file name) -> (class, options) or None.
+        # ('noguess', extension) for the extensions whose content did not look like code.
+        self.lookups = dict()
+        self.filenames = None  # regex of file names matched by name (see filename_patterns)
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        if hasattr(os, 'register_at_fork'):
+            # lock may be held by some other thread at the time of fork.
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self.lock = threading.Lock()
+
+    def _lookup(self, key, find_lexer):
+        '''
+        return the cached (lexer class, options) for the key. 'find_lexer' is called (and the
+        result is cached) only on the first lookup of the key.
+        '''
+        with self.lock:
+            if key in self.lookups:
+                self.hits = self.hits + 1
+                return self.lookups[key]
+        try:
+            lexer = find_lexer()
+            found = (type(lexer), lexer.options)
+        except ClassNotFound:
+            found = None
+        with self.lock:
+            self.misses = self.misses + 1
+            return self.lookups.setdefault(key, found)
+
+    def _instance(self, key, found):
+        '''
+        return the lexer instance of the current thread for the lookup result
+        '''
+        if found is None:
+            return None
+        instances = getattr(self.local, 'instances', None)
+        if instances is None:
+            instances = dict()
+            self.local.instances = instances
+        lexer = instances.get(key)
+        if lexer is None:
+            lexercls, options = found
+            lexer = lexercls(**options)
+            instances[key] = lexer
+        return lexer
+
+    def get_lexer_for_lang(self, lang):
+        '''
+        return the lexer for the language (Pygments short name) or None if it is not supported
+        '''
+        key = ('lang', lang)
+        found = self._lookup(key, lambda: get_lexer_by_name(lang, encoding='utf-8'))
+        return self._instance(key, found)
+
+    def get_lexer_for_file(self, filename, read_content=None):
+        '''
+        return the lexer for the file based on its extension. If the extension is not known and
+        'read_content' function is given, the lexer is guessed from the start of the file
+        content. Returns None if no lexer is found. Once the content of a file does not look like
+        code, other files with the same extension are not read again (files without extension
+        are always read).
+        '''
+        basename = os.path.basename(filename)
+        name, extension = os.path.splitext(basename)
+        if self.filenames is None:
+            self.filenames = filename_patterns()
+        if not extension or self.filenames.match(basename):
+            # lexer depends on the file name (e.g. 'Makefile' or 'README')
+            key = ('name', basename)
+        else:
+            key = ('ext', extension)
+        found = self._lookup(key, lambda: get_lexer_for_filename(filename, stripall=True,
+                                                                 encoding='utf-8'))
+        if found is None and read_content is not None:
+            noguesskey = ('noguess', extension)
+            with self.lock:
+                if noguesskey in self.lookups:
+                    self.hits = self.hits + 1
+                    return None
+            lexer = self.guess_lexer(read_content(filename))
+            if lexer is None and extension:
+                with self.lock:
+                    self.lookups[noguesskey] = None
+            return lexer
+        return self._instance(key, found)
+
+    def guess_lexer(self, content):
+        '''
+        guess the lexer from the content. Returns None if content does not look like code of
+        any language. Guessed lexers are not cached since they depend on the content.
+        '''
+        try:
+            lexer = guess_lexer(content[:SNIFF_SIZE], stripall=True, encoding='utf-8')
+        except ClassNotFound:
+            return None
+        if isinstance(lexer, TextLexer):
+            return None
+        return self._instance(('guess', type(lexer)), (type(lexer), lexer.options))
+
+    def clear(self):
+        with self.lock:
+            self.lookups.clear()
+        self.local = threading.local()
+
+
+# lexers shared by all the tokenizers of this process
+LEXERS = LexerRegistry()
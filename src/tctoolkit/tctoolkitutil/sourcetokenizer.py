@@ -11,49 +11,159 @@ New BSD License: http://www.opensource.org/licenses/bsd-license.php
 TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 '''
 import os.path
-import codecs
+import logging
 
-from pygments.lexers import get_lexer_for_filename, get_lexer_by_name, get_all_lexers
+from pygments.lexers import get_all_lexers
 from pygments.filter import simplefilter
 from pygments.token import Token
+from .filecontent import read_source, read_source_chunks
 from .filelist import make_uncpath
+from .lexerregistry import LEXERS, SNIFF_SIZE
+from .fastlexers import get_fast_lexer
+
+# 'fast' backend uses the fast lexers for the languages supported by them (Pygments for others)
+TOKENIZER_BACKENDS = ['pygments', 'fast']
+# policies for the files larger than the maximum file size. 'skip' ignores the file, 'sample'
+# tokenizes only the lines in the first 'maximum file size' bytes and 'stream' tokenizes the
+# whole file in chunks.
+LARGE_FILE_POLICIES = ['skip', 'sample', 'stream']
+# tokens starting in the last STREAM_OVERLAP characters of a chunk are lexed again with the next
+# chunk. Hence tokens (e.g. comments) crossing the chunk boundary are found correctly, if they
+# are shorter than this.
+STREAM_OVERLAP = 64 * 1024
+
+
+class TokenizerOptions(object):
+    '''
+    options of the source code tokenizers. Options are given to every tokenizer (and are sent to
+    the worker processes with the tokenizer arguments), hence they do not depend on the state of
+    the process creating the tokenizer.
+    backend : tokenizer backend ('pygments' or 'fast'). 'fast' uses the fast lexers for the
+        languages supported by them. Lexers returned by 'get_lexer_for_lang' and
+        'get_lexer_for_file' (e.g. used for syntax highlighting) are always Pygments lexers.
+    max_file_size : files larger than this (in bytes, None for no limit) use the large file
+        policy ('skip', 'sample' or 'stream'). The memory used for reading the larger files does
+        not depend on their size.
+    sniff : if True, lexer of the files with unknown extension is guessed from the file content.
+        Off by default, since the guessed files are analyzed too (and every such file is read).
+    '''
+
+    def __init__(self, backend='pygments', max_file_size=None, large_file_policy='stream',
+                 sniff=False):
+        assert backend in TOKENIZER_BACKENDS, "unknown tokenizer backend %s" % backend
+        assert large_file_policy in LARGE_FILE_POLICIES, "unknown large file policy %s" % large_file_policy
+        self.backend = backend
+        self.max_file_size = max_file_size
+        self.large_file_policy = large_file_policy
+        self.sniff = sniff
+
+
+def read_source_head(filename):
+    '''
+    return the first few lines of the source (used for guessing the lexer of the file)
+    '''
+    for chunk in read_source_chunks(filename, chunksize=SNIFF_SIZE):
+        return chunk
+    return ''
+
+
+def is_after_blank_line(text, charpos, ttype, value):
+    '''
+    check if the token starts after a blank line (at start of the line or in its indentation)
+    or it is a whitespace containing a blank line
+    '''
+    if ttype in Token.Text and value.count('\n') > 1 and value.strip() == '':
+        return True
+    lineend = text.rfind('\n', 0, charpos)
+    return lineend > 0 and text[lineend + 1:charpos].strip() == '' and \
+        text[text.rfind('\n', 0, lineend) + 1:lineend].strip() == ''
+
+
+def stream_tokens(lexer, chunks):
+    '''
+    yields (charpos, token type, value) tuples for the text made of line aligned 'chunks'. Text
+    is lexed in pieces. A piece ends after a blank line (outside strings and comments and with
+    the lowest brace nesting level) before the last STREAM_OVERLAP characters of the text.
+    (Most of the lexers start in the same state after a blank line between two functions.)
+    Rest of the text is lexed again with the next chunk.
+    '''
+    offset = 0  # charpos of the start of 'text'
+    text = ''
+    for chunk in chunks:
+        text = text + chunk
+        limit = len(text) - STREAM_OVERLAP
+        if limit <= 0:
+            continue
+        tokens = list(lexer.get_tokens_unprocessed(text))
+        cut = 0
+        cutdepth = 0
+        depth = 0  # nesting level of the braces
+        lastpos = 0  # last token start within limit
+        prevtype = None
+        for charpos, ttype, value in tokens:
+            if charpos > limit:
+                break
+            if charpos > 0 and (cut == 0 or depth <= cutdepth) and \
+                    is_after_blank_line(text, charpos, ttype, value) and \
+                    not (ttype in Token.Literal.String or ttype in Token.Comment or
+                         prevtype in Token.Literal.String or prevtype in Token.Comment):
+                cut = charpos
+                cutdepth = depth
+            if ttype in Token.Punctuation or ttype in Token.Operator:
+                depth = max(0, depth + value.count('{') - value.count('}'))
+            lastpos = charpos
+            prevtype = ttype
+        if cut == 0:
+            if limit < STREAM_OVERLAP:
+                # read more text to find a blank line
+                continue
+            # no blank line in a long text (e.g. generated tables)
+            cut = lastpos if lastpos > 0 else len(text)
+        for charpos, ttype, value in tokens:
+            if charpos >= cut:
+                break
+            yield charpos + offset, ttype, value
+        text = text[cut:]
+        offset = offset + cut
+    for charpos, ttype, value in lexer.get_tokens_unprocessed(text):
+        yield charpos + offset, ttype, value
+
 
 class SourceToken(object):
 
     '''
-    present one source code token. Use __slots__ to reduce the size of each object instance
+    present one source code token. Use __slots__ to reduce the size of each object instance.
+    Stripped value and number of new lines are computed once, when the token is created, since
+    the tokenizers read them several times for every token.
     '''
-    __slots__ = ['rawvalue', 'ttype', 'charpos']
+    __slots__ = ['rawvalue', 'ttype', 'charpos', 'value', 'num_lines']
 
     def __init__(self, ttype, value, charpos=None):
         self.ttype = ttype
         self.rawvalue = value
         self.charpos = charpos
+        self.value = value.strip()
+        self.num_lines = value.count('\n')
 
     def is_type(self, oftype):
         return self.ttype in oftype
 
-    @property
-    def value(self):
-        return self.rawvalue.strip()
-
-    @property
-    def num_lines(self):
-        return self.rawvalue.count('\n')
-
 
 class SourceCodeTokenizer(object):
 
     '''
     tokenizing the source files
     '''
-    __LEXERS_CACHE = dict()  # dictionary of lexers keyed by file extensions
 
-    def __init__(self, srcfile, lang=None, token_class=SourceToken):
+    def __init__(self, srcfile, lang=None, token_class=SourceToken, options=None):
         '''
         override the token_class if you want to use a drived class of 'SourceToken' class.
+        'options' is the TokenizerOptions (default options if it is None).
         '''
         self.srcfile = srcfile
+        if options is None:
+            options = TokenizerOptions()
+        self.options = options
         self.tokenlist = None
         self.lang = lang  # programming language.
         assert issubclass(
@@ -77,17 +187,40 @@ class SourceCodeTokenizer(object):
 
         if pyglexer != None:
             prevtoken = None
-            fname = make_uncpath(self.srcfile)
-            with codecs.open(fname, "rb", encoding='utf-8', errors='ignore') as code:
-                for charpos, ttype, value in pyglexer.get_tokens_unprocessed(code.read()):
-                    # NOTE : do not call 'strip' on the 'value' variable.
-                    # if derived class wants to calculate line numbers, the 'strip' call will screw up
-                    # the line number computation.
-                    srctoken = self.TOKEN_CLASS(ttype, value, charpos)
-                    self.update_type(srctoken, prevtoken)
-                    yield srctoken
-                    if srctoken.value != '':
-                        prevtoken = srctoken
+            for charpos, ttype, value in self._lex(pyglexer):
+                # NOTE : do not call 'strip' on the 'value' variable.
+                # if derived class wants to calculate line numbers, the 'strip' call will screw up
+                # the line number computation.
+                srctoken = self.TOKEN_CLASS(ttype, value, charpos)
+                self.update_type(srctoken, prevtoken)
+                yield srctoken
+                if srctoken.value != '':
+                    prevtoken = srctoken
+
+    def _lex(self, lexer):
+        '''
+        return the iterator over (charpos, token type, value) tuples of the source file, as per
+        the read policy of the file.
+        '''
+        policy = self.read_policy()
+        if policy == 'whole':
+            # source is read (and decoded) through the shared file content cache
+            return lexer.get_tokens_unprocessed(read_source(self.srcfile))
+        if policy == 'skip':
+            logging.info("%s skipped : larger than %d bytes" % (self.srcfile, self.options.max_file_size))
+            return iter([])
+        limit = self.options.max_file_size if policy == 'sample' else None
+        return stream_tokens(lexer, read_source_chunks(self.srcfile, limit=limit))
+
+    def read_policy(self):
+        '''
+        return how the source file is tokenized. 'whole' if it is not larger than the maximum
+        file size, otherwise the large file policy ('skip', 'sample' or 'stream').
+        '''
+        max_size = self.options.max_file_size
+        if max_size is None or os.path.getsize(make_uncpath(self.srcfile)) <= max_size:
+            return 'whole'
+        return self.options.large_file_policy
 
     def ignore_token(self, srctoken):
         return False
@@ -116,7 +249,9 @@ class SourceCodeTokenizer(object):
             lexer = SourceCodeTokenizer.get_lexer_for_lang(self.lang)
             assert(lexer != None)
         else:
-            lexer = SourceCodeTokenizer.get_lexer_for_file(self.srcfile)
+            lexer = SourceCodeTokenizer.get_lexer_for_file(self.srcfile, self.options.sniff)
+        if self.options.backend == 'fast':
+            lexer = get_fast_lexer(lexer) or lexer
         return lexer
 
     @classmethod
@@ -124,38 +259,15 @@ class SourceCodeTokenizer(object):
         '''
         get the lexer for the given language.
         '''
-        pyglexer = SourceCodeTokenizer.__LEXERS_CACHE.get(lang, None)
-
-        if(lang not in SourceCodeTokenizer.__LEXERS_CACHE):
-            try:
-                pyglexer = get_lexer_by_name(lang, encoding='utf-8')
-                SourceCodeTokenizer.__LEXERS_CACHE[lang] = pyglexer
-            except:
-                # ignore the lexer not found exceptions
-                assert(pyglexer == None)
-
-        return pyglexer
+        return LEXERS.get_lexer_for_lang(lang)
 
     @classmethod
-    def get_lexer_for_file(selfcls, filename):
+    def get_lexer_for_file(selfcls, filename, sniff=False):
         '''
-        search lexer in the lexers list first based on the file extension.
-        if it not there then call the get_lexer_for_filename
+        get the lexer based on the file extension (lookups are cached in the lexer registry).
+        If the extension is not known and 'sniff' is True, lexer is guessed from the file content.
         '''
-        name, extension = os.path.splitext(filename)
-        pyglexer = SourceCodeTokenizer.__LEXERS_CACHE.get(extension, None)
-
-        if(extension not in SourceCodeTokenizer.__LEXERS_CACHE):
-            try:
-                pyglexer = get_lexer_for_filename(
-                    filename, stripall=True, encoding='utf-8')
-                SourceCodeTokenizer.__LEXERS_CACHE[extension] = pyglexer
-            except:
-                # ignore the lexer not found exceptions
-                assert(pyglexer == None)
-                pass
-
-        return pyglexer
+        return LEXERS.get_lexer_for_file(filename, read_source_head if sniff else None)
 
     @classmethod
     def is_lang_supported(selfcls, lang):
@@ -15,7 +15,7 @@ TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 import logging
 
 from .filelist import DirFileLister
-from .sourcetokenizer import SourceCodeTokenizer
+from .sourcetokenizer import SourceCodeTokenizer, TokenizerOptions, TOKENIZER_BACKENDS, LARGE_FILE_POLICIES
 
 
 class TCApp(object):
@@ -32,6 +32,7 @@ class TCApp(object):
         self.options = []
         self.args = []
         self.filelist = None
+        self.tokenizer_options = TokenizerOptions()
         self.addDefaultOptions()
 
     def prog_name(self):
@@ -50,6 +51,20 @@ class TCApp(object):
                                   help="outfile name. Output to stdout if not specified")
         self.optparser.add_option("-l", "--lang", dest="lang", default=None,
                                   help="programming language. Pattern will be ignored if language is defined.")
+        self.optparser.add_option("", "--tokenizer", dest="tokenizer", default='pygments', type="choice",
+                                  choices=TOKENIZER_BACKENDS,
+                                  help="tokenizer backend (%s). 'fast' uses the built-in fast lexers for C, C++, Java, C# and Python and Pygments for other languages. Default is 'pygments'" % '|'.join(TOKENIZER_BACKENDS))
+        self.optparser.add_option("", "--max-file-size", dest="max_file_size", default=None, type="int",
+                                  help="maximum size of a source file in KB. Larger files are handled as per the large file policy. Default is no limit")
+        self.optparser.add_option("", "--large-file-policy", dest="large_file_policy", default='stream', type="choice",
+                                  choices=LARGE_FILE_POLICIES,
+                                  help="policy for the files larger than maximum file size (%s). 'skip' ignores the file, 'sample' tokenizes only the lines in the first 'max-file-size' KB and 'stream' tokenizes the file in chunks. Default is 'stream'" % '|'.join(LARGE_FILE_POLICIES))
+        self.optparser.add_option("", "--sniff-lexer", dest="sniff_lexer", default=False, action="store_true",
+                                  help="guess the language of the files with unknown extension from the file content. Such files are analyzed too. Default is off")
+        self.optparser.add_option("", "--scan-threads", dest="scan_threads", default=1, type="int",
+                                  help="number of threads used for scanning the directories (e.g. on network file systems). Default is 1")
+        self.optparser.add_option("", "--dir-snapshot", dest="dir_snapshot", default=None,
+                                  help="directory snapshot file. Only the directories modified after the snapshot are scanned again. Snapshot is updated after the scan")
 
     def parse_args(self):
         self.options, self.args = self.optparser.parse_args()
@@ -62,6 +77,13 @@ class TCApp(object):
             self.lang = self.options.lang
             self.pattern = self.options.pattern
             self.outfile = self.options.outfile
+            max_file_size = self.options.max_file_size
+            if max_file_size is not None:
+                max_file_size = max_file_size * 1024
+            # options are given to the tokenizers explicitly (also in the worker processes)
+            self.tokenizer_options = TokenizerOptions(self.options.tokenizer, max_file_size,
+                                                      self.options.large_file_policy,
+                                                      self.options.sniff_lexer)
             success = False
             if self.options.log == True:
                 logging.basicConfig(filename='%s.log' %
@@ -85,7 +107,8 @@ class TCApp(object):
         '''
         if self.filelist == None or self.dirname != dirname:
             self.dirname = dirname
-            filelister = DirFileLister(self.dirname, exclude_dirs)
+            filelister = DirFileLister(self.dirname, exclude_dirs, threads=self.options.scan_threads,
+                                       snapshotfile=self.options.dir_snapshot)
 
             # first add all names into the set
             self.filelist = filelister.getFilesForPatternOrLang(
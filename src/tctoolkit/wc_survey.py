@@ -35,8 +35,8 @@ class SignatureTokenizer(SourceCodeTokenizer):
     tokenize to return only the class names from the source file
     '''
 
-    def __init__(self, srcfile, lang):
-        super(SignatureTokenizer, self).__init__(srcfile, lang=lang)
+    def __init__(self, srcfile, lang, options=None):
+        super(SignatureTokenizer, self).__init__(srcfile, lang=lang, options=options)
         self.acceptable_values = set(["{", "}", ";", "'", '"'])
 
     def ignore_token(self, srctoken):
@@ -76,7 +76,7 @@ class WCSignatureSurvey(TCApp):
         for fname in self.getFileList(self.args[0]):
             print("Analyzing file %s" % fname)
 
-            tokenizer = SignatureTokenizer(fname, self.lang)
+            tokenizer = SignatureTokenizer(fname, self.lang, self.tokenizer_options)
             with closing(six.StringIO()) as signature:
 
                 for srctoken in tokenizer: